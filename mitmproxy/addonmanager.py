@@ -114,6 +114,9 @@ class AddonManager:
         self.lookup = {}
         self.chain = []
         self.master = master
+        # Event name -> handlers that may run outside of the event loop.
+        # Only ever populated from the event loop, see handle_lifecycle.
+        self._inline = {}
         master.options.changed.connect(self._configure_all)
 
     def _configure_all(self, options, updated):
@@ -127,6 +130,7 @@ class AddonManager:
             self.invoke_addon(a, "done")
         self.lookup = {}
         self.chain = []
+        self._inline = {}
 
     def get(self, name):
         """
@@ -160,6 +164,7 @@ class AddonManager:
         for a in traverse([addon]):
             self.master.commands.collect_commands(a)
         self.master.options.process_deferred()
+        self._inline = {}
         return addon
 
     def add(self, *addons):
@@ -184,6 +189,7 @@ class AddonManager:
                 raise exceptions.AddonManagerError("No such addon: %s" % n)
             self.chain = [i for i in self.chain if i is not a]
             del self.lookup[_get_name(a)]
+        self._inline = {}
         self.invoke_addon(addon, "done")
 
     def __len__(self):
@@ -204,14 +210,66 @@ class AddonManager:
             raise exceptions.ControlException(
                 "Message %s has no reply attribute" % message
             )
+        for n in (name, "update"):
+            if n not in self._inline:
+                self._inline[n] = self._inline_handlers(n)
+        self._dispatch(name, message, self.trigger)
 
+    def handle_lifecycle_inline(self, name, message):
+        """
+            Handle a lifecycle event on the calling thread instead of the
+            event loop. This is only possible if no addon implements the event,
+            or if all implementations are marked as thread-safe.
+
+            Returns:
+                False if the event has to be dispatched to the event loop.
+        """
+        inline = self._inline
+        handlers = {name: inline.get(name)}
+        if isinstance(message, flow.Flow):
+            handlers["update"] = inline.get("update")
+        if any(h is None for h in handlers.values()):
+            return False
+
+        def trigger(name, *args):
+            for funcs in handlers[name]:
+                try:
+                    with safecall():
+                        for func in funcs:
+                            func(*args)
+                except exceptions.AddonHalt:
+                    return
+
+        self._dispatch(name, message, trigger)
+        return True
+
+    def _inline_handlers(self, name):
+        """
+            Collect the handlers for an event, grouped by top-level addon, if
+            all of them are marked as thread-safe. Returns None otherwise.
+        """
+        groups = []
+        for i in self.chain:
+            funcs = []
+            for a in traverse([i]):
+                func = getattr(a, name, None)
+                if not func or isinstance(func, types.ModuleType):
+                    continue
+                if getattr(func, "threadsafe", False) is not True:
+                    return None
+                funcs.append(func)
+            if funcs:
+                groups.append(funcs)
+        return groups
+
+    def _dispatch(self, name, message, trigger):
         # We can use DummyReply objects multiple times. We only clear them up on
         # the next handler so that we can access value and state in the
         # meantime.
         if isinstance(message.reply, controller.DummyReply):
             message.reply.reset()
 
-        self.trigger(name, message)
+        trigger(name, message)
 
         if message.reply.state == "start":
             message.reply.take()
@@ -223,7 +281,7 @@ class AddonManager:
                 message.reply.mark_reset()
 
         if isinstance(message, flow.Flow):
-            self.trigger("update", [message])
+            trigger("update", [message])
 
     def invoke_addon(self, addon, name, *args, **kwargs):
         """
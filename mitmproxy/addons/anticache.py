@@ -1,4 +1,5 @@
 from mitmproxy import ctx
+from mitmproxy.script import threadsafe
 
 
 class AntiCache:
@@ -11,6 +12,7 @@ class AntiCache:
             """
         )
 
+    @threadsafe
     def request(self, flow):
         if ctx.options.anticache:
             flow.request.anticache()
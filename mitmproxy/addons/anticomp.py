@@ -1,4 +1,5 @@
 from mitmproxy import ctx
+from mitmproxy.script import threadsafe
 
 
 class AntiComp:
@@ -8,6 +9,7 @@ class AntiComp:
             "Try to convince servers to send us un-compressed data."
         )
 
+    @threadsafe
     def request(self, flow):
         if ctx.options.anticomp:
             flow.request.anticomp()
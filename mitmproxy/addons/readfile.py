@@ -5,6 +5,7 @@ import typing
 
 from mitmproxy import ctx
 from mitmproxy import exceptions
+from mitmproxy import flow
 from mitmproxy import flowfilter
 from mitmproxy import io
 from mitmproxy import command
@@ -27,6 +28,10 @@ class ReadFile:
             "readfile_filter", typing.Optional[str], None,
             "Read only matching flows."
         )
+        loader.add_option(
+            "readfile_processes", int, 1,
+            "Number of processes decoding the flows read from file in parallel."
+        )
 
     def configure(self, updated):
         if "readfile_filter" in updated:
@@ -38,15 +43,14 @@ class ReadFile:
                         "Invalid readfile filter: %s" % ctx.options.readfile_filter
                     )
             self.filter = filt
+        if "readfile_processes" in updated and ctx.options.readfile_processes < 1:
+            raise exceptions.OptionsError("readfile_processes must be positive.")
 
-    async def load_flows(self, fo: typing.IO[bytes]) -> int:
+    async def _load_flows(self, flows: typing.AsyncGenerator[flow.Flow, None]) -> int:
         cnt = 0
-        freader = io.FlowReader(fo)
         try:
-            for flow in freader.stream():
-                if self.filter and not self.filter(flow):
-                    continue
-                await ctx.master.load_flow(flow)
+            async for f in flows:
+                await ctx.master.load_flow(f)
                 cnt += 1
         except (IOError, exceptions.FlowReadException) as e:
             if cnt:
@@ -56,12 +60,30 @@ class ReadFile:
             raise exceptions.FlowReadException(str(e)) from e
         else:
             return cnt
+        finally:
+            # Stop reading right away if loading a flow fails.
+            await flows.aclose()
+
+    async def load_flows(self, fo: typing.IO[bytes], index: typing.Optional[io.FlowIndex] = None) -> int:
+        async def flows():
+            for f in io.FlowReader(fo).filtered(self.filter, index):
+                yield f
+        return await self._load_flows(flows())
+
+    async def load_flows_parallel(self, path: str, index: typing.Optional[io.FlowIndex] = None) -> int:
+        reader = io.ParallelFlowReader(path, ctx.options.readfile_processes, self.filter, index)
+        return await self._load_flows(reader.stream_async())
 
     async def load_flows_from_path(self, path: str) -> int:
         path = os.path.expanduser(path)
         try:
             with open(path, "rb") as f:
-                return await self.load_flows(f)
+                # An index of the file spares reading flows the filter rules out.
+                index = io.FlowIndex.open(path, io.FlowReader(f)) if self.filter else None
+                f.seek(0)
+                if ctx.options.readfile_processes > 1:
+                    return await self.load_flows_parallel(path, index)
+                return await self.load_flows(f, index)
         except IOError as e:
             ctx.log.error("Cannot load flows: {}".format(e))
             raise exceptions.FlowReadException(str(e)) from e
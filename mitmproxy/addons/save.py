@@ -14,6 +14,7 @@ class Save:
     def __init__(self):
         self.stream = None
         self.filt = None
+        self.write_index = False
         self.active_flows: typing.Set[flow.Flow] = set()
 
     def load(self, loader):
@@ -25,6 +26,14 @@ class Save:
             "save_stream_filter", typing.Optional[str], None,
             "Filter which flows are written to file."
         )
+        loader.add_option(
+            "save_index", bool, False,
+            """
+            Write an index next to flow files, with the suffix .idx. With an
+            index, reading flows with a filter only reads the flows that may
+            match. Appending to a file without an index does not create one.
+            """
+        )
 
     def open_file(self, path):
         if path.startswith("+"):
@@ -35,15 +44,40 @@ class Save:
         path = os.path.expanduser(path)
         return open(path, mode)
 
+    def open_index(self, path) -> typing.Optional[io.FlowIndex]:
+        """
+            An index for the flows written to path, or None if no index should
+            be written.
+        """
+        if not self.write_index:
+            return None
+        if not path.startswith("+"):
+            return io.FlowIndex()
+        path = os.path.expanduser(path[1:])
+        if not os.path.exists(path):
+            return io.FlowIndex()
+        with open(path, "rb") as f:
+            return io.FlowIndex.open(path, io.FlowReader(f))
+
+    def save_index(self, f, index: typing.Optional[io.FlowIndex]) -> None:
+        if index is not None:
+            try:
+                index.save(f.name)
+            except IOError as e:
+                ctx.log.warn("Cannot write flow index: {}".format(e))
+
     def start_stream_to_path(self, path, flt):
         try:
+            index = self.open_index(path)
             f = self.open_file(path)
         except IOError as v:
             raise exceptions.OptionsError(str(v))
-        self.stream = io.FilteredFlowWriter(f, flt)
+        self.stream = io.FilteredFlowWriter(f, flt, index)
         self.active_flows = set()
 
     def configure(self, updated):
+        if "save_index" in updated:
+            self.write_index = ctx.options.save_index
         # We're already streaming - stop the previous stream and restart
         if "save_stream_filter" in updated:
             if ctx.options.save_stream_filter:
@@ -67,13 +101,15 @@ class Save:
             appended to the file, otherwise it is over-written.
         """
         try:
+            index = self.open_index(path)
             f = self.open_file(path)
         except IOError as v:
             raise exceptions.CommandError(v) from v
-        stream = io.FlowWriter(f)
+        stream = io.FlowWriter(f, index)
         for i in flows:
             stream.add(i)
         f.close()
+        self.save_index(f, index)
         ctx.log.alert("Saved %s flows." % len(flows))
 
     def tcp_start(self, flow):
@@ -109,4 +145,5 @@ class Save:
                 self.stream.add(f)
             self.active_flows = set([])
             self.stream.fo.close()
+            self.save_index(self.stream.fo, self.stream.index)
             self.stream = None
@@ -4,6 +4,7 @@ import typing
 
 from mitmproxy import ctx
 from mitmproxy import flow
+from mitmproxy import flowfilter
 from mitmproxy import exceptions
 from mitmproxy import io
 from mitmproxy import command
@@ -84,7 +85,7 @@ class ServerPlayback:
     @command.command("replay.server.file")
     def load_file(self, path: mitmproxy.types.Path) -> None:
         try:
-            flows = io.read_flows_from_paths([path])
+            flows = io.read_flows_from_paths([path], flowfilter.FResp())
         except exceptions.FlowReadException as e:
             raise exceptions.CommandError(str(e))
         self.load_flows(flows)
@@ -168,7 +169,7 @@ class ServerPlayback:
         if not self.configured and ctx.options.server_replay:
             self.configured = True
             try:
-                flows = io.read_flows_from_paths(ctx.options.server_replay)
+                flows = io.read_flows_from_paths(ctx.options.server_replay, flowfilter.FResp())
             except exceptions.FlowReadException as e:
                 raise exceptions.OptionsError(str(e))
             self.load_flows(flows)
@@ -1,32 +1,195 @@
 import collections
+import concurrent.futures
+import hashlib
+import itertools
+import re
 import tempfile
 import asyncio
 import typing
-import bisect
 import shutil
 import sqlite3
+import sre_constants
+import sre_parse
+import threading
 import copy
+import time
 import os
+import zlib
+
+import sortedcontainers
 
 from mitmproxy import flowfilter
 from mitmproxy import types
 from mitmproxy import http
 from mitmproxy import ctx
 from mitmproxy.io import protobuf
+from mitmproxy import exceptions
 from mitmproxy.exceptions import SessionLoadException, CommandError
+from mitmproxy.net.http import encoding
+from mitmproxy.net.http.message import LazyContent
+from mitmproxy.utils import strutils
 from mitmproxy.utils.data import pkg_data
 
 
-class KeyifyList(object):
-    def __init__(self, inner, key):
-        self.inner = inner
-        self.key = key
+class FilterQuery:
+    """
+    Splits a flow filter into an SQL condition over the indexed columns of the
+    flow table and a residual filter, so that only flows the condition cannot
+    rule out have to be deserialized and matched in Python. A flow matches the
+    filter if it matches both parts; either part may be None.
+    """
+    # Columns searched by the expression of a filter. The filter matches if any column does.
+    rex_columns: typing.Dict[type, typing.Tuple[str, ...]] = {
+        flowfilter.FMethod: ("method",),
+        flowfilter.FDomain: ("host", "pretty_host"),
+        flowfilter.FUrl: ("pretty_url",),
+        flowfilter.FContentType: ("request_content_type", "response_content_type"),
+        flowfilter.FContentTypeRequest: ("request_content_type",),
+        flowfilter.FContentTypeResponse: ("response_content_type",),
+    }
+    # Columns holding one header value per line.
+    multiline_columns = {"request_content_type", "response_content_type"}
+    # Indexed columns, and whether their index ignores case. An expression anchored at the
+    # start narrows these down to a range of the index.
+    range_columns = {"method": True, "host": True, "pretty_host": True, "pretty_url": False}
+    # Full-text indexed columns containing whatever the expression of a filter matches.
+    fts_columns: typing.Dict[type, typing.Tuple[str, ...]] = {
+        flowfilter.FBod: ("request", "response"),
+        flowfilter.FBodRequest: ("request",),
+        flowfilter.FBodResponse: ("response",),
+        flowfilter.FUrl: ("url",),
+    }
+    # The session only stores HTTP flows.
+    constants = {
+        flowfilter.FHTTP: "1",
+        flowfilter.FTCP: "0",
+        flowfilter.FWebSocket: "0",
+        flowfilter.FReq: "status_code IS NULL",
+        flowfilter.FResp: "status_code IS NOT NULL",
+        flowfilter.FErr: "error IS NOT NULL",
+    }
 
-    def __len__(self):
-        return len(self.inner)
+    def __init__(self, flt: typing.Optional[flowfilter.TFilter], fts: bool = False) -> None:
+        self.fts = fts
+        self.rexes: typing.List[flowfilter._Rex] = []
+        if flt is None:
+            self.where, self.residual = None, None
+        else:
+            self.where, self.residual = self._translate(flt)
 
-    def __getitem__(self, k):
-        return self.key(self.inner[k])
+    def _translate(self, flt):
+        if type(flt) in self.constants:
+            return self.constants[type(flt)], None
+        if isinstance(flt, flowfilter.FCode):
+            return "status_code = %d" % flt.num, None
+        if type(flt) in self.rex_columns:
+            self.rexes.append(flt)
+            where = " OR ".join(
+                "flowfilter_search(%d, %s, %d)" % (len(self.rexes) - 1, col, col in self.multiline_columns)
+                for col in self.rex_columns[type(flt)]
+            )
+            candidates = [c for c in (self._match_range(flt), self._match_fts(flt)) if c is not None]
+            return " AND ".join(["(%s)" % c for c in candidates] + ["(%s)" % where]), None
+        if type(flt) in self.fts_columns:
+            # The index only narrows down the candidates, the expression itself is matched in Python.
+            return self._match_fts(flt), flt
+        if isinstance(flt, flowfilter.FAnd):
+            parts = [self._translate(i) for i in flt.lst]
+            where = [w for w, _ in parts if w is not None]
+            residual = [r for _, r in parts if r is not None]
+            return (
+                " AND ".join("(%s)" % w for w in where) if where else None,
+                flowfilter.FAnd(residual) if len(residual) > 1 else next(iter(residual), None)
+            )
+        if isinstance(flt, flowfilter.FOr):
+            parts = [self._translate(i) for i in flt.lst]
+            if all(w is not None and r is None for w, r in parts):
+                return " OR ".join("(%s)" % w for w, _ in parts), None
+        if isinstance(flt, flowfilter.FNot):
+            where, residual = self._translate(flt.itm)
+            if where is not None and residual is None:
+                # A comparison with NULL yields NULL, whose negation would not match either.
+                return "NOT IFNULL(%s, 0)" % where, None
+        return None, flt
+
+    @staticmethod
+    def required_literal(pattern: typing.Union[str, bytes]) -> typing.Optional[str]:
+        """
+        The longest printable ASCII string every match of the pattern contains, if any.
+        """
+        try:
+            # The stubs only know of str patterns.
+            parsed: typing.Any = sre_parse.parse(pattern)  # type: ignore
+        except (sre_constants.error, TypeError):
+            return None
+        best, run = "", ""
+        for op, av in list(parsed) + [(None, None)]:
+            if op is sre_constants.LITERAL and 0x20 <= av < 0x7f:
+                run += chr(av)
+            else:
+                best = max(best, run, key=len)
+                run = ""
+        return best or None
+
+    @staticmethod
+    def anchored_prefix(pattern: typing.Union[str, bytes]) -> typing.Optional[str]:
+        """
+        The printable ASCII string every match of a pattern anchored with ^ starts with, if any.
+        """
+        try:
+            parsed: typing.Any = sre_parse.parse(pattern)  # type: ignore
+        except (sre_constants.error, TypeError):
+            return None
+        items = list(parsed)
+        if not items or items[0] != (sre_constants.AT, sre_constants.AT_BEGINNING):
+            return None
+        prefix = ""
+        for op, av in items[1:]:
+            if op is not sre_constants.LITERAL or not 0x20 <= av < 0x7f:
+                break
+            prefix += chr(av)
+        return prefix or None
+
+    def _match_range(self, flt: flowfilter._Rex) -> typing.Optional[str]:
+        columns = self.rex_columns[type(flt)]
+        if not all(c in self.range_columns for c in columns):
+            return None
+        prefix = self.anchored_prefix(flt.re.pattern)
+        if prefix is None:
+            return None
+        ranges = []
+        for col in columns:
+            nocase = self.range_columns[col]
+            if flt.re.flags & re.IGNORECASE and not nocase:
+                return None
+            # NOCASE compares ASCII letters in lower case.
+            start = prefix.lower() if nocase else prefix
+            end = start[:-1] + chr(ord(start[-1]) + 1)
+            collate = " COLLATE NOCASE" if nocase else ""
+            ranges.append("{col} >= '{start}'{collate} AND {col} < '{end}'{collate}".format(
+                col=col, start=start.replace("'", "''"), end=end.replace("'", "''"), collate=collate
+            ))
+        return " OR ".join("(%s)" % r for r in ranges)
+
+    def _match_fts(self, flt: flowfilter._Rex) -> typing.Optional[str]:
+        if not self.fts or type(flt) not in self.fts_columns:
+            return None
+        literal = self.required_literal(flt.re.pattern)
+        # The trigram tokenizer cannot look up anything shorter.
+        if literal is None or len(literal) < 3:
+            return None
+        query = '{%s} : "%s"' % (" ".join(self.fts_columns[type(flt)]), literal.replace('"', '""'))
+        return "f.rowid IN (SELECT rowid FROM flow_fts WHERE flow_fts MATCH '%s')" % query.replace("'", "''")
+
+    def search(self, idx: int, value, multiline: int) -> bool:
+        if value is None:
+            return False
+        rex = self.rexes[idx]
+        if rex.is_binary:
+            value = strutils.always_bytes(value, "utf-8", "surrogateescape")
+        if multiline:
+            return any(rex.re.search(v) for v in value.split(b"\n" if rex.is_binary else "\n"))
+        return bool(rex.re.search(value))
 
 
 # Could be implemented using async libraries
@@ -43,20 +206,71 @@ class SessionDB:
             2: "response"
         }
     }
+    # Queryable columns of the flow table, next to the serialized flow.
+    flow_columns = {
+        "method": "VARCHAR(16)",
+        "host": "TEXT",
+        "pretty_host": "TEXT",
+        "path": "TEXT",
+        "url": "TEXT",
+        "pretty_url": "TEXT",
+        "status_code": "INTEGER",
+        "request_content_type": "TEXT",
+        "response_content_type": "TEXT",
+        "error": "TEXT",
+        "timestamp_start": "REAL",
+        "timestamp_end": "REAL",
+        "request_size": "INTEGER",
+        "response_size": "INTEGER",
+    }
+    # Indexes of earlier schemas that no query could use.
+    dropped_indexes = ("flow_method", "flow_host", "flow_path", "flow_response_content_type", "flow_timestamp_start")
+    # Codecs of stored body content
+    CODEC_RAW = 0
+    CODEC_ZLIB = 1
+    # Media types that are compressed already.
+    incompressible = re.compile(
+        r"(image/(?!svg)|video/|audio/|font/woff|application/(zip|gzip|x-gzip|zstd|x-bzip2|x-7z-compressed|pdf))",
+        re.IGNORECASE
+    )
+    # Bodies up to this size are sampled into the compression dictionary, which is
+    # created once that many bytes of them have been seen.
+    dict_sample_size = 4096
+    dict_size = 32768
+    # Optional full-text index over URLs and decoded bodies, sharing the rowid of the flow table.
+    fts_schema = "CREATE VIRTUAL TABLE flow_fts USING fts5(url, request, response, tokenize='trigram');"
 
-    def __init__(self, db_path=None):
+    def __init__(self, db_path=None, fts=False):
         """
         Connect to an already existing database,
         or create a new one with optional path.
         :param db_path:
+        :param fts: Maintain a full-text index of URLs and bodies.
         """
         self.live_components: typing.Dict[str, tuple] = {}
         self.tempdir: tempfile.TemporaryDirectory = None
         self.con: sqlite3.Connection = None
-        # This is used for fast look-ups over bodies already dumped to database.
-        # This permits to enforce one-to-one relationship between flow and body table.
-        self.body_ledger: typing.Set[str] = set()
+        # Used by store_snapshot only, which may run on a writer thread.
+        self.write_con: sqlite3.Connection = None
+        self.write_lock = threading.Lock()
+        # Incremented by clear(), so that snapshots taken before are not written after it.
+        self.generation = 0
+        # The content hash of every body in the database, by flow id and type id. Bodies are
+        # stored once per distinct content, and referenced from the body table by hash.
+        self.body_hashes: typing.Dict[typing.Tuple[str, int], str] = {}
+        # Compress stored bodies, optionally with a preset dictionary built from JSON bodies.
+        self.compress = True
+        self.compress_dict = False
+        self.dictionaries: typing.Dict[int, bytes] = {}
+        self.dict_samples: typing.List[bytes] = []
+        # Compression metrics
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
         self.id_ledger: typing.Set[str] = set()
+        # The query whose expressions flowfilter_search() evaluates.
+        self.active_query: typing.List[FilterQuery] = [FilterQuery(None)]
         if db_path is not None and os.path.isfile(db_path):
             self._load_session(db_path)
         else:
@@ -65,12 +279,16 @@ class SessionDB:
             else:
                 self.tempdir = tempfile.mkdtemp()
                 path = os.path.join(self.tempdir, 'tmp.sqlite')
-            self.con = sqlite3.connect(path)
+            self._connect(path)
             self._create_session()
+        self.fts = False
+        self.set_fts(fts)
 
     def __del__(self):
         if self.con:
             self.con.close()
+        if self.write_con:
+            self.write_con.close()
         if self.tempdir:
             shutil.rmtree(self.tempdir)
 
@@ -80,10 +298,125 @@ class SessionDB:
     def __len__(self):
         return len(self.id_ledger)
 
+    def _connect(self, path):
+        self.path = path
+        self.con = sqlite3.connect(path)
+        self.con_thread = threading.get_ident()
+        # Readers and the writer use separate connections, which do not block each other in WAL mode.
+        self.con.execute("PRAGMA journal_mode = WAL;")
+        self.con.execute("PRAGMA synchronous = NORMAL;")
+        # Register the function only once, as replacing it breaks statements sqlite has cached.
+        active = self.active_query
+        self.con.create_function(
+            "flowfilter_search", 3, lambda idx, value, multiline: active[0].search(idx, value, multiline)
+        )
+
     def _load_session(self, path):
         if not self.is_session_db(path):
             raise SessionLoadException('Given path does not point to a valid Session')
-        self.con = sqlite3.connect(path)
+        self._connect(path)
+        self._migrate()
+        self.id_ledger.update(fid for fid, in self.con.execute("SELECT id FROM flow;"))
+        self.body_hashes.update(
+            ((fid, typ), h) for fid, typ, h in self.con.execute("SELECT flow_id, type_id, hash FROM body;")
+        )
+        self.dictionaries.update(self.con.execute("SELECT id, content FROM body_dict;"))
+
+    def _table_columns(self, table: str) -> typing.Set[str]:
+        return {row[1] for row in self.con.execute(f"PRAGMA table_info({table});")}
+
+    def _migrate(self):
+        """
+        Bring sessions created with an earlier schema up to date.
+        """
+        missing = [c for c in self.flow_columns if c not in self._table_columns("flow")]
+        with self.con as con:
+            for c in missing:
+                con.execute(f"ALTER TABLE flow ADD COLUMN {c} {self.flow_columns[c]};")
+        if "hash" not in self._table_columns("body"):
+            # Bodies used to be stored with each flow, move them to content addressed storage.
+            self.con.execute("ALTER TABLE body RENAME TO body_old;")
+            self._create_session()
+            with self.con as con:
+                bodies = {}
+                for fid, typ, content in con.execute("SELECT flow_id, type_id, content FROM body_old ORDER BY id;"):
+                    bodies[(fid, typ)] = content
+                self._migrate_bodies(con, bodies)
+                con.execute("DROP TABLE body_old;")
+        with self.con as con:
+            for index in self.dropped_indexes:
+                con.execute(f"DROP INDEX IF EXISTS {index};")
+        self._create_session()
+        if "codec" not in self._table_columns("body_content"):
+            with self.con as con:
+                con.execute(f"ALTER TABLE body_content ADD COLUMN codec INTEGER NOT NULL DEFAULT {self.CODEC_RAW};")
+                con.execute("ALTER TABLE body_content ADD COLUMN dict_id INTEGER;")
+        if missing:
+            rows = [self._columns(f) + (f.id,) for f in self.retrieve_flows()]
+            assignments = ", ".join(f"{c} = ?" for c in self.flow_columns)
+            with self.con as con:
+                con.executemany(f"UPDATE flow SET {assignments} WHERE id = ?;", rows)
+
+    def _migrate_bodies(self, con, bodies: typing.Dict[typing.Tuple[str, int], bytes]) -> None:
+        """
+        Bodies used to be stored decoded, with the flow stored with its content set to b"",
+        which also set its content-length header. Store them encoded as their headers say,
+        and set the content-length to the length of the encoded body.
+        """
+        for fid in {fid for fid, _ in bodies}:
+            row = con.execute("SELECT content FROM flow WHERE id = ?;", (fid,)).fetchone()
+            if not row:
+                continue
+            flow = protobuf.loads(row[0])
+            for typ, name in self.type_mappings["body"].items():
+                message = getattr(flow, name)
+                if message and (fid, typ) in bodies:
+                    raw = self._encode_content(bodies[(fid, typ)], message.headers)
+                    self._set_body(con, fid, typ, raw, message.headers.get("content-type", ""))
+                    message.headers["content-length"] = str(len(raw))
+            con.execute("UPDATE flow SET content = ? WHERE id = ?;", (protobuf.dumps(flow), fid))
+
+    def set_fts(self, enabled: bool) -> bool:
+        """
+        Create or drop the full-text index. An index that is not maintained is dropped rather
+        than left to go stale. Returns False if this sqlite build does not support it.
+        """
+        exists = bool(self.con.execute("SELECT 1 FROM sqlite_master WHERE name = 'flow_fts';").fetchall())
+        if not enabled:
+            if exists:
+                with self.con as con:
+                    con.execute("DROP TABLE flow_fts;")
+            self.fts = False
+            return True
+        if not exists:
+            try:
+                with self.con as con:
+                    con.execute(self.fts_schema)
+            except sqlite3.OperationalError:
+                return False
+            with self.con:
+                self._index_fts(self.con, [self._fts_row(f) for f in self.retrieve_flows()])
+        self.fts = True
+        return True
+
+    @staticmethod
+    def _fts_text(message) -> str:
+        # ASCII text survives decoding as is, which is all FilterQuery looks up.
+        return message.get_content(strict=False).decode("utf-8", "replace") if message.raw_content else ""
+
+    def _fts_row(self, f) -> tuple:
+        return (
+            f.request.pretty_url,
+            self._fts_text(f.request),
+            self._fts_text(f.response) if f.response else "",
+            f.id
+        )
+
+    def _index_fts(self, con, rows):
+        con.executemany(
+            "INSERT INTO flow_fts (rowid, url, request, response) SELECT rowid, ?, ?, ? FROM flow WHERE id = ?;",
+            rows
+        )
 
     def _create_session(self):
         script_path = pkg_data.path("io/sql/session_create.sql")
@@ -143,57 +476,307 @@ class SessionDB:
                 flow.server_conn.via.rfile, flow.server_conn.via.wfile, flow.server_conn.via.reply = via
         return flow
 
+    @staticmethod
+    def _columns(flow: http.HTTPFlow) -> tuple:
+        request, response = flow.request, flow.response
+
+        def content_type(message):
+            values = message.headers.get_all("content-type")
+            return "\n".join(values) if values else None
+
+        return (
+            request.method,
+            request.host,
+            request.pretty_host,
+            request.path,
+            request.url,
+            request.pretty_url,
+            response.status_code if response else None,
+            content_type(request),
+            content_type(response) if response else None,
+            flow.error.msg if flow.error else None,
+            request.timestamp_start,
+            response.timestamp_end if response else request.timestamp_end,
+            request.data.content_size or 0,
+            (response.data.content_size or 0) if response else None,
+        )
+
     def store_flows(self, flows):
-        body_buf = []
-        flow_buf = []
+        """
+        Write flows to the database.
+        """
+        self.store_snapshot(self.snapshot(flows))
+
+    def snapshot(self, flows) -> typing.List[typing.Tuple[http.HTTPFlow, tuple]]:
+        """
+        Copy what store_snapshot writes of the flows, together with their queryable columns.
+        This must be called on the thread that modifies the flows.
+        """
+        snapshot = []
         for flow in flows:
-            self.id_ledger.add(flow.id)
             self._disassemble(flow)
             f = copy.copy(flow)
             f.request = copy.deepcopy(flow.request)
             if flow.response:
                 f.response = copy.deepcopy(flow.response)
             f.id = flow.id
-            if len(f.request.content) > self.content_threshold and f.id not in self.body_ledger:
-                body_buf.append((f.id, 1, f.request.content))
-                f.request.content = b""
-                self.body_ledger.add(f.id)
-            if f.response and f.id not in self.body_ledger:
-                if len(f.response.content) > self.content_threshold:
-                    body_buf.append((f.id, 2, f.response.content))
-                    f.response.content = b""
-            flow_buf.append((f.id, protobuf.dumps(f)))
-        self.con.executemany("INSERT OR REPLACE INTO flow VALUES(?, ?);", flow_buf)
-        if body_buf:
-            self.con.executemany("INSERT INTO body (flow_id, type_id, content) VALUES(?, ?, ?);", body_buf)
-        self.con.commit()
+            snapshot.append((f, self._columns(flow)))
+        return snapshot
+
+    def store_snapshot(
+        self,
+        snapshot: typing.List[typing.Tuple[http.HTTPFlow, tuple]],
+        generation: typing.Optional[int] = None
+    ) -> bool:
+        """
+        Write a snapshot of flows to the database in one transaction. This is safe to call
+        from a thread other than the one that created the SessionDB, but only one at a time.
+        A snapshot taken in an earlier generation, i.e. before the database was cleared, is
+        dropped. Returns whether the snapshot was written.
+        """
+        with self.write_lock:
+            if generation is not None and generation != self.generation:
+                return False
+            if not self.write_con:
+                self.write_con = sqlite3.connect(self.path, check_same_thread=False)
+            try:
+                self._store_flows(self.write_con, snapshot)
+            except Exception:
+                self._rollback(self.write_con, [f.id for f, _ in snapshot])
+                raise
+            self.id_ledger.update(f.id for f, _ in snapshot)
+        return True
+
+    def _rollback(self, con, ids: typing.List[str]) -> None:
+        """
+        Roll back a failed write, and forget the bodies and dictionaries it added.
+        """
+        con.rollback()
+        for key in [k for k in self.body_hashes if k[0] in ids]:
+            del self.body_hashes[key]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self.body_hashes.update(
+                ((fid, typ), h) for fid, typ, h in con.execute(
+                    f"SELECT flow_id, type_id, hash FROM body WHERE flow_id IN ({','.join('?' for _ in chunk)});",
+                    chunk
+                )
+            )
+        self.dictionaries = dict(con.execute("SELECT id, content FROM body_dict;"))
+
+    def _dictionary(self, con, content: bytes) -> typing.Optional[int]:
+        """
+        The id of the compression dictionary, which is built from the first small JSON bodies.
+        """
+        if self.dictionaries:
+            return max(self.dictionaries)
+        if len(content) <= self.dict_sample_size:
+            self.dict_samples.append(content)
+            if sum(len(i) for i in self.dict_samples) >= self.dict_size:
+                # zlib prefers the most common strings at the end of the dictionary.
+                zdict = b"".join(reversed(self.dict_samples))[-self.dict_size:]
+                dict_id = con.execute("INSERT INTO body_dict (content) VALUES(?);", (zdict,)).lastrowid
+                self.dictionaries[dict_id] = zdict
+                self.dict_samples = []
+                return dict_id
+        return None
+
+    def _encode_body(self, con, content: bytes, content_type: str) -> typing.Tuple[bytes, int, typing.Optional[int]]:
+        if not self.compress or self.incompressible.match(content_type):
+            return content, self.CODEC_RAW, None
+        start = time.thread_time()
+        dict_id = None
+        if self.compress_dict and "json" in content_type.lower():
+            dict_id = self._dictionary(con, content)
+        if dict_id:
+            c = zlib.compressobj(zdict=self.dictionaries[dict_id])
+            data = c.compress(content) + c.flush()
+        else:
+            data = zlib.compress(content)
+        self.compress_time += time.thread_time() - start
+        if len(data) >= len(content):
+            return content, self.CODEC_RAW, None
+        return data, self.CODEC_ZLIB, dict_id
+
+    def _decode_body(self, data: bytes, codec: int, dict_id: typing.Optional[int]) -> bytes:
+        if codec == self.CODEC_RAW:
+            return data
+        start = time.thread_time()
+        if dict_id:
+            d = zlib.decompressobj(zdict=self.dictionaries[dict_id])
+            content = d.decompress(data) + d.flush()
+        else:
+            content = zlib.decompress(data)
+        self.decompress_time += time.thread_time() - start
+        return content
+
+    def compression_stats(self) -> typing.Dict[str, float]:
+        """
+        Size of the body content written since the session was opened, before and after
+        compression, and the CPU time spent compressing and decompressing it.
+        """
+        return dict(
+            raw_bytes=self.raw_bytes,
+            stored_bytes=self.stored_bytes,
+            compression_ratio=self.raw_bytes / self.stored_bytes if self.stored_bytes else 1.0,
+            compress_time=self.compress_time,
+            decompress_time=self.decompress_time,
+        )
+
+    def _set_body(self, con, fid: str, typ: int, content: typing.Optional[bytes], content_type: str = "") -> None:
+        """
+        Point a body of a flow at the given content, or remove it if content is None.
+        Content is reference counted, and only compressed and written if it is not stored yet.
+        """
+        new = hashlib.sha256(content).hexdigest() if content is not None else None
+        old = self.body_hashes.get((fid, typ))
+        if new == old:
+            return
+        if old:
+            con.execute("DELETE FROM body WHERE flow_id = ? AND type_id = ?;", (fid, typ))
+            con.execute("UPDATE body_content SET refs = refs - 1 WHERE hash = ?;", (old,))
+            con.execute("DELETE FROM body_content WHERE hash = ? AND refs <= 0;", (old,))
+            del self.body_hashes[(fid, typ)]
+        if new:
+            if not con.execute("UPDATE body_content SET refs = refs + 1 WHERE hash = ?;", (new,)).rowcount:
+                data, codec, dict_id = self._encode_body(con, content, content_type)
+                self.raw_bytes += len(content)
+                self.stored_bytes += len(data)
+                con.execute(
+                    "INSERT INTO body_content (hash, refs, content, codec, dict_id) VALUES(?, 1, ?, ?, ?);",
+                    (new, data, codec, dict_id)
+                )
+            con.execute("INSERT INTO body (flow_id, type_id, hash) VALUES(?, ?, ?);", (fid, typ, new))
+            self.body_hashes[(fid, typ)] = new
+
+    def _store_flows(self, con, snapshot):
+        flow_buf = []
+        fts_buf = []
+        if self.fts:
+            # Replacing a flow gives it a new rowid, drop the old index entry first.
+            con.executemany(
+                "DELETE FROM flow_fts WHERE rowid = (SELECT rowid FROM flow WHERE id = ?);",
+                [(f.id,) for f, _ in snapshot]
+            )
+        for f, columns in snapshot:
+            if self.fts:
+                fts_buf.append(self._fts_row(f))
+            for typ, name in self.type_mappings["body"].items():
+                message = getattr(f, name)
+                if message and not message.data.content_loaded and (f.id, typ) in self.body_hashes:
+                    # Loaded from the session and not accessed since, the stored body is current.
+                    message.raw_content = b""
+                    continue
+                content = message.raw_content if message else None
+                # Bodies are stored as sent, so that they match their headers when loaded. The flow
+                # is serialized with its decoded content, encoded bodies are always stored here.
+                if content and (len(content) > self.content_threshold or "content-encoding" in message.headers):
+                    self._set_body(con, f.id, typ, content, message.headers.get("content-type", ""))
+                    message.raw_content = b""
+                else:
+                    self._set_body(con, f.id, typ, None)
+            flow_buf.append((f.id, protobuf.dumps(f)) + columns)
+        names = ", ".join(self.flow_columns)
+        placeholders = ", ".join("?" for _ in self.flow_columns)
+        con.executemany(
+            f"INSERT OR REPLACE INTO flow (id, content, {names}) VALUES(?, ?, {placeholders});", flow_buf
+        )
+        if self.fts:
+            self._index_fts(con, fts_buf)
+        con.commit()
 
     def retrieve_flows(self, ids=None):
+        if not ids:
+            return self._load_flows()
+        return self._load_flows(f"f.id IN ({','.join(['?' for _ in range(len(ids))])})", ids)
+
+    def _load_flows(self, where=None, params=()):
         flows = []
         with self.con as con:
-            if not ids:
-                sql = "SELECT f.content, b.type_id, b.content " \
-                      "FROM flow f " \
-                      "LEFT OUTER JOIN body b ON f.id = b.flow_id;"
-                rows = con.execute(sql).fetchall()
-            else:
-                sql = "SELECT f.content, b.type_id, b.content " \
-                      "FROM flow f " \
-                      "LEFT OUTER JOIN body b ON f.id = b.flow_id " \
-                      f"AND f.id IN ({','.join(['?' for _ in range(len(ids))])});"
-                rows = con.execute(sql, ids).fetchall()
-            for row in rows:
-                flow = protobuf.loads(row[0])
-                if row[1]:
-                    typ = self.type_mappings["body"][row[1]]
-                    if typ and row[2]:
-                        setattr(getattr(flow, typ), "content", row[2])
-                flow = self._reassemble(flow)
-                flows.append(flow)
+            sql = "SELECT f.id, f.content, f.request_size, f.response_size FROM flow f"
+            if where:
+                sql += f" WHERE {where}"
+            for fid, blob, *sizes in con.execute(sql + ";", params):
+                flow = protobuf.loads(blob)
+                for (typ, name), size in zip(self.type_mappings["body"].items(), sizes):
+                    h = self.body_hashes.get((fid, typ))
+                    if h:
+                        message = getattr(flow, name)
+                        message.raw_content = LazyContent(self._body_loader(h), size)
+                flows.append(self._reassemble(flow))
         return flows
 
+    def _body_loader(self, h: str) -> typing.Callable[[], bytes]:
+        """
+        Load the body content with the given hash when the message content is first accessed.
+        """
+        def load() -> bytes:
+            sql = "SELECT content, codec, dict_id FROM body_content WHERE hash = ?;"
+            if threading.get_ident() == self.con_thread:
+                row = self.con.execute(sql, (h,)).fetchone()
+            else:
+                # Content accessed by the writer thread, which cannot use our connection.
+                con = sqlite3.connect(self.path)
+                try:
+                    row = con.execute(sql, (h,)).fetchone()
+                finally:
+                    con.close()
+            return self._decode_body(*row) if row else b""
+        return load
+
+    @staticmethod
+    def _encode_content(content: bytes, headers) -> bytes:
+        # Sessions used to store decoded content, encode it again like Message.set_content does.
+        ce = headers.get("content-encoding")
+        try:
+            return encoding.encode(content, ce or "identity")  # type: ignore
+        except ValueError:
+            return content
+
+    def summary(self, flow: http.HTTPFlow) -> dict:
+        return dict(zip(("id",) + tuple(self.flow_columns), (flow.id,) + self._columns(flow)))
+
+    def retrieve_summaries(self, ids: typing.Sequence[str]) -> typing.Dict[str, dict]:
+        """
+        Retrieve the queryable columns of stored flows by id, leaving out serialized flows and bodies.
+        """
+        if not ids:
+            return {}
+        columns = ("id",) + tuple(self.flow_columns)
+        sql = f"SELECT {', '.join(columns)} FROM flow WHERE id IN ({','.join('?' for _ in ids)});"
+        with self.con as con:
+            return {row[0]: dict(zip(columns, row)) for row in con.execute(sql, ids)}
+
+    def filter_flows(self, query: FilterQuery) -> typing.List[http.HTTPFlow]:
+        """
+        Deserialize the flows matching the SQL part of a query.
+        """
+        self.active_query[0] = query
+        return self._load_flows(query.where)
+
+    def filter_orders(self, query: FilterQuery) -> typing.List[tuple]:
+        """
+        Return the id and the sort keys of the flows matching the SQL part of a query,
+        without deserializing them.
+        """
+        self.active_query[0] = query
+        sql = "SELECT id, IFNULL(timestamp_start, 0), method, url, request_size + IFNULL(response_size, 0) FROM flow f"
+        if query.where:
+            sql += f" WHERE {query.where}"
+        with self.con as con:
+            return con.execute(sql + ";").fetchall()
+
     def clear(self):
-        self.con.executescript("DELETE FROM body; DELETE FROM annotation; DELETE FROM flow;")
+        # Wait for a write in progress, and drop the snapshots taken before.
+        with self.write_lock:
+            self.con.executescript(
+                "DELETE FROM body; DELETE FROM body_content; DELETE FROM annotation; DELETE FROM flow;"
+            )
+            if self.fts:
+                self.con.executescript("DELETE FROM flow_fts;")
+            self.body_hashes.clear()
+            self.id_ledger.clear()
+            self.generation += 1
 
 
 matchall = flowfilter.parse(".")
@@ -211,23 +794,73 @@ class Session:
     _FP_RATE = 150
     _FP_DECREMENT = 0.9
     _FP_DEFAULT = 3.0
+    _HOT_MAX = 10000
+    _BACKOFF_MAX = 60.0
 
     def __init__(self):
         self.db_store: SessionDB = None
         self._hot_store: collections.OrderedDict = collections.OrderedDict()
         self._order_store: typing.Dict[str, typing.Dict[str, typing.Union[int, float, str]]] = {}
-        self._view: typing.List[typing.Tuple[typing.Union[int, float, str], str]] = []
+        # The view is kept sorted by (order key, flow id), and _view_keys maps the flows
+        # in it to their key, so that flows can be moved or removed in O(log n).
+        self._view = sortedcontainers.SortedList()
+        self._view_keys: typing.Dict[str, typing.Union[int, float, str]] = {}
         self.order: str = orders[0]
         self.filter = matchall
         self._flush_period: float = self._FP_DEFAULT
         self._flush_rate: int = self._FP_RATE
+        self._hot_max: int = self._HOT_MAX
+        # Flows are only dropped from the hot store once written, and only if
+        # they have not been updated since. This counts updates per flow.
+        self._hot_updates: typing.Dict[str, int] = {}
+        self._flush_now: typing.Optional[asyncio.Event] = None
+        self._executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._writer_task: typing.Optional[asyncio.Task] = None
         self.started: bool = False
+        # Writer metrics
+        self.flushes: int = 0
+        self.flushed: int = 0
+        self.writing: int = 0
+        self.flush_time: float = 0.0
+        self.flush_time_max: float = 0.0
+        self.write_errors: int = 0
+        # Seconds to wait before retrying after a failed write.
+        self._backoff: float = 0.0
 
     def load(self, loader):
         loader.add_option(
             "session_path", typing.Optional[types.Path], None,
             "Path of session to load or to create."
         )
+        loader.add_option(
+            "session_fts", bool, False,
+            "Maintain a full-text index of URLs and bodies in the session, "
+            "speeding up body and URL filters. Requires sqlite with FTS5."
+        )
+        loader.add_option(
+            "session_compress", bool, True,
+            "Compress bodies stored in the session, except for media types "
+            "that are compressed already."
+        )
+        loader.add_option(
+            "session_compress_dict", bool, False,
+            "Compress JSON bodies in the session with a dictionary built from "
+            "the first ones, which helps with many small bodies."
+        )
+        loader.add_option(
+            "session_flush_interval", int, int(self._FP_DEFAULT * 1000),
+            "Interval in milliseconds at which flows are written to the session. "
+            "The interval shrinks while there is a backlog."
+        )
+        loader.add_option(
+            "session_flush_batch", int, self._FP_RATE,
+            "Maximum number of flows written to the session in one transaction."
+        )
+        loader.add_option(
+            "session_hot_max", int, self._HOT_MAX,
+            "Number of unwritten flows at which the session writer stops "
+            "waiting for the flush interval and writes continuously."
+        )
         loader.add_option(
             "view_order", str, "time",
             "Flow sort order.",
@@ -242,33 +875,165 @@ class Session:
         if not self.started:
             self.started = True
             self.db_store = SessionDB(ctx.options.session_path)
+            self._set_fts(ctx.options.session_fts)
+            self.db_store.compress = ctx.options.session_compress
+            self.db_store.compress_dict = ctx.options.session_compress_dict
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+            self._flush_now = asyncio.Event()
             loop = asyncio.get_event_loop()
-            loop.create_task(self._writer())
+            self._writer_task = loop.create_task(self._writer())
+
+    def done(self):
+        if self._writer_task:
+            self._writer_task.cancel()
+            self._writer_task = None
+        if self.db_store is not None and self._hot_store:
+            # Write what is left, once a write in progress on the executor is done.
+            try:
+                self.db_store.store_flows(list(self._hot_store.values()))
+            except Exception as e:
+                ctx.log.error("Writing {} flows to the session failed: {}".format(len(self._hot_store), e))
+            else:
+                self._hot_store.clear()
+                self._hot_updates.clear()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _set_fts(self, enabled: bool) -> None:
+        if not self.db_store.set_fts(enabled):
+            ctx.log.warn("Full-text session index unavailable: sqlite lacks FTS5 trigram support.")
 
     def configure(self, updated):
+        if "session_flush_interval" in updated:
+            self._FP_DEFAULT = self._flush_period = ctx.options.session_flush_interval / 1000
+        if "session_flush_batch" in updated:
+            if ctx.options.session_flush_batch < 1:
+                raise exceptions.OptionsError("session_flush_batch must be positive.")
+            self._flush_rate = ctx.options.session_flush_batch
+        if "session_hot_max" in updated:
+            self._hot_max = ctx.options.session_hot_max
+        if "session_fts" in updated and self.db_store is not None:
+            self._set_fts(ctx.options.session_fts)
+        if "session_compress" in updated and self.db_store is not None:
+            self.db_store.compress = ctx.options.session_compress
+        if "session_compress_dict" in updated and self.db_store is not None:
+            self.db_store.compress_dict = ctx.options.session_compress_dict
         if "view_order" in updated:
             self.set_order(ctx.options.view_order)
         if "view_filter" in updated:
             self.set_filter(ctx.options.view_filter)
 
     async def _writer(self):
+        loop = asyncio.get_event_loop()
         while True:
-            await asyncio.sleep(self._flush_period)
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self._flush_period)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
             batches = -(-len(self._hot_store) // self._flush_rate)
             self._flush_period = self._flush_period * self._FP_DECREMENT if batches > 1 else self._FP_DEFAULT
             while batches:
-                tof = []
-                to_dump = min(len(self._hot_store), self._flush_rate)
-                for _ in range(to_dump):
-                    tof.append(self._hot_store.popitem(last=False)[1])
-                self.db_store.store_flows(tof)
+                # Flows are copied here, and serialized and written on the executor thread.
+                # They stay in the hot store meanwhile, so that they are visible throughout.
+                tof = list(itertools.islice(self._hot_store.values(), self._flush_rate))
+                updates = {f.id: self._hot_updates[f.id] for f in tof}
+                self.writing = len(tof)
+                start = time.perf_counter()
+                try:
+                    generation = self.db_store.generation
+                    snapshot = self.db_store.snapshot(tof)
+                    written = await loop.run_in_executor(
+                        self._executor, self.db_store.store_snapshot, snapshot, generation
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # The flows stay in the hot store and are written again later.
+                    self.writing = 0
+                    self.write_errors += 1
+                    self._backoff = min(max(self._backoff * 2, self._FP_DEFAULT), self._BACKOFF_MAX)
+                    ctx.log.error("Writing {} flows to the session failed, retrying in {:.1f}s: {}".format(
+                        len(tof), self._backoff, e
+                    ))
+                    await asyncio.sleep(self._backoff)
+                    break
+                self._backoff = 0.0
+                elapsed = time.perf_counter() - start
+                self.writing = 0
+                self.flushes += 1
+                self.flushed += len(tof)
+                self.flush_time += elapsed
+                self.flush_time_max = max(self.flush_time_max, elapsed)
+                # Flows cleared while they were written are dropped, and flows added since stay.
+                if written and generation == self.db_store.generation:
+                    for fid, count in updates.items():
+                        if self._hot_updates.get(fid) == count:
+                            del self._hot_updates[fid]
+                            del self._hot_store[fid]
                 batches -= 1
-                await asyncio.sleep(0.01)
+                if len(self._hot_store) < self._hot_max:
+                    await asyncio.sleep(0.01)
+
+    def stats(self) -> typing.Dict[str, typing.Union[int, float]]:
+        """
+        Writer metrics: flows waiting to be written or being written, the
+        number, size and latency of flushes and failed writes so far, and
+        body compression.
+        """
+        stats: typing.Dict[str, typing.Union[int, float]] = self.db_store.compression_stats() if self.db_store is not None else {}
+        return dict(
+            **stats,
+            hot=len(self._hot_store),
+            writing=self.writing,
+            flushes=self.flushes,
+            flushed=self.flushed,
+            write_errors=self.write_errors,
+            flush_time_avg=self.flush_time / self.flushes if self.flushes else 0.0,
+            flush_time_max=self.flush_time_max,
+        )
+
+    def _window(self, offset: int, limit: typing.Optional[int]) -> typing.List[str]:
+        offset = max(offset, 0)
+        end = None if limit is None else offset + max(limit, 0)
+        return [fid for _, fid in self._view.islice(offset, end)]
+
+    def load_view(self, offset: int = 0, limit: typing.Optional[int] = None) -> typing.Sequence[http.HTTPFlow]:
+        """
+        Load the flows in the view, in view order. Given a limit, only the
+        window of at most limit flows starting at offset is loaded.
+        """
+        ids = self._window(offset, limit)
+        flows = {f.id: f for f in self.load_storage(ids)}
+        return [flows[fid] for fid in ids if fid in flows]
+
+    def load_summaries(self, offset: int = 0, limit: typing.Optional[int] = None) -> typing.Sequence[dict]:
+        """
+        Like load_view, but return the queryable columns of each flow
+        instead of the flow itself, which avoids deserializing stored flows
+        and loading their bodies.
+        """
+        ids = self._window(offset, limit)
+        stored = self.db_store.retrieve_summaries(
+            [fid for fid in ids if fid not in self._hot_store and fid in self.db_store]
+        )
+        summaries = []
+        for fid in ids:
+            if fid in self._hot_store:
+                summaries.append(self.db_store.summary(self._hot_store[fid]))
+            elif fid in stored:
+                summaries.append(stored[fid])
+        return summaries
 
-    def load_view(self) -> typing.Sequence[http.HTTPFlow]:
-        ids = [fid for _, fid in self._view]
-        flows = self.load_storage(ids)
-        return sorted(flows, key=lambda f: self._generate_order(self.order, f))
+    def view_index(self, fid: str) -> int:
+        """
+        The position of a flow in the view, to load the window around it.
+        Raises ValueError if the flow is not in the view.
+        """
+        if fid not in self._view_keys:
+            raise ValueError("Flow not in view: %s" % fid)
+        return self._view.index((self._view_keys[fid], fid))
 
     def load_storage(self, ids=None) -> typing.Sequence[http.HTTPFlow]:
         flows = []
@@ -280,7 +1045,8 @@ class Session:
                     flows.append(self._hot_store[fid])
                 elif fid in self.db_store:
                     ids_from_store.append(fid)
-            flows += self.db_store.retrieve_flows(ids_from_store)
+            if ids_from_store:
+                flows += self.db_store.retrieve_flows(ids_from_store)
         else:
             for flow in self._hot_store.values():
                 flows.append(flow)
@@ -292,7 +1058,8 @@ class Session:
     def clear_storage(self):
         self.db_store.clear()
         self._hot_store.clear()
-        self._view = []
+        self._hot_updates.clear()
+        self._set_view([])
 
     def store_count(self) -> int:
         ln = 0
@@ -310,11 +1077,9 @@ class Session:
         if o == "url":
             return f.request.url
         if o == "size":
-            s = 0
-            if f.request.raw_content:
-                s += len(f.request.raw_content)
-            if f.response and f.response.raw_content:
-                s += len(f.response.raw_content)
+            s = f.request.data.content_size or 0
+            if f.response:
+                s += f.response.data.content_size or 0
             return s
         return None
 
@@ -330,17 +1095,29 @@ class Session:
             )
         if order != self.order:
             self.order = order
-            newview = [
-                (self._order_store[t[1]][order], t[1]) for t in self._view
-            ]
-            self._view = sorted(newview)
+            self._set_view([(self._order_store[fid][order], fid) for fid in self._view_keys])
+
+    def _set_view(self, entries: typing.List[typing.Tuple[typing.Union[int, float, str], str]]) -> None:
+        self._view = sortedcontainers.SortedList(entries)
+        self._view_keys = {fid: o for o, fid in entries}
 
     def _refilter(self):
-        self._view = []
-        flows = self.load_storage()
-        for f in flows:
+        view = []
+        for f in self._hot_store.values():
             if self.filter(f):
-                self.update_view(f)
+                view.append((self._order_store[f.id][self.order], f.id))
+        query = FilterQuery(None if self.filter is matchall else self.filter, self.db_store.fts)
+        if query.residual is None:
+            for fid, *keys in self.db_store.filter_orders(query):
+                if fid not in self._hot_store:
+                    self._order_store[fid] = dict(zip(orders, keys))
+                    view.append((self._order_store[fid][self.order], fid))
+        else:
+            for f in self.db_store.filter_flows(query):
+                if f.id not in self._hot_store and query.residual(f):
+                    self._store_order(f)
+                    view.append((self._order_store[f.id][self.order], f.id))
+        self._set_view(view)
 
     def set_filter(self, input_filter: typing.Optional[str]) -> None:
         filt = matchall if not input_filter else flowfilter.parse(input_filter)
@@ -352,10 +1129,14 @@ class Session:
         self._refilter()
 
     def update_view(self, f):
-        if any([f.id == t[1] for t in self._view]):
-            self._view = [(order, fid) for order, fid in self._view if fid != f.id]
+        self.remove_view(f)
         o = self._order_store[f.id][self.order]
-        self._view.insert(bisect.bisect_left(KeyifyList(self._view, lambda x: x[0]), o), (o, f.id))
+        self._view.add((o, f.id))
+        self._view_keys[f.id] = o
+
+    def remove_view(self, f):
+        if f.id in self._view_keys:
+            self._view.remove((self._view_keys.pop(f.id), f.id))
 
     def update(self, flows: typing.Sequence[http.HTTPFlow]) -> None:
         for f in flows:
@@ -363,8 +1144,13 @@ class Session:
             if f.id in self._hot_store:
                 self._hot_store.pop(f.id)
             self._hot_store[f.id] = f
+            self._hot_updates[f.id] = self._hot_updates.get(f.id, 0) + 1
             if self.filter(f):
                 self.update_view(f)
+            else:
+                self.remove_view(f)
+        if self._flush_now and len(self._hot_store) >= self._hot_max:
+            self._flush_now.set()
 
     def request(self, f):
         self.update([f])
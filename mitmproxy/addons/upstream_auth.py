@@ -4,6 +4,7 @@ import base64
 
 from mitmproxy import exceptions
 from mitmproxy import ctx
+from mitmproxy.script import threadsafe
 from mitmproxy.utils import strutils
 
 
@@ -49,10 +50,12 @@ class UpstreamAuth():
             else:
                 self.auth = parse_upstream_auth(ctx.options.upstream_auth)
 
+    @threadsafe
     def http_connect(self, f):
         if self.auth and f.mode == "upstream":
             f.request.headers["Proxy-Authorization"] = self.auth
 
+    @threadsafe
     def requestheaders(self, f):
         if self.auth:
             if f.mode == "upstream" and not f.server_conn.via:
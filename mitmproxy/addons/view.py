@@ -8,6 +8,7 @@ The View:
 - Exposes a settings store for flows that automatically expires if the flow is
   removed from the store.
 """
+import asyncio
 import collections
 import typing
 
@@ -21,7 +22,8 @@ from mitmproxy import command
 from mitmproxy import connections
 from mitmproxy import ctx
 from mitmproxy import io
-from mitmproxy import http  # noqa
+from mitmproxy import http
+from mitmproxy import websocket
 
 # The underlying sorted list implementation expects the sort key to be stable
 # for the lifetime of the object. However, if we sort by size, for instance,
@@ -37,6 +39,7 @@ from mitmproxy import http  # noqa
 class _OrderKey:
     def __init__(self, view):
         self.view = view
+        self.name = "_order_%s" % id(self)
 
     def generate(self, f: http.HTTPFlow) -> typing.Any:  # pragma: no cover
         pass
@@ -52,7 +55,7 @@ class _OrderKey:
             self.view.sig_view_refresh.send(self.view)
 
     def _key(self):
-        return "_order_%s" % id(self)
+        return self.name
 
     def __call__(self, f):
         if f.id in self.view._store:
@@ -92,7 +95,20 @@ class OrderKeySize(_OrderKey):
         return s
 
 
-matchall = flowfilter.parse(".")
+class _MatchAll(flowfilter.FUrl):
+    """
+        The default filter, equivalent to flowfilter.parse("."). Every URL
+        matches ".", so we skip building and searching the URL of each flow.
+    """
+    pattern = "."
+
+    def __call__(self, f):
+        if isinstance(f, websocket.WebSocketFlow):
+            f = f.handshake_flow
+        return isinstance(f, http.HTTPFlow) and bool(f.request)
+
+
+matchall = _MatchAll(".")
 
 
 orders = [
@@ -104,6 +120,11 @@ orders = [
 
 
 class View(collections.abc.Sequence):
+    # Adding this many flows at once, e.g. when loading a capture, builds
+    # the view in a single sort and sends one sig_view_refresh rather than a
+    # sig_view_add for every flow.
+    BULK_ADD = 1000
+
     def __init__(self):
         super().__init__()
         self._store = collections.OrderedDict()
@@ -132,6 +153,9 @@ class View(collections.abc.Sequence):
         self.sig_view_remove = blinker.Signal()
         # Signals that the view should be refreshed completely
         self.sig_view_refresh = blinker.Signal()
+        # Signals the progress of refiltering a large store in chunks, with
+        # the number of flows done and the total.
+        self.sig_view_refilter = blinker.Signal()
 
         # The sig_store* signals broadcast events that affect the underlying
         # store. If a flow is removed from just the view, sig_view_remove is
@@ -141,6 +165,16 @@ class View(collections.abc.Sequence):
         # Signals that the store should be refreshed completely
         self.sig_store_refresh = blinker.Signal()
 
+        # Stores with more flows than this are refiltered in chunks of this
+        # size, handing control back to the event loop in between.
+        self.refilter_chunk = 10000
+        self._refilter_task: typing.Optional[asyncio.Future] = None
+        # Flows added or updated while refiltering, which are matched again
+        # once it is done.
+        self._refilter_changed: typing.Dict[str, mitmproxy.flow.Flow] = {}
+        # The number of flows refiltered so far and the total, while refiltering in chunks.
+        self.refilter_progress: typing.Optional[typing.Tuple[int, int]] = None
+
         self.focus = Focus(self)
         self.settings = Settings(self)
 
@@ -158,6 +192,15 @@ class View(collections.abc.Sequence):
             "view_order_reversed", bool, False,
             "Reverse the sorting order."
         )
+        loader.add_option(
+            "view_refilter_chunk", int, 10000,
+            """
+            Refilter stores with more flows than this in chunks of this many
+            flows, handing control back to the event loop in between, so that
+            refiltering large stores doesn't block the proxy. The previous
+            view is shown until refiltering is done. 0 always refilters at once.
+            """
+        )
         loader.add_option(
             "console_focus_follow", bool, False,
             "Focus follows new flows."
@@ -198,21 +241,68 @@ class View(collections.abc.Sequence):
         return self._view.__contains__(f)
 
     def _order_key_name(self):
-        return "_order_%s" % id(self.order_key)
+        return self.order_key.name
 
     def _base_add(self, f):
         self.settings[f][self._order_key_name()] = self.order_key(f)
         self._view.add(f)
 
+    def _match(self, f: mitmproxy.flow.Flow) -> bool:
+        if self.show_marked and not f.marked:
+            return False
+        return bool(self.filter(f))
+
+    def _cancel_refilter(self) -> None:
+        if self._refilter_task:
+            self._refilter_task.cancel()
+            self._refilter_task = None
+            self._refilter_changed.clear()
+            self.refilter_progress = None
+
     def _refilter(self):
+        self._cancel_refilter()
+        if self.refilter_chunk and len(self._store) > self.refilter_chunk:
+            if asyncio.get_event_loop().is_running():
+                self._refilter_task = asyncio.ensure_future(
+                    self._refilter_chunked(list(self._store.values()))
+                )
+                return
         self._view.clear()
         for i in self._store.values():
-            if self.show_marked and not i.marked:
-                continue
-            if self.filter(i):
+            if self._match(i):
                 self._base_add(i)
         self.sig_view_refresh.send(self)
 
+    async def _refilter_chunked(self, flows: typing.List[mitmproxy.flow.Flow]) -> None:
+        matched: typing.Dict[str, mitmproxy.flow.Flow] = collections.OrderedDict()
+        total = len(flows)
+        for start in range(0, total, self.refilter_chunk):
+            key = self._order_key_name()
+            for f in flows[start:start + self.refilter_chunk]:
+                if f.id in self._store and self._match(f):
+                    matched[f.id] = f
+                    self.settings[f][key] = self.order_key(f)
+            self.refilter_progress = (min(start + self.refilter_chunk, total), total)
+            self.sig_view_refilter.send(self, done=self.refilter_progress[0], total=total)
+            await asyncio.sleep(0)
+
+        key = self._order_key_name()
+        for f in self._refilter_changed.values():
+            if f.id in self._store and self._match(f):
+                matched[f.id] = f
+                self.settings[f][key] = self.order_key(f)
+            else:
+                matched.pop(f.id, None)
+        self._refilter_task = None
+        self._refilter_changed.clear()
+        self.refilter_progress = None
+        # Flows may have been removed since they were matched.
+        self._view = sortedcontainers.SortedListWithKey(
+            (f for f in matched.values() if f.id in self._store),
+            key=self.order_key
+        )
+        self.sig_view_refresh.send(self)
+
     """ View API """
 
     # Focus
@@ -309,12 +399,21 @@ class View(collections.abc.Sequence):
         self.filter = flt or matchall
         self._refilter()
 
+    @command.command("view.filter.profile")
+    def profile_filter(self) -> str:
+        """
+            Match all flows against the current view filter and report how
+            much time each part of the filter takes.
+        """
+        return flowfilter.profile(self.filter, self._store.values())
+
     # View Updates
     @command.command("view.clear")
     def clear(self) -> None:
         """
             Clears both the store and view.
         """
+        self._cancel_refilter()
         self._store.clear()
         self._view.clear()
         self.sig_view_refresh.send(self)
@@ -446,32 +545,62 @@ class View(collections.abc.Sequence):
         """
             Load flows into the view, without processing them with addons.
         """
+        flows = []
         try:
             with open(path, "rb") as f:
                 for i in io.FlowReader(f).stream():
                     # Do this to get a new ID, so we can load the same file N times and
                     # get new flows each time. It would be more efficient to just have a
                     # .newid() method or something.
-                    self.add([i.copy()])
+                    flows.append(i.copy())
         except IOError as e:
             ctx.log.error(e.strerror)
         except exceptions.FlowReadException as e:
             ctx.log.error(str(e))
+        # Flows read before an error are loaded as well.
+        self.add(flows)
 
     def add(self, flows: typing.Sequence[mitmproxy.flow.Flow]) -> None:
         """
             Adds a flow to the state. If the flow already exists, it is
             ignored.
         """
+        if len(flows) >= self.BULK_ADD:
+            self._add_bulk(flows)
+            return
         for f in flows:
             if f.id not in self._store:
                 self._store[f.id] = f
+                if self._refilter_task:
+                    # The view still shows the previous filter, so new flows
+                    # are only matched once refiltering is done.
+                    self._refilter_changed[f.id] = f
+                    continue
                 if self.filter(f):
                     self._base_add(f)
                     if self.focus_follow:
                         self.focus.flow = f
                     self.sig_view_add.send(self, flow=f)
 
+    def _add_bulk(self, flows: typing.Sequence[mitmproxy.flow.Flow]) -> None:
+        added = []
+        for f in flows:
+            if f.id not in self._store:
+                self._store[f.id] = f
+                if self._refilter_task:
+                    self._refilter_changed[f.id] = f
+                elif self.filter(f):
+                    added.append(f)
+        if not added:
+            return
+        # The sorted list computes the order keys, which cache themselves in
+        # the settings, and sorts all flows at once rather than inserting
+        # them one by one.
+        self._view.update(added)
+        if self.focus_follow:
+            self.focus.flow = added[-1]
+        self.sig_view_refresh.send(self)
+
     def get_by_id(self, flow_id: str) -> typing.Optional[mitmproxy.flow.Flow]:
         """
             Get flow with the given id from the store.
@@ -511,6 +640,10 @@ class View(collections.abc.Sequence):
 
     # Event handlers
     def configure(self, updated):
+        if "view_refilter_chunk" in updated:
+            if ctx.options.view_refilter_chunk < 0:
+                raise exceptions.OptionsError("view_refilter_chunk must not be negative.")
+            self.refilter_chunk = ctx.options.view_refilter_chunk
         if "view_filter" in updated:
             filt = None
             if ctx.options.view_filter:
@@ -555,6 +688,14 @@ class View(collections.abc.Sequence):
         """
         for f in flows:
             if f.id in self._store:
+                if self._refilter_task:
+                    # Flows are matched against the new filter once
+                    # refiltering is done; until then only refresh them.
+                    self._refilter_changed[f.id] = f
+                    if f in self._view:
+                        self.order_key.refresh(f)
+                        self.sig_view_update.send(self, flow=f)
+                    continue
                 if self.filter(f):
                     if f not in self._view:
                         self._base_add(f)
@@ -1,9 +1,13 @@
+import collections
+import concurrent.futures
 import os
 import ssl
 import time
 import datetime
+import hashlib
 import ipaddress
 import sys
+import threading
 import typing
 import contextlib
 
@@ -131,35 +135,158 @@ class CertStoreEntry:
 TCustomCertId = bytes  # manually provided certs (e.g. mitmproxy's --certs)
 TGeneratedCertId = typing.Tuple[typing.Optional[bytes], typing.Tuple[bytes, ...]]  # (common_name, sans)
 TCertId = typing.Union[TCustomCertId, TGeneratedCertId]
+TUpstreamHint = typing.Tuple[typing.Optional[bytes], typing.List[bytes], typing.Optional[bytes]]  # (common_name, sans, organization)
 
 
 class CertStore:
 
     """
         Implements an in-memory certificate store.
+
+        Generated certificates are kept in a least-recently-used cache of at
+        most cap entries. If persist_dir is set, generated certificates are
+        also written there and read back on a cache miss, so that they survive
+        a restart. At most PERSIST_CAP certificates are kept on disk, the least
+        recently used ones are deleted first. Certificates that will likely be
+        needed soon can be generated in the background with prefetch(), by a
+        pool of worker threads. At most cap certificates are queued, as more
+        would only evict each other from the cache.
+
+        Certificates that mirror an upstream certificate can't be predicted
+        from the hostname alone. The cert ids requested for a server host are
+        remembered with add_upstream_hint(), so that prefetch_upstream() can
+        sign the same cert again once it has been evicted.
     """
     STORE_CAP = 100
+    PERSIST_CAP = 10000
 
     def __init__(
             self,
             default_privatekey,
             default_ca,
             default_chain_file,
-            dhparams):
+            dhparams,
+            cap: int = STORE_CAP) -> None:
         self.default_privatekey = default_privatekey
         self.default_ca = default_ca
         self.default_chain_file = default_chain_file
         self.dhparams = dhparams
+        self.cap = cap
         self.certs: typing.Dict[TCertId, CertStoreEntry] = {}
-        self.expire_queue = []
+        # Generated cert ids, least recently used first.
+        self.expire_queue: "collections.OrderedDict[TCertId, None]" = collections.OrderedDict()
+        self.persist_dir: typing.Optional[str] = None
+        # persist_dir -> number of certificates in it, counted on first use.
+        self.persisted: typing.Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.prefetched = 0
+        self.lock = threading.Lock()
+        # Generated cert ids that are being prefetched in the background.
+        self.pending: typing.Dict[TCertId, concurrent.futures.Future] = {}
+        self.executor: typing.Optional[concurrent.futures.ThreadPoolExecutor] = None
+        # Signing releases the GIL, so prefetch workers run in parallel.
+        self.workers = os.cpu_count() or 1
+        # server host -> (commonname, sans, organization) of its last cert, least recently used first.
+        self.upstream_hints: "collections.OrderedDict[bytes, TUpstreamHint]" = collections.OrderedDict()
+
+    def __repr__(self):
+        return "CertStore(cached={}/{}, hits={}, misses={}, disk_hits={}, prefetched={})".format(
+            len(self.expire_queue), self.cap, self.hits, self.misses, self.disk_hits, self.prefetched
+        )
+
+    def expire(self, key: TGeneratedCertId) -> None:
+        """
+            Marks a generated cert as most recently used and evicts the least
+            recently used ones if the cache is full.
+        """
+        self.expire_queue[key] = None
+        self.expire_queue.move_to_end(key)
+        self._evict()
 
-    def expire(self, entry):
-        self.expire_queue.append(entry)
-        if len(self.expire_queue) > self.STORE_CAP:
-            d = self.expire_queue.pop(0)
-            for k, v in list(self.certs.items()):
-                if v == d:
-                    del self.certs[k]
+    def set_cap(self, cap: int) -> None:
+        with self.lock:
+            self.cap = cap
+            self._evict()
+
+    def set_workers(self, workers: int) -> None:
+        """
+            Sets the number of prefetch worker threads, or one per CPU if 0.
+            Prefetches that are already queued still complete.
+        """
+        with self.lock:
+            self.workers = workers or os.cpu_count() or 1
+            if self.executor:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def _evict(self) -> None:
+        while len(self.expire_queue) > self.cap:
+            k, _ = self.expire_queue.popitem(last=False)
+            self.certs.pop(k, None)
+
+    def _persist_path(self, key: TGeneratedCertId, organization: typing.Optional[bytes]) -> str:
+        # Certs signed by a different CA must not be picked up.
+        h = hashlib.sha256(self.default_ca.digest("sha256"))
+        h.update(repr((key, organization)).encode())
+        return os.path.join(self.persist_dir, h.hexdigest() + ".pem")
+
+    def _load_persisted(self, path: str) -> typing.Optional["Cert"]:
+        try:
+            with open(path, "rb") as f:
+                cert = Cert.from_pem(f.read())
+        except (OSError, OpenSSL.crypto.Error):
+            return None
+        if cert.has_expired:
+            return None
+        try:
+            # The modification time orders certs for pruning.
+            os.utime(path)
+        except OSError:
+            pass
+        return cert
+
+    def _persist(self, path: str, cert: "Cert") -> None:
+        # Persistence is best-effort, the cert has already been generated.
+        persist_dir = os.path.dirname(path)
+        try:
+            os.makedirs(persist_dir, exist_ok=True)
+            tmp = "{}.{}.tmp".format(path, threading.get_ident())
+            with open(tmp, "wb") as f:
+                f.write(cert.to_pem())
+            os.replace(tmp, path)
+            with self.lock:
+                if persist_dir in self.persisted:
+                    self.persisted[persist_dir] += 1
+                else:
+                    # Counted once, including the cert just written.
+                    self.persisted[persist_dir] = len(os.listdir(persist_dir))
+                count = self.persisted[persist_dir]
+            if count > self.PERSIST_CAP:
+                self._prune(persist_dir)
+        except OSError:
+            pass
+
+    def _prune(self, persist_dir: str) -> None:
+        # Prune to 90% of the cap, so that the directory is not listed for
+        # every new cert.
+        keep = self.PERSIST_CAP * 9 // 10
+        paths = []
+        for name in os.listdir(persist_dir):
+            path = os.path.join(persist_dir, name)
+            try:
+                paths.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+        paths.sort()
+        for _, path in paths[:max(len(paths) - keep, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self.lock:
+            self.persisted[persist_dir] = min(len(paths), keep)
 
     @staticmethod
     def load_dhparam(path):
@@ -182,7 +309,7 @@ class CertStore:
             return dh
 
     @classmethod
-    def from_store(cls, path, basename):
+    def from_store(cls, path, basename, cap: int = STORE_CAP):
         ca_path = os.path.join(path, basename + "-ca.pem")
         if not os.path.exists(ca_path):
             key, ca = cls.create_store(path, basename)
@@ -197,7 +324,7 @@ class CertStore:
                 raw)
         dh_path = os.path.join(path, basename + "-dhparam.pem")
         dh = cls.load_dhparam(dh_path)
-        return cls(key, ca, ca_path, dh)
+        return cls(key, ca, ca_path, dh, cap)
 
     @staticmethod
     @contextlib.contextmanager
@@ -320,6 +447,91 @@ class CertStore:
             organization: Organization name for the generated certificate.
         """
 
+        # The order of SANs does not matter, so normalize it for the cache.
+        sans = sorted(set(sans))
+        key = (commonname, tuple(sans))
+        with self.lock:
+            name = self._lookup(commonname, sans)
+            if name:
+                entry = self.certs[name]
+                if name in self.expire_queue:
+                    self.expire_queue.move_to_end(name)
+                self.hits += 1
+                return entry.cert, entry.privatekey, entry.chain_file
+            self.misses += 1
+            pending = self.pending.get(key)
+
+        if pending:
+            entry = pending.result()
+        else:
+            entry = self._create_entry(key, organization)
+        return entry.cert, entry.privatekey, entry.chain_file
+
+    def prefetch(self, commonname: typing.Optional[bytes], sans: typing.List[bytes], organization: typing.Optional[bytes] = None) -> None:
+        """
+            Generates a cert in the background, so that a later call to
+            get_cert with the same arguments is a cache hit. Does nothing if
+            that call would already be a cache hit, or if cap certs are queued
+            already.
+        """
+        sans = sorted(set(sans))
+        key = (commonname, tuple(sans))
+        with self.lock:
+            if key in self.pending or len(self.pending) >= self.cap or self._lookup(commonname, sans):
+                return
+            if not self.executor:
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            self.pending[key] = self.executor.submit(self._prefetch, key, organization)
+
+    def add_upstream_hint(
+            self,
+            host: bytes,
+            commonname: typing.Optional[bytes],
+            sans: typing.List[bytes],
+            organization: typing.Optional[bytes]
+    ) -> None:
+        """
+            Remembers the arguments of a get_cert call for a cert that mirrors
+            the certificate of the upstream server host.
+        """
+        with self.lock:
+            self.upstream_hints[host] = (commonname, sans, organization)
+            self.upstream_hints.move_to_end(host)
+            # Hints are small, keep more of them than certs.
+            while len(self.upstream_hints) > self.cap * 10:
+                self.upstream_hints.popitem(last=False)
+
+    def prefetch_upstream(self, host: bytes) -> None:
+        """
+            Prefetches the cert last requested for the upstream server host,
+            if any.
+        """
+        with self.lock:
+            hint = self.upstream_hints.get(host)
+        if hint:
+            self.prefetch(*hint)
+
+    def close(self) -> None:
+        """
+            Stops the prefetch worker. Prefetches that are already running
+            still complete.
+        """
+        with self.lock:
+            if self.executor:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def _prefetch(self, key: TGeneratedCertId, organization: typing.Optional[bytes]) -> CertStoreEntry:
+        try:
+            entry = self._create_entry(key, organization)
+            with self.lock:
+                self.prefetched += 1
+            return entry
+        finally:
+            with self.lock:
+                del self.pending[key]
+
+    def _lookup(self, commonname: typing.Optional[bytes], sans: typing.List[bytes]) -> typing.Optional[TCertId]:
         potential_keys: typing.List[TCertId] = []
         if commonname:
             potential_keys.extend(self.asterisk_forms(commonname))
@@ -328,26 +540,37 @@ class CertStore:
         potential_keys.append(b"*")
         potential_keys.append((commonname, tuple(sans)))
 
-        name = next(
+        return next(
             filter(lambda key: key in self.certs, potential_keys),
             None
         )
-        if name:
-            entry = self.certs[name]
-        else:
-            entry = CertStoreEntry(
-                cert=dummy_cert(
-                    self.default_privatekey,
-                    self.default_ca,
-                    commonname,
-                    sans,
-                    organization),
-                privatekey=self.default_privatekey,
-                chain_file=self.default_chain_file)
-            self.certs[(commonname, tuple(sans))] = entry
-            self.expire(entry)
 
-        return entry.cert, entry.privatekey, entry.chain_file
+    def _create_entry(self, key: TGeneratedCertId, organization: typing.Optional[bytes]) -> CertStoreEntry:
+        commonname, sans = key
+        cert = None
+        if self.persist_dir:
+            path = self._persist_path(key, organization)
+            cert = self._load_persisted(path)
+            if cert:
+                with self.lock:
+                    self.disk_hits += 1
+        if not cert:
+            cert = dummy_cert(
+                self.default_privatekey,
+                self.default_ca,
+                commonname,
+                sans,
+                organization)
+            if self.persist_dir:
+                self._persist(path, cert)
+        entry = CertStoreEntry(
+            cert=cert,
+            privatekey=self.default_privatekey,
+            chain_file=self.default_chain_file)
+        with self.lock:
+            self.certs[key] = entry
+            self.expire(key)
+        return entry
 
 
 class _GeneralName(univ.Choice):
@@ -190,6 +190,12 @@ class ServerConnection(tcp.TCPClient, stateobject.StateObject):
         self.timestamp_end = None
         self.timestamp_tcp_setup = None
         self.timestamp_tls_setup = None
+        # True while the connection sits idle after a complete HTTP/1 exchange,
+        # i.e. when it may be handed to another client via the upstream pool.
+        self.reusable = False
+        # True once the connection is bound to the client that opened it, e.g. by
+        # connection-oriented authentication. Such a connection is never pooled.
+        self.pinned = False
 
     def connected(self):
         return bool(self.connection) and not self.finished
@@ -1,8 +1,33 @@
+import collections
 import queue
+import threading
+import time
 import asyncio
 from mitmproxy import exceptions
 
 
+class HookStats:
+    """
+        Dispatch statistics for a single hook. Latencies are measured from
+        the moment a connection thread asks the master until it receives the
+        reply, so they include the time a flow spends intercepted.
+    """
+    def __init__(self):
+        self.count = 0
+        self.inline = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return "HookStats(count={}, inline={}, mean={:.6f}s, max={:.6f}s)".format(
+            self.count, self.inline, self.mean, self.max
+        )
+
+
 class Channel:
     """
         The only way for the proxy server to communicate with the master
@@ -12,6 +37,24 @@ class Channel:
         self.master = master
         self.loop = loop
         self.should_exit = should_exit
+        self.stats = collections.defaultdict(HookStats)
+        self._stats_lock = threading.Lock()
+
+    def _send(self, mtype, m):
+        """
+        Handle the message on the calling thread if the addons allow it,
+        otherwise hand it over to the event loop.
+
+        Returns:
+            True, if the message has been handled inline.
+        """
+        if self.master.addons.handle_lifecycle_inline(mtype, m):
+            return True
+        asyncio.run_coroutine_threadsafe(
+            self.master.addons.handle_lifecycle(mtype, m),
+            self.loop,
+        )
+        return False
 
     def ask(self, mtype, m):
         """
@@ -23,11 +66,16 @@ class Channel:
         """
         if not self.should_exit.is_set():
             m.reply = Reply(m)
-            asyncio.run_coroutine_threadsafe(
-                self.master.addons.handle_lifecycle(mtype, m),
-                self.loop,
-            )
+            start = time.perf_counter()
+            inline = self._send(mtype, m)
             g = m.reply.q.get()
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                stats = self.stats[mtype]
+                stats.count += 1
+                stats.inline += inline
+                stats.total += elapsed
+                stats.max = max(stats.max, elapsed)
             if g == exceptions.Kill:
                 raise exceptions.Kill()
             return g
@@ -39,10 +87,7 @@ class Channel:
         """
         if not self.should_exit.is_set():
             m.reply = DummyReply()
-            asyncio.run_coroutine_threadsafe(
-                self.master.addons.handle_lifecycle(mtype, m),
-                self.loop,
-            )
+            self._send(mtype, m)
 
 
 NO_REPLY = object()  # special object we can distinguish from a valid "None" reply.
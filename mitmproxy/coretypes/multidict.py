@@ -157,12 +157,94 @@ class _MultiDict(MutableMapping, metaclass=ABCMeta):
 
 
 class MultiDict(_MultiDict, serializable.Serializable):
+    """
+    A MultiDict that owns its fields. Lookups go through an index that maps
+    each canonical key to the positions of its fields, so that accessing a
+    key does not have to scan and convert all fields.
+    """
     def __init__(self, fields=()):
         super().__init__()
         self.fields = tuple(
             tuple(i) for i in fields
         )
 
+    @property
+    def fields(self):
+        return self._fields
+
+    @fields.setter
+    def fields(self, value):
+        self._fields = value
+        self._index = None
+
+    def _get_index(self):
+        """
+        Return a dict that maps each canonical key to a list of the positions
+        of its fields, ordered by first occurrence. The index is built lazily
+        and discarded whenever fields is reassigned.
+        """
+        if self._index is None:
+            index = {}
+            kconv = self._kconv
+            for i, (key, _) in enumerate(self._fields):
+                index.setdefault(kconv(key), []).append(i)
+            self._index = index
+        return self._index
+
+    def __copy__(self):
+        # The index is updated in place, so copies must not share it.
+        c = self.__class__.__new__(self.__class__)
+        c.__dict__.update(self.__dict__)
+        c._index = None
+        return c
+
+    def __delitem__(self, key):
+        positions = self._get_index().get(self._kconv(key))
+        if not positions:
+            raise KeyError(key)
+        positions = set(positions)
+        self.fields = tuple(
+            field for i, field in enumerate(self._fields)
+            if i not in positions
+        )
+
+    def __iter__(self):
+        for positions in self._get_index().values():
+            yield self._fields[positions[0]][0]
+
+    def __len__(self):
+        return len(self._get_index())
+
+    def get_all(self, key):
+        positions = self._get_index().get(self._kconv(key), ())
+        return [self._fields[i][1] for i in positions]
+
+    def set_all(self, key, values):
+        values = list(values)
+        index = self._get_index()
+        key_kconv = self._kconv(key)
+        positions = index.get(key_kconv, ())
+        if not positions:
+            if values:
+                start = len(self._fields)
+                self._fields += tuple((key, value) for value in values)
+                index[key_kconv] = list(range(start, len(self._fields)))
+        elif len(positions) == len(values):
+            # Replace values in place, keeping the original key spelling.
+            fields = list(self._fields)
+            for i, value in zip(positions, values):
+                fields[i] = (fields[i][0], value)
+            self._fields = tuple(fields)
+        else:
+            super().set_all(key, values)
+
+    def insert(self, index, key, value):
+        if index < len(self._fields) or self._index is None:
+            super().insert(index, key, value)
+        else:
+            self._index.setdefault(self._kconv(key), []).append(len(self._fields))
+            self._fields += ((key, value),)
+
     @staticmethod
     def _reduce_values(values):
         return values[0]
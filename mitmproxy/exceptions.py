@@ -28,6 +28,19 @@ class Kill(MitmproxyException):
     pass
 
 
+class Park(MitmproxyException):
+
+    """
+    Signal that a layer is waiting for the client to send more data, and that its
+    thread should be released until the client connection becomes readable.
+    The connection continues with layer.resume() from then on.
+    """
+
+    def __init__(self, layer):
+        super().__init__("Connection parked")
+        self.layer = layer
+
+
 class ProtocolException(MitmproxyException):
     """
     ProtocolExceptions are caused by invalid user input, unavailable network resources,
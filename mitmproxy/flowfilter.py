@@ -32,9 +32,13 @@
         rex         Equivalent to ~u rex
 """
 
+import copy
 import re
 import sys
 import functools
+import threading
+import time
+import weakref
 
 from mitmproxy import http
 from mitmproxy import websocket
@@ -44,7 +48,7 @@ from mitmproxy import flow
 from mitmproxy.utils import strutils
 
 import pyparsing as pp
-from typing import Callable, Sequence, Type  # noqa
+from typing import Callable, Dict, Iterable, Sequence, Type  # noqa
 
 
 def only(*types):
@@ -58,7 +62,46 @@ def only(*types):
     return decorator
 
 
+def _content_token(f):
+    """
+    Returns a value that changes whenever the (decoded) contents of a flow change.
+    """
+    if isinstance(f, http.HTTPFlow):
+        return tuple(
+            (m.raw_content, m.headers.get("content-encoding"))
+            for m in (f.request, f.response) if m is not None
+        )
+    return tuple((m.from_client, m.content) for m in getattr(f, "messages", ()))
+
+
+_cache: "weakref.WeakKeyDictionary[flow.Flow, Dict]" = weakref.WeakKeyDictionary()
+_cache_lock = threading.Lock()
+
+
+def cached(fn):
+    """
+    Remembers the result of an expensive filter for each flow until the flow's
+    contents change, so that re-evaluating a filter on unchanged flows is cheap.
+    """
+    @functools.wraps(fn)
+    def cached_filter(self, f):
+        key = (type(self), self.expr)
+        token = _content_token(f)
+        with _cache_lock:
+            entry = _cache.get(f, {}).get(key)
+        if entry and entry[0] == token:
+            return entry[1]
+        ret = fn(self, f)
+        with _cache_lock:
+            _cache.setdefault(f, {})[key] = (token, ret)
+        return ret
+    return cached_filter
+
+
 class _Token:
+    # Rough relative cost of evaluating this filter.
+    # Operands of & and | are evaluated in order of ascending cost.
+    cost = 1
 
     def dump(self, indent=0, fp=sys.stdout):
         print("{spacing}{name}{expr}".format(
@@ -164,6 +207,7 @@ def _check_content_type(rex, message):
 class FAsset(_Action):
     code = "a"
     help = "Match asset in response: CSS, Javascript, Flash, images."
+    cost = 3
     ASSET_TYPES = [re.compile(x) for x in [
         b"text/javascript",
         b"application/x-javascript",
@@ -185,6 +229,7 @@ class FAsset(_Action):
 class FContentType(_Rex):
     code = "t"
     help = "Content-type header"
+    cost = 3
 
     @only(http.HTTPFlow)
     def __call__(self, f):
@@ -198,6 +243,7 @@ class FContentType(_Rex):
 class FContentTypeRequest(_Rex):
     code = "tq"
     help = "Request Content-Type header"
+    cost = 3
 
     @only(http.HTTPFlow)
     def __call__(self, f):
@@ -207,6 +253,7 @@ class FContentTypeRequest(_Rex):
 class FContentTypeResponse(_Rex):
     code = "ts"
     help = "Response Content-Type header"
+    cost = 3
 
     @only(http.HTTPFlow)
     def __call__(self, f):
@@ -218,6 +265,7 @@ class FContentTypeResponse(_Rex):
 class FHead(_Rex):
     code = "h"
     help = "Header"
+    cost = 4
     flags = re.MULTILINE
 
     @only(http.HTTPFlow)
@@ -232,6 +280,7 @@ class FHead(_Rex):
 class FHeadRequest(_Rex):
     code = "hq"
     help = "Request header"
+    cost = 4
     flags = re.MULTILINE
 
     @only(http.HTTPFlow)
@@ -243,6 +292,7 @@ class FHeadRequest(_Rex):
 class FHeadResponse(_Rex):
     code = "hs"
     help = "Response header"
+    cost = 4
     flags = re.MULTILINE
 
     @only(http.HTTPFlow)
@@ -254,9 +304,11 @@ class FHeadResponse(_Rex):
 class FBod(_Rex):
     code = "b"
     help = "Body"
+    cost = 10
     flags = re.DOTALL
 
     @only(http.HTTPFlow, websocket.WebSocketFlow, tcp.TCPFlow)
+    @cached
     def __call__(self, f):
         if isinstance(f, http.HTTPFlow):
             if f.request and f.request.raw_content:
@@ -275,9 +327,11 @@ class FBod(_Rex):
 class FBodRequest(_Rex):
     code = "bq"
     help = "Request body"
+    cost = 10
     flags = re.DOTALL
 
     @only(http.HTTPFlow, websocket.WebSocketFlow, tcp.TCPFlow)
+    @cached
     def __call__(self, f):
         if isinstance(f, http.HTTPFlow):
             if f.request and f.request.raw_content:
@@ -292,9 +346,11 @@ class FBodRequest(_Rex):
 class FBodResponse(_Rex):
     code = "bs"
     help = "Response body"
+    cost = 10
     flags = re.DOTALL
 
     @only(http.HTTPFlow, websocket.WebSocketFlow, tcp.TCPFlow)
+    @cached
     def __call__(self, f):
         if isinstance(f, http.HTTPFlow):
             if f.response and f.response.raw_content:
@@ -309,6 +365,7 @@ class FBodResponse(_Rex):
 class FMethod(_Rex):
     code = "m"
     help = "Method"
+    cost = 2
     flags = re.IGNORECASE
 
     @only(http.HTTPFlow)
@@ -319,6 +376,7 @@ class FMethod(_Rex):
 class FDomain(_Rex):
     code = "d"
     help = "Domain"
+    cost = 2
     flags = re.IGNORECASE
     is_binary = False
 
@@ -335,6 +393,7 @@ class FDomain(_Rex):
 class FUrl(_Rex):
     code = "u"
     help = "URL"
+    cost = 3
     is_binary = False
     # FUrl is special, because it can be "naked".
 
@@ -356,6 +415,7 @@ class FUrl(_Rex):
 class FSrc(_Rex):
     code = "src"
     help = "Match source address"
+    cost = 2
     is_binary = False
 
     def __call__(self, f):
@@ -368,6 +428,7 @@ class FSrc(_Rex):
 class FDst(_Rex):
     code = "dst"
     help = "Match destination address"
+    cost = 2
     is_binary = False
 
     def __call__(self, f):
@@ -393,38 +454,37 @@ class FCode(_Int):
             return True
 
 
-class FAnd(_Token):
+class _Operator(_Token):
 
     def __init__(self, lst):
         self.lst = lst
+        # Evaluate cheap operands first so that expensive ones can be skipped.
+        self.ordered = sorted(lst, key=lambda x: x.cost)
+        self.cost = sum(i.cost for i in lst)
 
     def dump(self, indent=0, fp=sys.stdout):
         super().dump(indent, fp)
         for i in self.lst:
             i.dump(indent + 1, fp)
 
-    def __call__(self, f):
-        return all(i(f) for i in self.lst)
 
+class FAnd(_Operator):
 
-class FOr(_Token):
+    def __call__(self, f):
+        return all(i(f) for i in self.ordered)
 
-    def __init__(self, lst):
-        self.lst = lst
 
-    def dump(self, indent=0, fp=sys.stdout):
-        super().dump(indent, fp)
-        for i in self.lst:
-            i.dump(indent + 1, fp)
+class FOr(_Operator):
 
     def __call__(self, f):
-        return any(i(f) for i in self.lst)
+        return any(i(f) for i in self.ordered)
 
 
 class FNot(_Token):
 
     def __init__(self, itm):
         self.itm = itm[0]
+        self.cost = self.itm.cost
 
     def dump(self, indent=0, fp=sys.stdout):
         super().dump(indent, fp)
@@ -544,6 +604,63 @@ def match(flt, flow):
     return True
 
 
+class _Timer:
+    def __init__(self, flt, children):
+        self.flt = flt
+        self.children = children
+        self.calls = 0
+        self.time = 0.0
+        self.cost = flt.cost
+
+    def __call__(self, f):
+        start = time.perf_counter()
+        try:
+            return self.flt(f)
+        finally:
+            self.calls += 1
+            self.time += time.perf_counter() - start
+
+
+def _instrument(flt) -> _Timer:
+    if isinstance(flt, _Operator):
+        children = [_instrument(i) for i in flt.ordered]
+        flt = copy.copy(flt)
+        flt.ordered = children
+    elif isinstance(flt, FNot):
+        children = [_instrument(flt.itm)]
+        flt = copy.copy(flt)
+        flt.itm = children[0]
+    else:
+        children = []
+    return _Timer(flt, children)
+
+
+def profile(flt: TFilter, flows: Iterable[flow.Flow]) -> str:
+    """
+        Matches flows against a compiled filter expression and returns a
+        report of how often each part of the expression was evaluated and
+        how much time that took. Operands of & and | are listed in the order
+        in which they are evaluated.
+    """
+    root = _instrument(flt)
+    matched = sum(1 for f in flows if root(f))
+    lines = ["{:>8} {:>10}  {}".format("calls", "ms", "filter")]
+
+    def walk(timer, indent):
+        lines.append("{:>8} {:>10.3f}  {}{}{}".format(
+            timer.calls,
+            timer.time * 1000,
+            "  " * indent,
+            timer.flt.__class__.__name__,
+            " " + timer.flt.expr if hasattr(timer.flt, "expr") else ""
+        ))
+        for i in timer.children:
+            walk(i, indent + 1)
+    walk(root, 0)
+    lines.append("{} of {} flows matched.".format(matched, root.calls))
+    return "\n".join(lines)
+
+
 help = []
 for a in filter_unary:
     help.append(
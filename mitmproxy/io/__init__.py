@@ -1,8 +1,10 @@
 
-from .io import FlowWriter, FlowReader, FilteredFlowWriter, read_flows_from_paths
+from .io import FlowWriter, FlowReader, FilteredFlowWriter, FlowIndex, ParallelFlowReader, \
+    IncrementalFlowReader, read_flows_from_paths
 from .db import DBHandler
 
 
 __all__ = [
-    "FlowWriter", "FlowReader", "FilteredFlowWriter", "read_flows_from_paths", "DBHandler"
+    "FlowWriter", "FlowReader", "FilteredFlowWriter", "FlowIndex", "ParallelFlowReader",
+    "IncrementalFlowReader", "read_flows_from_paths", "DBHandler"
 ]
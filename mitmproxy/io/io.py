@@ -1,5 +1,10 @@
+import asyncio
+import collections
+import concurrent.futures
+import multiprocessing
 import os
-from typing import Type, Iterable, Dict, Union, Any, cast  # noqa
+import sys
+from typing import Type, AsyncGenerator, Deque, Generator, Iterable, Dict, List, NamedTuple, Optional, Tuple, Union, Any, cast  # noqa
 
 from mitmproxy import exceptions
 from mitmproxy import flow
@@ -10,6 +15,7 @@ from mitmproxy import websocket
 
 from mitmproxy.io import compat
 from mitmproxy.io import tnetstring
+from mitmproxy.utils import strutils
 
 FLOW_TYPES: Dict[str, Type[flow.Flow]] = dict(
     http=http.HTTPFlow,
@@ -18,70 +24,496 @@ FLOW_TYPES: Dict[str, Type[flow.Flow]] = dict(
 )
 
 
+IndexEntry = NamedTuple(
+    "IndexEntry",
+    [
+        ("offset", int),
+        ("id", str),
+        ("type", str),
+        ("marked", bool),
+        ("error", bool),
+        ("timestamp_start", Optional[float]),
+        ("method", Optional[str]),
+        ("host", Optional[str]),
+        ("pretty_host", Optional[str]),
+        ("pretty_url", Optional[str]),
+        ("status_code", Optional[int]),
+    ],
+)
+
+
+def index_path(path: str) -> str:
+    """
+        The path of the index of the dump at path.
+    """
+    return path + ".idx"
+
+
+class FlowIndex:
+    """
+        The offsets and key metadata of the flows in a dump, kept in a file
+        next to it. With an index, flows can be read individually, and flows a
+        filter rules out on their metadata alone are not read at all. Dumps
+        stay plain sequences of flows, readable with or without their index.
+    """
+    VERSION = 1
+    # Flow types the filters apply to, by filter class.
+    flow_types: Dict[type, Tuple[str, ...]] = {
+        flowfilter.FHTTP: ("http",),
+        flowfilter.FWebSocket: ("websocket",),
+        flowfilter.FTCP: ("tcp",),
+    }
+    # Flow types and entry fields searched by the expression of a filter.
+    rex_fields: Dict[type, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+        flowfilter.FMethod: (("http",), ("method",)),
+        flowfilter.FDomain: (("http", "websocket"), ("host", "pretty_host")),
+        flowfilter.FUrl: (("http", "websocket"), ("pretty_url",)),
+    }
+
+    def __init__(self) -> None:
+        self.entries: List[IndexEntry] = []
+        # The number of bytes of the dump covered by the index.
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, offset: int, f: flow.Flow) -> None:
+        request = None
+        if isinstance(f, http.HTTPFlow):
+            request = f.request
+        elif isinstance(f, websocket.WebSocketFlow) and f.handshake_flow:
+            request = f.handshake_flow.request
+        response = f.response if isinstance(f, http.HTTPFlow) else None
+        self.entries.append(IndexEntry(
+            offset,
+            f.id,
+            f.type,
+            bool(f.marked),
+            bool(f.error),
+            request.timestamp_start if request else None,
+            request.method if request else None,
+            request.host if request else None,
+            request.pretty_host if request else None,
+            request.pretty_url if request else None,
+            response.status_code if response else None,
+        ))
+
+    def extend(self, reader: "FlowReader") -> None:
+        """
+            Index the flows in the dump behind the ones indexed already.
+        """
+        reader.fo.seek(self.size)
+        for offset, f in reader.stream_offsets():
+            self.add(offset, f)
+        self.size = reader.fo.tell()
+
+    def _match(self, flt, e: IndexEntry) -> Optional[bool]:
+        """
+            Whether the filter matches a flow given its index entry, or None
+            if that depends on more than the entry holds.
+        """
+        t = type(flt)
+        if t in self.flow_types:
+            return e.type in self.flow_types[t]
+        if t is flowfilter.FErr:
+            return e.error
+        if t is flowfilter.FMarked:
+            return e.marked
+        if t is flowfilter.FReq:
+            return e.type == "http" and e.status_code is None
+        if t is flowfilter.FResp:
+            return e.type == "http" and e.status_code is not None
+        if t is flowfilter.FCode:
+            return e.type == "http" and e.status_code == flt.num
+        if t in self.rex_fields:
+            types, fields = self.rex_fields[t]
+            if e.type not in types:
+                return False
+            values = [getattr(e, i) for i in fields if getattr(e, i) is not None]
+            if flt.is_binary:
+                values = [strutils.always_bytes(v, "utf-8", "surrogateescape") for v in values]
+            return any(flt.re.search(v) for v in values)
+        if isinstance(flt, (flowfilter.FAnd, flowfilter.FOr)):
+            results = [self._match(i, e) for i in flt.lst]
+            decisive = isinstance(flt, flowfilter.FOr)
+            if decisive in results:
+                return decisive
+            return None if None in results else not decisive
+        if isinstance(flt, flowfilter.FNot):
+            result = self._match(flt.itm, e)
+            return None if result is None else not result
+        return None
+
+    def candidates(self, flt) -> List[IndexEntry]:
+        """
+            The entries of flows the filter may match.
+        """
+        if not flt:
+            return list(self.entries)
+        return [e for e in self.entries if self._match(flt, e) is not False]
+
+    def dump(self, fo) -> None:
+        tnetstring.dump(
+            dict(version=self.VERSION, size=self.size, entries=[list(e) for e in self.entries]),
+            fo
+        )
+
+    @classmethod
+    def load(cls, fo) -> "FlowIndex":
+        """
+            Raises:
+                ValueError, if fo does not hold an index of this version.
+        """
+        data: Any = tnetstring.load(fo)
+        if not isinstance(data, dict) or data.get("version") != cls.VERSION:
+            raise ValueError("Unknown flow index format.")
+        index = cls()
+        index.size = data["size"]
+        index.entries = [IndexEntry(*e) for e in data["entries"]]
+        return index
+
+    def save(self, path: str) -> None:
+        """
+            Write the index of the dump at path.
+        """
+        tmp = index_path(path) + ".tmp"
+        with open(tmp, "wb") as fo:
+            self.dump(fo)
+        os.replace(tmp, index_path(path))
+
+    @classmethod
+    def open(cls, path: str, reader: "FlowReader") -> Optional["FlowIndex"]:
+        """
+            The index of the dump at path, read with reader, and brought up to
+            date with flows appended to the dump since. None if there is no
+            index, or if it does not belong to the dump.
+        """
+        try:
+            with open(index_path(path), "rb") as fo:
+                index = cls.load(fo)
+            size = os.path.getsize(path)
+        except (IOError, ValueError, TypeError, KeyError):
+            return None
+        if index.size > size:
+            return None
+        try:
+            if index.entries and reader.read_at(index.entries[-1].offset).id != index.entries[-1].id:
+                return None
+            if index.size < size:
+                index.extend(reader)
+        except exceptions.FlowReadException:
+            return None
+        return index
+
+
 class FlowWriter:
-    def __init__(self, fo):
+    def __init__(self, fo, index=None):
         self.fo = fo
+        # An optional FlowIndex, recording where each flow is written.
+        self.index = index
 
     def add(self, flow):
         d = flow.get_state()
+        if self.index is not None:
+            self.index.add(self.fo.tell(), flow)
         tnetstring.dump(d, self.fo)
+        if self.index is not None:
+            self.index.size = self.fo.tell()
+
+
+def _from_state(loaded) -> flow.Flow:
+    if not isinstance(loaded, dict):
+        raise exceptions.FlowReadException("Invalid data format.")
+    # FIXME: This cast hides a lack of dynamic type checking
+    loaded = cast(Dict[Union[bytes, str], Any], loaded)
+    try:
+        mdata = compat.migrate_flow(loaded)
+    except ValueError as e:
+        raise exceptions.FlowReadException(str(e))
+    if mdata["type"] not in FLOW_TYPES:
+        raise exceptions.FlowReadException("Unknown flow type: {}".format(mdata["type"]))
+    return FLOW_TYPES[mdata["type"]].from_state(mdata)
 
 
 class FlowReader:
     def __init__(self, fo):
         self.fo = fo
 
-    def stream(self) -> Iterable[flow.Flow]:
-        """
-            Yields Flow objects from the dump.
-        """
+    def _load(self) -> flow.Flow:
+        return _from_state(tnetstring.load(self.fo))
+
+    def _stream(self, offsets: bool) -> Iterable[Tuple[Optional[int], flow.Flow]]:
         try:
             while True:
-                # FIXME: This cast hides a lack of dynamic type checking
-                loaded = cast(
-                    Dict[Union[bytes, str], Any],
-                    tnetstring.load(self.fo),
-                )
-                try:
-                    mdata = compat.migrate_flow(loaded)
-                except ValueError as e:
-                    raise exceptions.FlowReadException(str(e))
-                if mdata["type"] not in FLOW_TYPES:
-                    raise exceptions.FlowReadException("Unknown flow type: {}".format(mdata["type"]))
-                yield FLOW_TYPES[mdata["type"]].from_state(mdata)
+                # Only ask for offsets if needed, stdin cannot tell them.
+                offset = self.fo.tell() if offsets else None
+                yield offset, self._load()
         except ValueError as e:
             if str(e) == "not a tnetstring: empty file":
                 return  # Error is due to EOF
             raise exceptions.FlowReadException("Invalid data format.")
 
+    def stream(self) -> Iterable[flow.Flow]:
+        """
+            Yields Flow objects from the dump.
+        """
+        for _, f in self._stream(False):
+            yield f
 
-class FilteredFlowWriter:
-    def __init__(self, fo, flt):
-        self.fo = fo
+    def stream_offsets(self) -> Iterable[Tuple[int, flow.Flow]]:
+        """
+            Yields the offset of each flow in the dump together with the flow.
+        """
+        for offset, f in self._stream(True):
+            yield cast(int, offset), f
+
+    def read_at(self, offset: int) -> flow.Flow:
+        """
+            Read the flow at the given offset, as recorded in a FlowIndex.
+        """
+        self.fo.seek(offset)
+        try:
+            return self._load()
+        except ValueError:
+            raise exceptions.FlowReadException("Invalid data format.")
+
+    def filtered(self, flt, index: Optional[FlowIndex] = None) -> Iterable[flow.Flow]:
+        """
+            Yields the flows in the dump matching the filter. Given an index
+            of the dump, flows the index rules out are not read.
+        """
+        if index is None:
+            flows = self.stream()
+        else:
+            flows = (self.read_at(e.offset) for e in index.candidates(flt))
+        for f in flows:
+            if not flt or flt(f):
+                yield f
+
+
+class FilteredFlowWriter(FlowWriter):
+    def __init__(self, fo, flt, index=None):
+        super().__init__(fo, index)
         self.flt = flt
 
     def add(self, f: flow.Flow):
         if self.flt and not flowfilter.match(self.flt, f):
             return
-        d = f.get_state()
-        tnetstring.dump(d, self.fo)
+        super().add(f)
+
+
+class IncrementalFlowReader:
+    """
+        Reads flows from a dump that arrives in pieces, e.g. an upload.
+        Only the flow currently being received is kept in memory.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data: bytes) -> List[flow.Flow]:
+        """
+            Adds the next piece of the dump and returns the flows it completes.
+        """
+        self.buf += data
+        flows = []
+        while self.buf:
+            # A length prefix has at most 9 digits.
+            length, colon, _ = bytes(self.buf[:10]).partition(b":")
+            if not length.isdigit() or (not colon and len(length) == 10):
+                raise exceptions.FlowReadException("Invalid data format.")
+            if not colon:
+                break
+            start = len(length) + 1
+            end = start + int(length)
+            if len(self.buf) <= end:
+                break
+            data_type, data = self.buf[end], bytes(self.buf[start:end])
+            del self.buf[:end + 1]
+            try:
+                loaded = tnetstring.parse(data_type, data)
+            except ValueError:
+                raise exceptions.FlowReadException("Invalid data format.")
+            flows.append(_from_state(loaded))
+        return flows
+
+    def close(self) -> None:
+        """
+            Signals the end of the dump, which must not end within a flow.
+        """
+        if self.buf:
+            raise exceptions.FlowReadException("Invalid data format.")
+
+
+def record_offsets(fo) -> Iterable[int]:
+    """
+        Yields the offset of each record in a dump, starting at the current
+        position. Records are skipped over rather than parsed. The offset of
+        an invalid record is yielded as well, which leaves reporting it to
+        whoever reads the record.
+    """
+    offset = fo.tell()
+    while True:
+        fo.seek(offset)
+        # A length prefix has at most 9 digits.
+        prefix = fo.read(10)
+        if not prefix:
+            return
+        yield offset
+        length, colon, _ = prefix.partition(b":")
+        if not colon or not length.isdigit():
+            return
+        offset += len(length) + 1 + int(length) + 1
+
 
+def _read_chunk(
+    path: str, offsets: List[int], flt
+) -> Tuple[List[Union[flow.Flow, dict]], Optional[exceptions.FlowReadException]]:
+    """
+        Decode the flows at the given offsets of a dump in a worker process.
+        Returns the flows, and the error that stopped decoding, if any.
+    """
+    flows: List[Union[flow.Flow, dict]] = []
+    with open(path, "rb") as fo:
+        reader = FlowReader(fo)
+        for offset in offsets:
+            try:
+                f = reader.read_at(offset)
+            except exceptions.FlowReadException as e:
+                return flows, e
+            if not flt or flt(f):
+                # WebSocket flows hold message queues, which cannot be pickled.
+                flows.append(f.get_state() if isinstance(f, websocket.WebSocketFlow) else f)
+    return flows, None
 
-def read_flows_from_paths(paths):
+
+class ParallelFlowReader:
+    """
+        Reads a dump in chunks of whole flows, which a pool of processes
+        decodes in parallel. Flows are yielded in the order of the dump.
+
+        Chunk boundaries come from the index of the dump if there is one,
+        otherwise they are found by skipping from one record to the next.
+    """
+    CHUNK_SIZE = 4 * 1024 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        processes: Optional[int] = None,
+        flt=None,
+        index: Optional[FlowIndex] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> None:
+        self.path = path
+        self.processes = processes or os.cpu_count() or 1
+        self.flt = flt
+        self.index = index
+        self.chunk_size = chunk_size
+
+    def chunks(self) -> Iterable[List[int]]:
+        """
+            Yields the offsets of the flows to read, grouped in chunks spanning
+            about chunk_size bytes of the dump.
+        """
+        with open(self.path, "rb") as fo:
+            if self.index is not None:
+                offsets: Iterable[int] = (e.offset for e in self.index.candidates(self.flt))
+            else:
+                offsets = record_offsets(fo)
+            chunk: List[int] = []
+            for offset in offsets:
+                if chunk and offset - chunk[0] >= self.chunk_size:
+                    yield chunk
+                    chunk = []
+                chunk.append(offset)
+            if chunk:
+                yield chunk
+
+    def _futures(self, pool: concurrent.futures.Executor) -> Generator[concurrent.futures.Future, None, None]:
+        """
+            Submits chunks to the pool, keeping a few per process in flight,
+            and yields their futures in order.
+        """
+        pending: Deque[concurrent.futures.Future] = collections.deque()
+        try:
+            for chunk in self.chunks():
+                pending.append(pool.submit(_read_chunk, self.path, chunk, self.flt))
+                if len(pending) >= 2 * self.processes:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            for f in pending:
+                f.cancel()
+
+    @staticmethod
+    def _flows(result) -> Iterable[flow.Flow]:
+        decoded, error = result
+        for f in decoded:
+            yield FLOW_TYPES[f["type"]].from_state(f) if isinstance(f, dict) else f
+        if error:
+            raise error
+
+    def _pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        # Forked workers would inherit the locks of the proxy's threads in whatever state they are.
+        if sys.version_info >= (3, 7):
+            spawn = multiprocessing.get_context("spawn")
+            return concurrent.futures.ProcessPoolExecutor(self.processes, mp_context=spawn)  # type: ignore
+        return concurrent.futures.ProcessPoolExecutor(self.processes)  # pragma: no cover
+
+    def stream(self) -> Iterable[flow.Flow]:
+        with self._pool() as pool:
+            futures = self._futures(pool)
+            try:
+                for future in futures:
+                    yield from self._flows(future.result())
+            finally:
+                # If the consumer stops early, chunks not started yet are cancelled.
+                futures.close()
+
+    async def stream_async(self) -> AsyncGenerator[flow.Flow, None]:
+        """
+            Like stream, but waits for the workers without blocking the event loop.
+        """
+        pool = self._pool()
+        futures = self._futures(pool)
+        try:
+            for future in futures:
+                for f in self._flows(await asyncio.wrap_future(future)):
+                    yield f
+        finally:
+            futures.close()
+            # Chunks being decoded when the consumer stops early are waited for off the loop.
+            asyncio.get_event_loop().run_in_executor(None, pool.shutdown)
+
+
+def read_flows_from_paths(paths, flt=None, processes: int = 1):
     """
     Given a list of filepaths, read all flows and return a list of them.
     From a performance perspective, streaming would be advisable -
     however, if there's an error with one of the files, we want it to be raised immediately.
 
+    Given a filter, only matching flows are returned, and files with an index
+    only have the flows read that the index does not rule out. With more than
+    one process, flows are decoded by a pool of processes.
+
     Raises:
         FlowReadException, if any error occurs.
     """
     try:
-        flows = []
+        flows: List[flow.Flow] = []
         for path in paths:
             path = os.path.expanduser(path)
             with open(path, "rb") as f:
-                flows.extend(FlowReader(f).stream())
+                reader = FlowReader(f)
+                index = FlowIndex.open(path, reader) if flt else None
+                f.seek(0)
+                if processes > 1:
+                    flows.extend(ParallelFlowReader(path, processes, flt, index).stream())
+                else:
+                    flows.extend(reader.filtered(flt, index))
     except IOError as e:
         raise exceptions.FlowReadException(e.strerror)
     return flows
@@ -1,19 +1,56 @@
 PRAGMA foreign_keys = ON;
 
-CREATE TABLE flow (
+CREATE TABLE IF NOT EXISTS flow (
 id VARCHAR(36) PRIMARY KEY,
+content BLOB,
+method VARCHAR(16),
+host TEXT,
+pretty_host TEXT,
+path TEXT,
+url TEXT,
+pretty_url TEXT,
+status_code INTEGER,
+request_content_type TEXT,
+response_content_type TEXT,
+error TEXT,
+timestamp_start REAL,
+timestamp_end REAL,
+request_size INTEGER,
+response_size INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS flow_method_nocase ON flow(method COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS flow_host_nocase ON flow(host COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS flow_pretty_host_nocase ON flow(pretty_host COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS flow_pretty_url ON flow(pretty_url);
+CREATE INDEX IF NOT EXISTS flow_status_code ON flow(status_code);
+
+CREATE TABLE IF NOT EXISTS body_dict (
+id INTEGER PRIMARY KEY,
 content BLOB
 );
 
-CREATE TABLE body (
+CREATE TABLE IF NOT EXISTS body_content (
+hash CHAR(64) PRIMARY KEY,
+refs INTEGER NOT NULL,
+content BLOB,
+codec INTEGER NOT NULL DEFAULT 0,
+dict_id INTEGER,
+FOREIGN KEY(dict_id) REFERENCES body_dict(id)
+);
+
+CREATE TABLE IF NOT EXISTS body (
 id INTEGER PRIMARY KEY,
 flow_id VARCHAR(36),
 type_id INTEGER,
-content BLOB,
-FOREIGN KEY(flow_id) REFERENCES flow(id)
+hash CHAR(64),
+FOREIGN KEY(flow_id) REFERENCES flow(id),
+FOREIGN KEY(hash) REFERENCES body_content(hash)
 );
 
-CREATE TABLE annotation (
+CREATE UNIQUE INDEX IF NOT EXISTS body_flow ON body(flow_id, type_id);
+
+CREATE TABLE IF NOT EXISTS annotation (
 id INTEGER PRIMARY KEY,
 flow_id VARCHAR(36),
 type VARCHAR(16),
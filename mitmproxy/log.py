@@ -56,9 +56,18 @@ class Log:
         self(txt, "error")
 
     def __call__(self, text, level="info"):
-        asyncio.get_event_loop().call_soon(
-            self.master.addons.trigger, "log", LogEntry(text, level)
-        )
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            # We are called from a thread without event loop, e.g. by
+            # thread-safe or concurrent event handlers.
+            self.master.channel.loop.call_soon_threadsafe(
+                self.master.addons.trigger, "log", LogEntry(text, level)
+            )
+        else:
+            loop.call_soon(
+                self.master.addons.trigger, "log", LogEntry(text, level)
+            )
 
 
 LogTierOrder = [
@@ -72,7 +72,10 @@ class Master:
     def start(self):
         self.should_exit.clear()
         if self.server:
-            ServerThread(self.server).start()
+            if self.options.server_asyncio:
+                self.server.serve_on_loop(self.channel.loop)
+            else:
+                ServerThread(self.server).start()
 
     async def running(self):
         self.addons.trigger("running")
@@ -1,7 +1,7 @@
 from .read import (
     read_request, read_request_head,
     read_response, read_response_head,
-    read_body,
+    read_body, read_body_into,
     connection_close,
     expected_http_body_size,
 )
@@ -15,7 +15,7 @@ from .assemble import (
 __all__ = [
     "read_request", "read_request_head",
     "read_response", "read_response_head",
-    "read_body",
+    "read_body", "read_body_into",
     "connection_close",
     "expected_http_body_size",
     "assemble_request", "assemble_request_head",
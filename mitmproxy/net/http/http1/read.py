@@ -1,3 +1,4 @@
+import io
 import time
 import sys
 import re
@@ -9,6 +10,9 @@ from mitmproxy.net.http import url
 from mitmproxy.net import check
 from mitmproxy import exceptions
 
+# The empty line that terminates the header block.
+HEADERS_END = re.compile(br"^\r?\n|\n\r?\n")
+
 
 def get_header_tokens(headers, key):
     """
@@ -154,6 +158,49 @@ def read_body(rfile, expected_size, limit=None, max_chunk_size=4096):
             raise exceptions.HttpException("HTTP body too large. Limit is {}.".format(limit))
 
 
+def read_body_into(rfile, expected_size, buffer, limit=None):
+    """
+        Read an HTTP message body into a reusable buffer.
+
+        Like :py:func:`read_body`, but yields slices of the given memoryview instead of
+        newly allocated chunks. A slice is only valid until the next one is requested,
+        so the consumer must not keep references to it.
+        Chunked bodies are framed by the sender and are read with :py:func:`read_body`.
+
+        Raises:
+            exceptions.HttpException, if an error occurs
+    """
+    if expected_size is None:
+        yield from read_body(rfile, expected_size, limit)
+        return
+    if not limit or limit < 0:
+        limit = sys.maxsize
+
+    if expected_size >= 0:
+        if expected_size > limit:
+            raise exceptions.HttpException(
+                "HTTP Body too large. "
+                "Limit is {}, content length was advertised as {}".format(limit, expected_size)
+            )
+        bytes_left = expected_size
+        while bytes_left:
+            n = rfile.readinto(buffer[:min(bytes_left, len(buffer))])
+            if not n:
+                raise exceptions.HttpException("Unexpected EOF")
+            yield buffer[:n]
+            bytes_left -= n
+    else:
+        total = 0
+        while True:
+            n = rfile.readinto(buffer)
+            if not n:
+                return
+            total += n
+            if total > limit:
+                raise exceptions.HttpException("HTTP body too large. Limit is {}.".format(limit))
+            yield buffer[:n]
+
+
 def connection_close(http_version, headers):
     """
         Checks the message to see if the client connection should be closed
@@ -325,6 +372,10 @@ def _read_headers(rfile):
         Raises:
             exceptions.HttpSyntaxException
     """
+    if hasattr(rfile, "read_until"):
+        # Reading line by line from a connection is expensive,
+        # so we read the complete header block in one go and parse it from memory.
+        rfile = io.BytesIO(rfile.read_until(HEADERS_END))
     ret = []
     while True:
         line = rfile.readline()
@@ -1,5 +1,5 @@
 import re
-from typing import Optional, Union  # noqa
+from typing import Callable, Optional, Union  # noqa
 
 from mitmproxy.utils import strutils
 from mitmproxy.net.http import encoding
@@ -7,12 +7,52 @@ from mitmproxy.coretypes import serializable
 from mitmproxy.net.http import headers
 
 
+class LazyContent:
+    """
+    A handle to a message body that is stored elsewhere, e.g. in a session
+    database, and only loaded when the content is first accessed.
+    """
+
+    def __init__(self, load: Callable[[], bytes], size: Optional[int] = None) -> None:
+        self.load = load
+        # The length of the content, if known without loading it.
+        self.size = size
+
+
 class MessageData(serializable.Serializable):
-    content: bytes = None
+    @property
+    def content(self) -> bytes:
+        content = self.__dict__.get("content")
+        if isinstance(content, LazyContent):
+            content = self.__dict__["content"] = content.load()
+        return content
+
+    @content.setter
+    def content(self, content: Optional[Union[bytes, LazyContent]]) -> None:
+        self.__dict__["content"] = content
+
+    @property
+    def content_loaded(self) -> bool:
+        """
+        False if the content is a LazyContent handle that has not been accessed yet.
+        """
+        return not isinstance(self.__dict__.get("content"), LazyContent)
+
+    @property
+    def content_size(self) -> Optional[int]:
+        """
+        The length of the content, or None if there is no content. Does not load
+        LazyContent that knows its size.
+        """
+        content = self.__dict__.get("content")
+        if isinstance(content, LazyContent) and content.size is not None:
+            return content.size
+        content = self.content
+        return None if content is None else len(content)
 
     def __eq__(self, other):
         if isinstance(other, MessageData):
-            return self.__dict__ == other.__dict__
+            return self.content == other.content and self.__dict__ == other.__dict__
         return False
 
     def set_state(self, state):
@@ -24,6 +64,7 @@ class MessageData(serializable.Serializable):
     def get_state(self):
         state = vars(self).copy()
         state["headers"] = state["headers"].get_state()
+        state["content"] = self.content
         return state
 
     @classmethod
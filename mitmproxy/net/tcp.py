@@ -1,5 +1,7 @@
+import asyncio
 import os
 import errno
+import re
 import select
 import socket
 import sys
@@ -19,6 +21,8 @@ from mitmproxy.coretypes import basethread
 
 socket_fileobject = socket.SocketIO
 
+NEWLINE = re.compile(b"\n")
+
 # workaround for https://bugs.python.org/issue29515
 # Python 3.6 for Windows is missing a constant
 IPPROTO_IPV6 = getattr(socket, "IPPROTO_IPV6", 41)
@@ -65,7 +69,8 @@ class _FileLike:
 
     def add_log(self, v):
         if self.is_logging():
-            self._log.append(v)
+            # Copy memoryviews, their underlying buffer may be reused.
+            self._log.append(bytes(v))
 
     def reset_timestamps(self):
         self.first_byte_timestamp = None
@@ -93,6 +98,10 @@ class Writer(_FileLike):
                 if hasattr(self.o, "sendall"):
                     self.add_log(v)
                     return self.o.sendall(v)
+                elif isinstance(self.o, socket_fileobject):
+                    # SocketIO.write() may only send parts of v if the socket has a timeout.
+                    self.add_log(v)
+                    return self.o._sock.sendall(v)
                 else:
                     r = self.o.write(v)
                     self.add_log(v[:r])
@@ -102,23 +111,57 @@ class Writer(_FileLike):
 
 
 class Reader(_FileLike):
+    PEEKSIZE = 1024 * 4
 
     def read(self, length):
         """
             If length is -1, we read until connection closes.
         """
-        result = b''
-        start = time.time()
+        chunks = []
         while length == -1 or length > 0:
             if length == -1 or length > self.BLOCKSIZE:
                 rlen = self.BLOCKSIZE
             else:
                 rlen = length
+            data = self._read_once(self.o.read, rlen, b"")
+            self.first_byte_timestamp = self.first_byte_timestamp or time.time()
+            if not data:
+                break
+            chunks.append(data)
+            if length != -1:
+                length -= len(data)
+        result = b"".join(chunks)
+        self.add_log(result)
+        return result
+
+    def readinto(self, b):
+        """
+            Read up to len(b) bytes into the writable buffer b.
+
+            Returns:
+                The number of bytes read, 0 if the connection has been closed.
+        """
+        if isinstance(self.o, SSL.Connection):
+            n = self._read_once(self.o.recv_into, b, 0)
+        else:
+            n = self._read_once(self.o.readinto, b, 0)
+        self.first_byte_timestamp = self.first_byte_timestamp or time.time()
+        if n:
+            self.add_log(b[:n])
+        return n or 0
+
+    def _read_once(self, read, arg, eof):
+        """
+            Calls read(arg) and translates errors into our exceptions.
+            Returns eof if the connection has been closed.
+        """
+        start = time.time()
+        while True:
             try:
-                data = self.o.read(rlen)
+                return read(arg)
             except SSL.ZeroReturnError:
                 # TLS connection was shut down cleanly
-                break
+                return eof
             except (SSL.WantWriteError, SSL.WantReadError):
                 # From the OpenSSL docs:
                 # If the underlying BIO is non-blocking, SSL_read() will also return when the
@@ -127,7 +170,6 @@ class Reader(_FileLike):
                 # SSL_read() will yield SSL_ERROR_WANT_READ or SSL_ERROR_WANT_WRITE.
                 if (time.time() - start) < self.o.gettimeout():
                     time.sleep(0.1)
-                    continue
                 else:
                     raise exceptions.TcpTimeout()
             except socket.timeout:
@@ -136,35 +178,62 @@ class Reader(_FileLike):
                 raise exceptions.TcpDisconnect(str(e))
             except SSL.SysCallError as e:
                 if e.args == (-1, 'Unexpected EOF'):
-                    break
+                    return eof
                 raise exceptions.TlsException(str(e))
             except SSL.Error as e:
                 raise exceptions.TlsException(str(e))
-            self.first_byte_timestamp = self.first_byte_timestamp or time.time()
-            if not data:
-                break
-            result += data
-            if length != -1:
-                length -= len(data)
-        self.add_log(result)
-        return result
 
     def readline(self, size=None):
+        return self.read_until(NEWLINE, size)
+
+    def read_until(self, pattern, size=None):
+        """
+        Read until (and including) the first match of a compiled bytes regex,
+        until size bytes have been read or until the connection is closed.
+
+        We deliberately do not keep a read buffer, as callers hand the underlying
+        connection to other code (TLS handshakes, raw TCP relays, ...).
+        Instead, we peek into the connection and only consume data up to the match.
+        """
         result = b''
-        bytes_read = 0
-        while True:
-            if size is not None and bytes_read >= size:
+        while size is None or len(result) < size:
+            limit = self.PEEKSIZE if size is None else min(self.PEEKSIZE, size - len(result))
+            available = self._peek_available(limit)
+            if available:
+                match = pattern.search(result + available)
+                n = match.end() - len(result) if match else len(available)
+            else:
+                # Fall back to a single byte and let .read() handle EOF and errors.
+                n = 1
+            data = self.read(n)
+            if not data:
                 break
-            ch = self.read(1)
-            bytes_read += 1
-            if not ch:
+            result += data
+            if pattern.search(result):
                 break
-            else:
-                result += ch
-                if ch == b'\n':
-                    break
         return result
 
+    def _peek_available(self, length):
+        """
+        Returns up to length bytes which can be read without blocking, waiting for at least one.
+        Returns None if the underlying file object cannot be peeked into or peeking fails.
+        """
+        try:
+            if isinstance(self.o, socket_fileobject):
+                return self.o._sock.recv(length, socket.MSG_PEEK)
+            elif isinstance(self.o, SSL.Connection):
+                return self.o.recv(length, socket.MSG_PEEK)
+        except (socket.error, SSL.Error):
+            pass
+        return None
+
+    def buffered(self):
+        """
+            True, if data has been received from the connection but not been
+            read yet. The socket does not become readable again for such data.
+        """
+        return isinstance(self.o, SSL.Connection) and self.o.pending() > 0
+
     def safe_read(self, length):
         """
             Like .read, but is guaranteed to either return length bytes, or
@@ -227,6 +296,101 @@ def ssl_read_select(rlist, timeout):
     ] or select.select(rlist, (), (), timeout)[0]
 
 
+class _RelayProtocol(asyncio.Protocol):
+    """
+    One side of a relay: writes what it receives to the transport of its peer.
+    """
+
+    def __init__(self, loop, bufsize):
+        self.bufsize = bufsize
+        self.transport = None
+        self.peer = None
+        self.eof = False
+        # What arrives before the peer is connected.
+        self.pending = []
+        self.lost = loop.create_future()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=self.bufsize)
+
+    def start(self):
+        """
+        Called once both sides are connected.
+        """
+        if self.pending:
+            self.peer.transport.write(b"".join(self.pending))
+            self.pending = []
+        if self.eof:
+            self._forward_eof()
+        if self.lost.done():
+            self.peer.transport.close()
+
+    def data_received(self, data):
+        if self.peer.transport:
+            self.peer.transport.write(data)
+        else:
+            self.pending.append(data)
+
+    def eof_received(self):
+        self.eof = True
+        if self.peer.transport:
+            self._forward_eof()
+        # Keep our side open for writing until the peer is done as well.
+        return True
+
+    def _forward_eof(self):
+        if self.peer.transport.can_write_eof():
+            self.peer.transport.write_eof()
+        if self.peer.eof:
+            self.transport.close()
+            self.peer.transport.close()
+
+    def pause_writing(self):
+        # Our peer sends faster than we can pass it on.
+        if not self.peer.transport.is_closing():
+            self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if not self.peer.transport.is_closing():
+            self.peer.transport.resume_reading()
+
+    def connection_lost(self, exc):
+        if self.peer.transport:
+            self.peer.transport.close()
+        if not self.lost.done():
+            self.lost.set_result(exc)
+
+
+async def relay(a, b, bufsize=1024 * 32):
+    """
+    Shuffle bytes between two connected, non-blocking sockets on the running
+    event loop until both directions have been closed. A clean EOF on one side
+    is forwarded as a half-close to the other. Both sockets are closed once
+    the relay finishes or is cancelled.
+
+    The sockets are driven by transports, which stay registered with the
+    selector for the lifetime of the relay and write straight from the
+    receive callback, rather than by a sock_recv()/sock_sendall() round-trip
+    per chunk. At most bufsize bytes are buffered per direction.
+    """
+    loop = asyncio.get_event_loop()
+    pa, pb = _RelayProtocol(loop, bufsize), _RelayProtocol(loop, bufsize)
+    pa.peer, pb.peer = pb, pa
+    try:
+        await loop.connect_accepted_socket(lambda: pa, a)
+        await loop.connect_accepted_socket(lambda: pb, b)
+        pa.start()
+        pb.start()
+        await asyncio.gather(pa.lost, pb.lost)
+    finally:
+        for p in (pa, pb):
+            if p.transport:
+                p.transport.abort()
+        a.close()
+        b.close()
+
+
 def close_socket(sock):
     """
     Does a hard close of a socket, without emitting a RST.
@@ -556,6 +720,7 @@ class TCPServer:
             raise socket.error("Binding to 'localhost' is prohibited. Please use '::1' or '127.0.0.1' directly.")
 
         self.socket = None
+        self.loop = None
 
         try:
             # First try to bind an IPv6 socket, with possible IPv4 if the OS supports it.
@@ -598,6 +763,25 @@ class TCPServer:
             finally:
                 close_socket(connection)
 
+    def start_connection_thread(self, connection, client_address):
+        t = basethread.BaseThread(
+            "TCPConnectionHandler (%s: %s:%s -> %s:%s)" % (
+                self.__class__.__name__,
+                client_address[0],
+                client_address[1],
+                self.address[0],
+                self.address[1],
+            ),
+            target=self.connection_thread,
+            args=(connection, client_address),
+        )
+        t.setDaemon(1)
+        try:
+            t.start()
+        except threading.ThreadError:
+            self.handle_error(connection, client_address)
+            connection.close()
+
     def serve_forever(self, poll_interval=0.1):
         self.__is_shut_down.clear()
         try:
@@ -605,30 +789,37 @@ class TCPServer:
                 r, w_, e_ = select.select([self.socket], [], [], poll_interval)
                 if self.socket in r:
                     connection, client_address = self.socket.accept()
-                    t = basethread.BaseThread(
-                        "TCPConnectionHandler (%s: %s:%s -> %s:%s)" % (
-                            self.__class__.__name__,
-                            client_address[0],
-                            client_address[1],
-                            self.address[0],
-                            self.address[1],
-                        ),
-                        target=self.connection_thread,
-                        args=(connection, client_address),
-                    )
-                    t.setDaemon(1)
-                    try:
-                        t.start()
-                    except threading.ThreadError:
-                        self.handle_error(connection, client_address)
-                        connection.close()
+                    self.start_connection_thread(connection, client_address)
         finally:
             self.__shutdown_request = False
             self.__is_shut_down.set()
 
+    def serve_on_loop(self, loop):
+        """
+            Accept connections from an asyncio event loop instead of a
+            dedicated polling thread. Connections are handed to
+            handle_client_connection_on_loop. shutdown() must be called from
+            the loop's thread.
+        """
+        self.loop = loop
+        self.socket.setblocking(False)
+        loop.add_reader(self.socket.fileno(), self._accept)
+
+    def _accept(self):
+        try:
+            connection, client_address = self.socket.accept()
+        except OSError:
+            # Either a spurious wakeup or the listening socket is gone.
+            return
+        connection.setblocking(True)
+        self.handle_client_connection_on_loop(connection, client_address)
+
     def shutdown(self):
         self.__shutdown_request = True
         self.__is_shut_down.wait()
+        if self.loop is not None:
+            self.loop.remove_reader(self.socket.fileno())
+            self.loop = None
         self.socket.close()
         self.handle_shutdown()
 
@@ -652,6 +843,13 @@ class TCPServer:
         """
         raise NotImplementedError
 
+    def handle_client_connection_on_loop(self, conn, client_address):
+        """
+            Called on the event loop after serve_on_loop() has accepted a
+            connection. By default, the connection is handled in its own thread.
+        """
+        self.start_connection_thread(conn, client_address)
+
     def handle_shutdown(self):
         """
             Called after server shutdown.
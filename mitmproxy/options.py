@@ -17,6 +17,17 @@ class Options(optmanager.OptManager):
             "server", bool, True,
             "Start a proxy server. Enabled by default."
         )
+        self.add_option(
+            "server_asyncio", bool, False,
+            """
+            Experimental: Accept client connections on the main event loop
+            and relay passthrough TCP connections (see ignore_hosts) on the
+            loop instead of in dedicated threads. This reduces the
+            per-connection footprint when passing through many long-lived
+            connections. Intercepted HTTP and TLS connections, including
+            idle keep-alive connections, are still handled by one thread each.
+            """
+        )
         self.add_option(
             "showhost", bool, False,
             "Use the Host header to construct URLs for display."
@@ -45,6 +56,33 @@ class Options(optmanager.OptManager):
             certificate as the first entry.
             """
         )
+        self.add_option(
+            "cert_cache_size", int, 100,
+            "Number of generated certificates to keep in memory."
+        )
+        self.add_option(
+            "cert_cache_persist", bool, False,
+            """
+            Store generated certificates in the confdir and reuse them after a
+            restart instead of signing new ones. At most 10000 certificates are
+            kept, the least recently used ones are deleted first.
+            """
+        )
+        self.add_option(
+            "cert_prefetch_hosts", Sequence[str], [],
+            """
+            Generate certificates for these hostnames in the background on
+            startup. Only used if upstream_cert is disabled, as certificates
+            otherwise depend on the upstream server's certificate. With
+            upstream_cert, certificates are only prefetched on CONNECT, for
+            hosts whose upstream certificate has been seen before.
+            """
+        )
+        self.add_option(
+            "cert_prefetch_workers", int, 0,
+            "Number of threads generating certificates in the background. "
+            "0 uses one per CPU."
+        )
         self.add_option(
             "ciphers_client", Optional[str], None,
             "Set supported ciphers for client connections using OpenSSL syntax."
@@ -79,6 +117,18 @@ class Options(optmanager.OptManager):
             "upstream_bind_address", str, "",
             "Address to bind upstream requests to."
         )
+        self.add_option(
+            "upstream_pool_size", int, 0,
+            """
+            Keep up to this many idle HTTP/1 server connections per host, port,
+            TLS, SNI and ALPN combination for reuse by other client connections
+            in regular, transparent and reverse proxy mode. 0 disables pooling.
+            """
+        )
+        self.add_option(
+            "upstream_pool_timeout", int, 60,
+            "Close pooled server connections that have been idle for this many seconds."
+        )
         self.add_option(
             "mode", str, "regular",
             """
@@ -104,6 +154,14 @@ class Options(optmanager.OptManager):
             with misbehaving servers.
             """
         )
+        self.add_option(
+            "stream_chunk_size", str, "128k",
+            """
+            Buffer size for relaying streamed HTTP/1 bodies that are not
+            modified by a stream function. Understands k/m/g suffixes, i.e.
+            3m for 3 megabytes.
+            """
+        )
         self.add_option(
             "websocket", bool, True,
             "Enable/disable WebSocket support. "
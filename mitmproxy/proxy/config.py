@@ -1,5 +1,7 @@
+import functools
 import os
 import re
+import time
 import typing
 
 from OpenSSL import crypto
@@ -8,28 +10,102 @@ from mitmproxy import exceptions
 from mitmproxy import options as moptions
 from mitmproxy import certs
 from mitmproxy.net import server_spec
+from mitmproxy.proxy import pool
 
 CONF_BASENAME = "mitmproxy"
 
 
 class HostMatcher:
+    r"""
+    Matches "host:port" strings against a list of regular expressions.
+
+    Patterns of the common forms ^example\.com:443$ and ^(.+\.)?example\.com:443$
+    (optionally with :\d+ as port) are looked up by domain suffix. All other
+    patterns are combined into a single regular expression where possible.
+    Recent decisions are cached.
+    """
+    CACHE_SIZE = 4096
+
+    # Patterns that cannot be combined with others into one regular expression.
+    _NOT_COMBINABLE = re.compile(r"\\[1-9]|\(\?P=|\(\?[aiLmsux]+\)")
+    _SIMPLE = re.compile(
+        r"""
+        ^\^
+        (?P<wildcard>\((?:\?:)?\.(?P<quantifier>[+*])\\\.\)\?)?
+        (?P<domain>(?:[a-zA-Z0-9-]+\\\.)*[a-zA-Z0-9-]+)
+        :(?:(?P<port>\d+)|\\d\+)
+        \$$
+        """,
+        re.VERBOSE
+    )
 
     def __init__(self, patterns=tuple()):
         self.patterns = list(patterns)
         self.regexes = [re.compile(p, re.IGNORECASE) for p in self.patterns]
 
+        # domain -> [(wildcard quantifier or None, port or None)]
+        self.suffixes: typing.Dict[str, typing.List[typing.Tuple[typing.Optional[str], typing.Optional[str]]]] = {}
+        combinable = []
+        self.remaining: typing.List[typing.Pattern] = []
+        for p, rex in zip(self.patterns, self.regexes):
+            m = self._SIMPLE.match(p)
+            if m:
+                domain = m.group("domain").replace("\\.", ".").lower()
+                self.suffixes.setdefault(domain, []).append(
+                    (m.group("quantifier"), m.group("port"))
+                )
+            elif self._NOT_COMBINABLE.search(p):
+                self.remaining.append(rex)
+            else:
+                combinable.append(p)
+        if combinable:
+            try:
+                self.remaining.insert(0, re.compile(
+                    "|".join("(?:%s)" % p for p in combinable),
+                    re.IGNORECASE
+                ))
+            except re.error:
+                # e.g. duplicate group names
+                self.remaining.extend(
+                    rex for p, rex in zip(self.patterns, self.regexes) if p in combinable
+                )
+
+        self.calls = 0
+        self.time = 0.0
+        self._match = functools.lru_cache(maxsize=self.CACHE_SIZE)(self._match_uncached)
+
     def __call__(self, address):
         if not address:
             return False
-        host = "%s:%s" % address
-        if any(rex.search(host) for rex in self.regexes):
-            return True
-        else:
-            return False
+        self.calls += 1
+        start = time.perf_counter()
+        ret = self._match(address[0], address[1])
+        self.time += time.perf_counter() - start
+        return ret
+
+    def _match_uncached(self, host, port) -> bool:
+        if self.suffixes and isinstance(host, str):
+            labels = host.lower().split(".")
+            port = str(port)
+            for i in range(len(labels)):
+                for quantifier, p in self.suffixes.get(".".join(labels[i:]), ()):
+                    if p is not None and p != port:
+                        continue
+                    if i == 0 or quantifier == "*" or (quantifier == "+" and ".".join(labels[:i])):
+                        return True
+        host = "%s:%s" % (host, port)
+        return any(rex.search(host) for rex in self.remaining)
 
     def __bool__(self):
         return bool(self.patterns)
 
+    def __repr__(self):
+        cache = self._match.cache_info()
+        return "HostMatcher(patterns={}, suffixes={}, calls={}, cache_hits={}, avg={:.1f}us)".format(
+            len(self.patterns), len(self.suffixes), self.calls, cache.hits,
+            self.time / self.calls * 1e6 if self.calls else 0
+        )
+
 
 class ProxyConfig:
 
@@ -40,6 +116,7 @@ class ProxyConfig:
         self.check_tcp: HostMatcher = None
         self.certstore: certs.CertStore = None
         self.upstream_server: typing.Optional[server_spec.ServerSpec] = None
+        self.pool = pool.ConnectionPool()
         self.configure(options, set(options.keys()))
         options.changed.connect(self.configure)
 
@@ -48,34 +125,60 @@ class ProxyConfig:
             self.check_ignore = HostMatcher(options.ignore_hosts)
         if "tcp_hosts" in updated:
             self.check_tcp = HostMatcher(options.tcp_hosts)
+        if "upstream_pool_size" in updated or "upstream_pool_timeout" in updated:
+            self.pool.max_per_host = options.upstream_pool_size
+            self.pool.idle_timeout = options.upstream_pool_timeout
+            if not options.upstream_pool_size:
+                self.pool.clear()
 
         certstore_path = os.path.expanduser(options.confdir)
-        if not os.path.exists(os.path.dirname(certstore_path)):
-            raise exceptions.OptionsError(
-                "Certificate Authority parent directory does not exist: %s" %
-                os.path.dirname(certstore_path)
-            )
-        self.certstore = certs.CertStore.from_store(
-            certstore_path,
-            CONF_BASENAME
-        )
-
-        for c in options.certs:
-            parts = c.split("=", 1)
-            if len(parts) == 1:
-                parts = ["*", parts[0]]
-
-            cert = os.path.expanduser(parts[1])
-            if not os.path.exists(cert):
+        new_certstore = "confdir" in updated or "certs" in updated
+        if new_certstore:
+            if not os.path.exists(os.path.dirname(certstore_path)):
                 raise exceptions.OptionsError(
-                    "Certificate file does not exist: %s" % cert
-                )
-            try:
-                self.certstore.add_cert_file(parts[0], cert)
-            except crypto.Error:
-                raise exceptions.OptionsError(
-                    "Invalid certificate format: %s" % cert
+                    "Certificate Authority parent directory does not exist: %s" %
+                    os.path.dirname(certstore_path)
                 )
+            certstore = certs.CertStore.from_store(
+                certstore_path,
+                CONF_BASENAME,
+                options.cert_cache_size
+            )
+
+            for c in options.certs:
+                parts = c.split("=", 1)
+                if len(parts) == 1:
+                    parts = ["*", parts[0]]
+
+                cert = os.path.expanduser(parts[1])
+                if not os.path.exists(cert):
+                    raise exceptions.OptionsError(
+                        "Certificate file does not exist: %s" % cert
+                    )
+                try:
+                    certstore.add_cert_file(parts[0], cert)
+                except crypto.Error:
+                    raise exceptions.OptionsError(
+                        "Invalid certificate format: %s" % cert
+                    )
+            if self.certstore:
+                self.certstore.close()
+            self.certstore = certstore
+        elif "cert_cache_size" in updated:
+            self.certstore.set_cap(options.cert_cache_size)
+        if options.cert_cache_persist:
+            self.certstore.persist_dir = os.path.join(certstore_path, CONF_BASENAME + "-certs")
+        else:
+            self.certstore.persist_dir = None
+        if new_certstore or "cert_prefetch_workers" in updated:
+            if options.cert_prefetch_workers < 0:
+                raise exceptions.OptionsError("cert_prefetch_workers must not be negative.")
+            self.certstore.set_workers(options.cert_prefetch_workers)
+        prefetch = new_certstore or "cert_prefetch_hosts" in updated or "upstream_cert" in updated
+        if prefetch and not options.upstream_cert:
+            for host in options.cert_prefetch_hosts:
+                host = host.encode("idna")
+                self.certstore.prefetch(host, [host])
         m = options.mode
         if m.startswith("upstream:") or m.startswith("reverse:"):
             _, spec = server_spec.parse_with_mode(options.mode)
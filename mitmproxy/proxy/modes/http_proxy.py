@@ -1,3 +1,4 @@
+from mitmproxy import exceptions
 from mitmproxy.proxy import protocol
 
 
@@ -5,10 +6,15 @@ class HttpProxy(protocol.Layer, protocol.ServerConnectionMixin):
 
     def __call__(self):
         layer = self.ctx.next_layer(self)
+        parked = False
         try:
             layer()
+        except exceptions.Park:
+            # The server connection stays open until the parked connection is done.
+            parked = True
+            raise
         finally:
-            if self.server_conn.connected():
+            if self.server_conn.connected() and not parked:
                 self.disconnect()
 
 
@@ -19,8 +25,13 @@ class HttpUpstreamProxy(protocol.Layer, protocol.ServerConnectionMixin):
 
     def __call__(self):
         layer = self.ctx.next_layer(self)
+        parked = False
         try:
             layer()
+        except exceptions.Park:
+            # The server connection stays open until the parked connection is done.
+            parked = True
+            raise
         finally:
-            if self.server_conn.connected():
+            if self.server_conn.connected() and not parked:
                 self.disconnect()
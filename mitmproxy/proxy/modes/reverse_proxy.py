@@ -1,3 +1,4 @@
+from mitmproxy import exceptions
 from mitmproxy.proxy import protocol
 
 
@@ -9,8 +10,13 @@ class ReverseProxy(protocol.Layer, protocol.ServerConnectionMixin):
 
     def __call__(self):
         layer = self.ctx.next_layer(self)
+        parked = False
         try:
             layer()
+        except exceptions.Park:
+            # The server connection stays open until the parked connection is done.
+            parked = True
+            raise
         finally:
-            if self.server_conn.connected():
+            if self.server_conn.connected() and not parked:
                 self.disconnect()
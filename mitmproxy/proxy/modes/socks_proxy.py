@@ -50,8 +50,13 @@ class Socks5Proxy(protocol.Layer, protocol.ServerConnectionMixin):
         self.server_conn.address = connect_request.addr
 
         layer = self.ctx.next_layer(self)
+        parked = False
         try:
             layer()
+        except exceptions.Park:
+            # The server connection stays open until the parked connection is done.
+            parked = True
+            raise
         finally:
-            if self.server_conn.connected():
+            if self.server_conn.connected() and not parked:
                 self.disconnect()
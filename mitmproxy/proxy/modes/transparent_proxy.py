@@ -15,8 +15,13 @@ class TransparentProxy(protocol.Layer, protocol.ServerConnectionMixin):
             raise exceptions.ProtocolException("Transparent mode failure: %s" % repr(e))
 
         layer = self.ctx.next_layer(self)
+        parked = False
         try:
             layer()
+        except exceptions.Park:
+            # The server connection stays open until the parked connection is done.
+            parked = True
+            raise
         finally:
-            if self.server_conn.connected():
+            if self.server_conn.connected() and not parked:
                 self.disconnect()
@@ -0,0 +1,146 @@
+import collections
+import threading
+import time
+import typing
+
+from mitmproxy import connections
+from mitmproxy.net import tcp
+
+PoolKey = typing.Tuple[tuple, bool, typing.Optional[str], typing.Optional[bytes]]
+
+
+class ConnectionPool:
+    """
+    A pool of idle upstream connections that is shared between all client connections.
+
+    Connections are keyed by (address, TLS, SNI, ALPN), so that a connection is only
+    handed out to a layer that would otherwise have established an identical one.
+    Idle connections are checked for staleness before they are reused and are dropped
+    once they exceed the idle timeout.
+
+    Attributes:
+        hits: Number of requests for a connection that were served from the pool.
+        misses: Number of requests for a connection that required a new one.
+        handshakes_saved: Number of TCP and TLS handshakes avoided by reusing connections.
+    """
+
+    def __init__(self, max_per_host: int = 0, idle_timeout: float = 0) -> None:
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.hits = 0
+        self.misses = 0
+        self.handshakes_saved = 0
+        self._idle: typing.Dict[
+            PoolKey, typing.Deque[typing.Tuple[float, connections.ServerConnection]]
+        ] = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(conn: connections.ServerConnection) -> PoolKey:
+        return (
+            conn.address,
+            conn.tls_established,
+            conn.sni,
+            conn.alpn_proto_negotiated or None,
+        )
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return sum(len(i) for i in self._idle.values())
+
+    def __repr__(self):
+        return "ConnectionPool(idle={}, hits={}, misses={}, hit_rate={:.1%}, handshakes_saved={})".format(
+            len(self), self.hits, self.misses, self.hit_rate, self.handshakes_saved
+        )
+
+    def get(self, *keys: PoolKey) -> typing.Optional[connections.ServerConnection]:
+        """
+        Take an idle connection for the first of the given keys that has a healthy one.
+        """
+        if self.max_per_host <= 0:
+            return None
+        now = time.time()
+        stale = []
+        conn = None
+        with self._lock:
+            for key in keys:
+                idle = self._idle.get(key)
+                while idle:
+                    # Most recently returned first, it is the least likely to have been closed.
+                    since, c = idle.pop()
+                    if self._expired(since, now) or not self._healthy(c):
+                        stale.append(c)
+                    else:
+                        conn = c
+                        break
+                if conn:
+                    break
+            if conn:
+                self.hits += 1
+                self.handshakes_saved += 2 if conn.tls_established else 1
+            else:
+                self.misses += 1
+        for c in stale:
+            self._close(c)
+        return conn
+
+    def put(self, conn: connections.ServerConnection) -> bool:
+        """
+        Return a connection to the pool.
+
+        Returns:
+            False, if the pool is full or disabled. The caller remains responsible for closing the connection.
+        """
+        if self.max_per_host <= 0 or not self._healthy(conn):
+            return False
+        now = time.time()
+        with self._lock:
+            stale = self._expire(now)
+            idle = self._idle[self.key(conn)]
+            accepted = len(idle) < self.max_per_host
+            if accepted:
+                idle.append((now, conn))
+        for c in stale:
+            self._close(c)
+        return accepted
+
+    def clear(self) -> None:
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(collections.deque)
+        for conns in idle.values():
+            for _, c in conns:
+                self._close(c)
+
+    def _expired(self, since: float, now: float) -> bool:
+        return self.idle_timeout > 0 and now - since > self.idle_timeout
+
+    def _expire(self, now: float) -> typing.List[connections.ServerConnection]:
+        stale = []
+        for key in list(self._idle.keys()):
+            idle = self._idle[key]
+            while idle and self._expired(idle[0][0], now):
+                stale.append(idle.popleft()[1])
+            if not idle:
+                del self._idle[key]
+        return stale
+
+    @staticmethod
+    def _healthy(conn: connections.ServerConnection) -> bool:
+        # An idle HTTP/1 connection must not be readable:
+        # that would either be an EOF or data the server was not asked for.
+        try:
+            return conn.connected() and not tcp.ssl_read_select([conn.connection], 0)
+        except (OSError, ValueError):
+            return False
+
+    @staticmethod
+    def _close(conn: connections.ServerConnection) -> None:
+        conn.finish()
+        conn.close()
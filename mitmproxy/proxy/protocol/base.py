@@ -144,12 +144,53 @@ class ServerConnectionMixin:
         """
         self.log("serverdisconnect", "debug", [repr(self.server_conn.address)])
         address = self.server_conn.address
-        self.server_conn.finish()
-        self.server_conn.close()
+        if not self.__release_server_conn():
+            self.server_conn.finish()
+            self.server_conn.close()
         self.channel.tell("serverdisconnect", self.server_conn)
 
         self.server_conn = self.__make_server_conn(address)
 
+    def __can_pool(self):
+        # Connections to an upstream proxy, with upstream credentials or from
+        # a spoofed source address are not interchangeable between clients.
+        return not (
+            self.config.options.spoof_source_address or
+            self.config.options.mode.startswith("upstream:") or
+            getattr(self.config.options, "upstream_auth", None)
+        )
+
+    def __release_server_conn(self):
+        """
+        Hands an idle server connection over to the upstream connection pool.
+
+        Returns:
+            True, if the pool took ownership of the connection.
+        """
+        if not self.server_conn.reusable or self.server_conn.pinned or not self.__can_pool():
+            return False
+        self.server_conn.reusable = False
+        return self.config.pool.put(self.server_conn)
+
+    def reuse_server_conn(self, *keys):
+        """
+        Replaces the server connection with an idle one from the upstream connection pool.
+        Must not be called if there is an existing connection.
+
+        Args:
+            keys: Acceptable :py:meth:`pool keys <mitmproxy.proxy.pool.ConnectionPool.key>`, in order of preference.
+
+        Returns:
+            True, if a matching connection was found.
+        """
+        conn = self.__can_pool() and self.config.pool.get(*keys)
+        if not conn:
+            return False
+        self.log("serverconnect (pooled)", "debug", [repr(conn.address)])
+        self.channel.ask("serverconnect", conn)
+        self.server_conn = conn
+        return True
+
     def connect(self):
         """
         Establishes a server connection.
@@ -50,6 +50,13 @@ class _HttpTransmissionLayer(base.Layer):
     def check_close_connection(self, f):
         raise NotImplementedError()
 
+    def client_idle(self):
+        """
+        True, if the client has not started to send another request and the
+        connection can wait for it on the event loop, see exceptions.Park.
+        """
+        return False
+
 
 class ConnectServerConnection:
 
@@ -120,6 +127,21 @@ def is_ok(status):
     return 200 <= status < 300
 
 
+def binds_connection(f: http.HTTPFlow) -> bool:
+    """
+    Whether the exchange ties the server connection to this client: NTLM and
+    Negotiate authenticate the connection rather than a single request, and
+    proxy credentials that reach the server belong to this client alone.
+    """
+    if "Proxy-Authorization" in f.request.headers:
+        return True
+    values = f.request.headers.get_all("Authorization")
+    if f.response:
+        values += f.response.headers.get_all("WWW-Authenticate")
+        values += f.response.headers.get_all("Proxy-Authenticate")
+    return any(v.split(" ", 1)[0].lower() in ("ntlm", "negotiate") for v in values)
+
+
 class HTTPMode(enum.Enum):
     regular = 1
     transparent = 2
@@ -178,6 +200,13 @@ class HttpLayer(base.Layer):
         if self.mode == HTTPMode.transparent:
             self.__initial_server_tls = self.server_tls
             self.__initial_server_address = self.server_conn.address
+        self.resume()
+
+    def resume(self):
+        """
+        Serves requests until the connection is closed. Called directly to
+        continue after the layer has parked the connection.
+        """
         while True:
             flow = http.HTTPFlow(
                 self.client_conn,
@@ -187,6 +216,8 @@ class HttpLayer(base.Layer):
             )
             if not self._process_flow(flow):
                 return
+            if self.parkable and self.client_idle():
+                raise exceptions.Park(self)
 
     def handle_regular_connect(self, f):
         self.connect_request = True
@@ -194,6 +225,15 @@ class HttpLayer(base.Layer):
         try:
             self.set_server((f.request.host, f.request.port))
 
+            if not self.config.check_ignore(self.server_conn.address):
+                # Sign the certificate that the TLS layer will most likely ask for
+                # while the client is still busy with our response and its handshake.
+                host = f.request.host.encode("idna")
+                if self.config.options.upstream_cert:
+                    self.config.certstore.prefetch_upstream(host)
+                else:
+                    self.config.certstore.prefetch(host, [host])
+
             if f.response:
                 resp = f.response
             else:
@@ -332,6 +372,7 @@ class HttpLayer(base.Layer):
                     f.request.port,
                     f.request.scheme
                 )
+                self.server_conn.reusable = False
 
                 def get_response():
                     self.send_request_headers(f.request)
@@ -447,6 +488,12 @@ class HttpLayer(base.Layer):
                 layer()
                 return False  # should never be reached
 
+            if binds_connection(f):
+                self.server_conn.pinned = True
+            # HTTP/2 connections are multiplexed and cannot be handed to another client.
+            if self.server_conn.alpn_proto_negotiated != b"h2":
+                self.server_conn.reusable = True
+
         except (exceptions.ProtocolException, exceptions.NetlibException) as e:
             self.send_error_response(502, repr(e))
             if not f.response:
@@ -490,7 +537,8 @@ class HttpLayer(base.Layer):
                 self.set_server_tls(tls, address[0])
             # Establish connection is necessary.
             if not self.server_conn.connected():
-                self.connect()
+                if not self.connect_from_pool():
+                    self.connect()
         else:
             if not self.server_conn.connected():
                 self.connect()
@@ -9,6 +9,7 @@ class Http1Layer(httpbase._HttpTransmissionLayer):
     def __init__(self, ctx, mode):
         super().__init__(ctx)
         self.mode = mode
+        self._stream_buffer = None
 
     def read_request_headers(self, flow):
         return http.HTTPRequest.wrap(
@@ -17,11 +18,17 @@ class Http1Layer(httpbase._HttpTransmissionLayer):
 
     def read_request_body(self, request):
         expected_size = http1.expected_http_body_size(request)
-        return http1.read_body(
-            self.client_conn.rfile,
-            expected_size,
-            human.parse_size(self.config.options.body_size_limit)
-        )
+        return self._read_body(self.client_conn.rfile, expected_size, request.stream)
+
+    def _read_body(self, rfile, expected_size, stream):
+        limit = human.parse_size(self.config.options.body_size_limit)
+        if stream and not callable(stream):
+            # The chunks go straight to the other side, so we can read them into a reusable buffer.
+            size = human.parse_size(self.config.options.stream_chunk_size)
+            if self._stream_buffer is None or len(self._stream_buffer) != size:
+                self._stream_buffer = memoryview(bytearray(size))
+            return http1.read_body_into(rfile, expected_size, self._stream_buffer, limit)
+        return http1.read_body(rfile, expected_size, limit)
 
     def send_request_headers(self, request):
         headers = http1.assemble_request_head(request)
@@ -43,11 +50,7 @@ class Http1Layer(httpbase._HttpTransmissionLayer):
 
     def read_response_body(self, request, response):
         expected_size = http1.expected_http_body_size(request, response)
-        return http1.read_body(
-            self.server_conn.rfile,
-            expected_size,
-            human.parse_size(self.config.options.body_size_limit)
-        )
+        return self._read_body(self.server_conn.rfile, expected_size, response.stream)
 
     def send_response_headers(self, response):
         raw = http1.assemble_response_head(response)
@@ -78,6 +81,9 @@ class Http1Layer(httpbase._HttpTransmissionLayer):
             return False
         return close_connection
 
+    def client_idle(self):
+        return not self.client_conn.rfile.buffered()
+
     def __call__(self):
         layer = httpbase.HttpLayer(self, self.mode)
         layer()
@@ -1,3 +1,4 @@
+import asyncio
 import socket
 
 from OpenSSL import SSL
@@ -19,6 +20,10 @@ class RawTCPLayer(base.Layer):
     def __call__(self):
         self.connect()
 
+        if self._can_relay_on_loop():
+            self._relay_on_loop()
+            return
+
         if not self.ignore:
             f = tcp.TCPFlow(self.client_conn, self.server_conn, self)
             self.channel.ask("tcp_start", f)
@@ -63,3 +68,27 @@ class RawTCPLayer(base.Layer):
         finally:
             if not self.ignore:
                 self.channel.tell("tcp_end", f)
+
+    def _can_relay_on_loop(self):
+        return (
+            self.ignore and
+            self.config.options.server_asyncio and
+            not isinstance(self.client_conn.connection, SSL.Connection) and
+            not isinstance(self.server_conn.connection, SSL.Connection)
+        )
+
+    def _relay_on_loop(self):
+        """
+        Hand both sockets over to the event loop so that the connection thread
+        can exit while the passthrough connection lives on.
+        """
+        socks = []
+        for conn in (self.client_conn.connection, self.server_conn.connection):
+            family, type, proto = conn.family, conn.type, conn.proto
+            s = socket.socket(family, type, proto, conn.detach())
+            s.setblocking(False)
+            socks.append(s)
+        asyncio.run_coroutine_threadsafe(
+            mitmproxy.net.tcp.relay(*socks, bufsize=self.chunk_size),
+            self.channel.loop,
+        )
@@ -351,8 +351,9 @@ class TlsLayer(base.Layer):
 
     def _establish_tls_with_client_and_server(self):
         try:
-            self.ctx.connect()
-            self._establish_tls_with_server()
+            if not self.connect_from_pool():
+                self.ctx.connect()
+                self._establish_tls_with_server()
         except Exception:
             # If establishing TLS with the server fails, we try to establish TLS with the client nonetheless
             # to send an error message over TLS.
@@ -398,32 +399,60 @@ class TlsLayer(base.Layer):
                 self._client_hello.sni or repr(self.server_conn.address)
             )
 
+    def _server_alpn(self):
+        """
+        The application protocols we offer to the server.
+        """
+        alpn = None
+        if self._client_tls:
+            if self._client_hello.alpn_protocols:
+                # We only support http/1.1 and h2.
+                # If the server only supports spdy (next to http/1.1), it may select that
+                # and mitmproxy would enter TCP passthrough mode, which we want to avoid.
+                alpn = [
+                    x for x in self._client_hello.alpn_protocols if
+                    not (x.startswith(b"h2-") or x.startswith(b"spdy"))
+                ]
+            if alpn and b"h2" in alpn and not self.config.options.http2:
+                alpn.remove(b"h2")
+
+        if self.client_conn.tls_established and self.client_conn.get_alpn_proto_negotiated():
+            # If the client has already negotiated an ALP, then force the
+            # server to use the same. This can only happen if the host gets
+            # changed after the initial connection was established. E.g.:
+            #   * the client offers http/1.1 and h2,
+            #   * the initial host is only capable of http/1.1,
+            #   * then the first server connection negotiates http/1.1,
+            #   * but after the server_conn change, the new host offers h2
+            #   * which results in garbage because the layers don' match.
+            alpn = [self.client_conn.get_alpn_proto_negotiated()]
+        return alpn
+
+    def connect_from_pool(self):
+        """
+        Take an idle connection from the upstream connection pool instead of connecting,
+        if there is one that is equivalent to the connection we would establish.
+
+        Returns:
+            True, if a pooled connection is used.
+        """
+        if not self._server_tls:
+            return self.ctx.reuse_server_conn((self.server_conn.address, False, None, None))
+        alpn = self._server_alpn() or []
+        if b"h2" in alpn:
+            # We cannot know whether the server would have picked h2 over a pooled HTTP/1 connection.
+            return False
+        # Servers without ALPN support do not select any protocol.
+        keys = [
+            (self.server_conn.address, True, self.server_sni, proto)
+            for proto in alpn + [None]
+        ]
+        return self.ctx.reuse_server_conn(*keys)
+
     def _establish_tls_with_server(self):
         self.log("Establish TLS with server", "debug")
         try:
-            alpn = None
-            if self._client_tls:
-                if self._client_hello.alpn_protocols:
-                    # We only support http/1.1 and h2.
-                    # If the server only supports spdy (next to http/1.1), it may select that
-                    # and mitmproxy would enter TCP passthrough mode, which we want to avoid.
-                    alpn = [
-                        x for x in self._client_hello.alpn_protocols if
-                        not (x.startswith(b"h2-") or x.startswith(b"spdy"))
-                    ]
-                if alpn and b"h2" in alpn and not self.config.options.http2:
-                    alpn.remove(b"h2")
-
-            if self.client_conn.tls_established and self.client_conn.get_alpn_proto_negotiated():
-                # If the client has already negotiated an ALP, then force the
-                # server to use the same. This can only happen if the host gets
-                # changed after the initial connection was established. E.g.:
-                #   * the client offers http/1.1 and h2,
-                #   * the initial host is only capable of http/1.1,
-                #   * then the first server connection negotiates http/1.1,
-                #   * but after the server_conn change, the new host offers h2
-                #   * which results in garbage because the layers don' match.
-                alpn = [self.client_conn.get_alpn_proto_negotiated()]
+            alpn = self._server_alpn()
 
             # We pass through the list of ciphers send by the client, because some HTTP/2 servers
             # will select a non-HTTP/2 compatible cipher from our default list and then hang up
@@ -501,4 +530,8 @@ class TlsLayer(base.Layer):
         # In other words, the Common Name is irrelevant then.
         if host:
             sans.add(host)
+        if use_upstream_cert and self.server_conn.address:
+            self.config.certstore.add_upstream_hint(
+                self.server_conn.address[0].encode("idna"), host, list(sans), organization
+            )
         return self.config.certstore.get_cert(host, list(sans), organization)
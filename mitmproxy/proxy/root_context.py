@@ -21,12 +21,16 @@ class RootContext:
             :py:meth:`.tell() <mitmproxy.controller.Channel.tell>` methods.
         config:
             The :py:class:`proxy server's configuration <mitmproxy.proxy.ProxyConfig>`
+        parkable:
+            ``True``, if layers may release their thread while the client is idle
+            by raising :py:class:`~mitmproxy.exceptions.Park`.
     """
 
-    def __init__(self, client_conn, config, channel):
+    def __init__(self, client_conn, config, channel, parkable=False):
         self.client_conn = client_conn
         self.channel = channel
         self.config = config
+        self.parkable = parkable
 
     def next_layer(self, top_layer):
         """
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 import traceback
 
@@ -7,8 +8,10 @@ from mitmproxy import controller  # noqa
 from mitmproxy import http
 from mitmproxy import log
 from mitmproxy import platform
+from mitmproxy.coretypes import basethread
 from mitmproxy.proxy import config
 from mitmproxy.proxy import modes
+from mitmproxy.proxy import protocol
 from mitmproxy.proxy import root_context
 from mitmproxy.net import tcp
 from mitmproxy.net.http import http1
@@ -28,6 +31,9 @@ class DummyServer:
     def serve_forever(self):
         pass
 
+    def serve_on_loop(self, loop):
+        pass
+
     def shutdown(self):
         pass
 
@@ -67,10 +73,70 @@ class ProxyServer(tcp.TCPServer):
         )
         h.handle()
 
+    def handle_client_connection_on_loop(self, conn, client_address):
+        h = ConnectionHandler(
+            conn,
+            client_address,
+            self.config,
+            self.channel,
+            parkable=True
+        )
+        asyncio.ensure_future(self._handle_parkable(h, conn, client_address), loop=self.loop)
+
+    async def _handle_parkable(self, h, conn, client_address):
+        """
+        Runs the layers of a connection in a thread until they park it, and
+        waits on the event loop for the client to send more data before
+        resuming them in a new thread. Idle connections do not hold a thread.
+        """
+        with self.handler_counter:
+            try:
+                layer = await self._in_thread(conn, client_address, h.handle)
+                while layer is not None:
+                    await h.client_readable()
+                    layer = await self._in_thread(conn, client_address, h.resume, layer)
+            except asyncio.CancelledError:
+                tcp.close_socket(conn)
+                raise
+
+    def _in_thread(self, conn, client_address, target, *args):
+        """
+        Calls target in a new thread and returns a future for its result, the
+        parked layer or None. The connection is closed once it is done.
+        """
+        loop = self.loop
+        done = loop.create_future()
+
+        def set_result(layer):
+            if not done.cancelled():
+                done.set_result(layer)
+
+        def run():
+            layer = None
+            try:
+                layer = target(*args)
+            except:
+                self.handle_error(conn, client_address)
+            finally:
+                if layer is None:
+                    tcp.close_socket(conn)
+                try:
+                    loop.call_soon_threadsafe(set_result, layer)
+                except RuntimeError:  # pragma: no cover
+                    # The event loop has been closed on shutdown.
+                    pass
+
+        basethread.BaseThread(
+            "ConnectionHandler (%s:%s)" % (client_address[0], client_address[1]),
+            target=run,
+            daemon=True,
+        ).start()
+        return done
+
 
 class ConnectionHandler:
 
-    def __init__(self, client_conn, client_address, config, channel):
+    def __init__(self, client_conn, client_address, config, channel, parkable=False):
         self.config: config.ProxyConfig = config
         self.client_conn = connections.ClientConnection(
             client_conn,
@@ -79,12 +145,15 @@ class ConnectionHandler:
         """@type: mitmproxy.proxy.connection.ClientConnection"""
         self.channel = channel
         """@type: mitmproxy.controller.Channel"""
+        self.parkable = parkable
+        self.root_layer = None
 
     def _create_root_layer(self):
         root_ctx = root_context.RootContext(
             self.client_conn,
             self.config,
-            self.channel
+            self.channel,
+            self.parkable
         )
 
         mode = self.config.options.mode
@@ -112,13 +181,53 @@ class ConnectionHandler:
             raise ValueError("Unknown proxy mode: %s" % mode)
 
     def handle(self):
+        """
+        Handles the connection until it is closed or, if the handler is
+        parkable, until a layer parks it.
+
+        Returns:
+            The parked layer, or None once the connection is done.
+        """
         self.log("clientconnect", "info")
+        return self._run(self._start)
+
+    def resume(self, layer):
+        """
+        Continues a parked connection once the client has sent more data.
+
+        Returns:
+            The parked layer, or None once the connection is done.
+        """
+        return self._run(layer.resume)
 
-        root_layer = None
+    async def client_readable(self):
+        """
+        Waits on the event loop until the client connection becomes readable.
+        """
+        loop = asyncio.get_event_loop()
+        fd = self.client_conn.connection.fileno()
+        readable = loop.create_future()
+
+        def wakeup():
+            if not readable.done():
+                readable.set_result(None)
+
+        loop.add_reader(fd, wakeup)
         try:
-            root_layer = self._create_root_layer()
-            root_layer = self.channel.ask("clientconnect", root_layer)
-            root_layer()
+            await readable
+        finally:
+            loop.remove_reader(fd)
+
+    def _start(self):
+        self.root_layer = self._create_root_layer()
+        self.root_layer = self.channel.ask("clientconnect", self.root_layer)
+        self.root_layer()
+
+    def _run(self, f):
+        try:
+            f()
+        except exceptions.Park as e:
+            return e.layer
         except exceptions.Kill:
             self.log("Connection killed", "info")
         except exceptions.ProtocolException as e:
@@ -150,10 +259,16 @@ class ConnectionHandler:
             print("mitmproxy has crashed!", file=sys.stderr)
             print("Please lodge a bug report at: https://github.com/mitmproxy/mitmproxy", file=sys.stderr)
 
+        root_layer = self.root_layer
+        if isinstance(root_layer, protocol.ServerConnectionMixin) and root_layer.server_conn.connected():
+            # The root layer leaves the server connection open when its connection is parked.
+            root_layer.disconnect()
+
         self.log("clientdisconnect", "info")
         if root_layer is not None:
             self.channel.tell("clientdisconnect", root_layer)
         self.client_conn.finish()
+        return None
 
     def log(self, msg, level):
         msg = "{}: {}".format(human.format_address(self.client_conn.address), msg)
@@ -1,5 +1,7 @@
 from .concurrent import concurrent
+from .concurrent import threadsafe
 
 __all__ = [
     "concurrent",
+    "threadsafe",
 ]
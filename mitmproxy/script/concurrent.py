@@ -1,6 +1,7 @@
 """
 This module provides a @concurrent decorator primitive to
-offload computations from mitmproxy's main master thread.
+offload computations from mitmproxy's main master thread, and a
+@threadsafe marker to run cheap handlers without involving it at all.
 """
 
 from mitmproxy import eventsequence
@@ -36,3 +37,22 @@ def concurrent(fn):
         ).start()
 
     return _concurrent
+
+
+def threadsafe(fn):
+    """
+        Mark an event handler as safe to run directly on the proxy's
+        connection threads. If all handlers for an event are marked, the
+        event skips the round-trip to the master's event loop.
+
+        Thread-safe handlers must not touch shared state without proper
+        locking. They may run concurrently to each other and to the event
+        loop, and may observe events out of order with respect to
+        notifications such as log or serverdisconnect.
+    """
+    if fn.__name__ not in eventsequence.Events - {"load", "configure"}:
+        raise NotImplementedError(
+            "Threadsafe decorator not supported for '%s' method." % fn.__name__
+        )
+    fn.threadsafe = True
+    return fn
@@ -179,6 +179,7 @@ class StatusBar(urwid.WidgetWrap):
         master.options.changed.connect(self.sig_update)
         master.view.focus.sig_change.connect(self.sig_update)
         master.view.sig_view_add.connect(self.sig_update)
+        master.view.sig_view_refilter.connect(self.sig_refilter)
         self.refresh()
 
     def refresh(self):
@@ -188,6 +189,9 @@ class StatusBar(urwid.WidgetWrap):
     def sig_update(self, sender, flow=None, updated=None):
         self.redraw()
 
+    def sig_refilter(self, sender, done, total):
+        self.redraw()
+
     def keypress(self, *args, **kwargs):
         return self.ab.keypress(*args, **kwargs)
 
@@ -229,6 +233,9 @@ class StatusBar(urwid.WidgetWrap):
             r.append("[")
             r.append(("heading_key", "f"))
             r.append(":%s]" % self.master.options.view_filter)
+        if self.master.view.refilter_progress:
+            done, total = self.master.view.refilter_progress
+            r.append("[filtering:%d%%]" % (100 * done // total))
         if self.master.options.stickycookie:
             r.append("[")
             r.append(("heading_key", "t"))
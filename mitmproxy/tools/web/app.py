@@ -1,8 +1,12 @@
+import cgi
+import collections
 import hashlib
 import json
 import logging
 import os.path
 import re
+import sys
+import typing
 from io import BytesIO
 import asyncio
 
@@ -95,6 +99,26 @@ def flow_to_json(flow: mitmproxy.flow.Flow) -> dict:
     return f
 
 
+def project_json(data: dict, fields: typing.Sequence[str]) -> dict:
+    """
+    Pick the given fields from a serialized flow. Nested fields are given as
+    dotted paths, e.g. "request.method". Fields the flow doesn't have are left out.
+    """
+    ret: dict = {}
+    for field in fields:
+        *path, key = field.split(".")
+        src, dst = data, ret
+        for p in path:
+            src = src.get(p)
+            if not isinstance(src, dict):
+                break
+            dst = dst.setdefault(p, {})
+        else:
+            if key in src:
+                dst[key] = src[key]
+    return ret
+
+
 def logentry_to_json(e: log.LogEntry) -> dict:
     return {
         "id": id(e),  # we just need some kind of id.
@@ -200,7 +224,15 @@ class WebSocketEventBroadcaster(tornado.websocket.WebSocketHandler):
 
     @classmethod
     def broadcast(cls, **kwargs):
-        message = json.dumps(kwargs, ensure_ascii=False).encode("utf8", "surrogateescape")
+        cls.send(kwargs)
+
+    @classmethod
+    def send(cls, data: typing.Union[dict, list]) -> None:
+        """
+        Send a message, or a list of messages, to all clients. The data is
+        serialized once for all of them.
+        """
+        message = json.dumps(data, ensure_ascii=False).encode("utf8", "surrogateescape")
 
         for conn in cls.connections:
             try:
@@ -213,30 +245,310 @@ class ClientConnection(WebSocketEventBroadcaster):
     connections: set = set()
 
 
+class FlowUpdates:
+    """
+    Coalesces the flow messages sent to web clients. Messages are kept per
+    flow, a later message replacing the earlier one, and sent as a list once
+    per interval. Flows are serialized when the list is sent, so the states a
+    flow goes through in between are never serialized.
+    """
+
+    def __init__(self, broadcaster: typing.Type[WebSocketEventBroadcaster], interval: float = 0.05) -> None:
+        self.broadcaster = broadcaster
+        self.interval = interval
+        self.reset_pending = False
+        # The command and flow to send, by flow id, in the order of their first message.
+        self.pending: typing.Dict[str, typing.Tuple[str, mitmproxy.flow.Flow]] = collections.OrderedDict()
+        self.handle: typing.Optional[asyncio.Handle] = None
+
+    def _queue(self, cmd: str, flow: mitmproxy.flow.Flow) -> None:
+        # Clients fetch all flows when they connect, there is nobody to tell before that.
+        if not self.broadcaster.connections:
+            return
+        previous = self.pending.get(flow.id, (None, None))[0]
+        if previous == "add" and cmd == "update":
+            cmd = "add"
+        elif previous == "add" and cmd == "remove":
+            # The client has never seen the flow.
+            del self.pending[flow.id]
+            return
+        elif previous == "remove" and cmd == "add":
+            cmd = "update"
+        self.pending[flow.id] = (cmd, flow)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self.handle is None:
+            self.handle = asyncio.get_event_loop().call_later(self.interval, self.flush)
+
+    def add(self, flow: mitmproxy.flow.Flow) -> None:
+        self._queue("add", flow)
+
+    def update(self, flow: mitmproxy.flow.Flow) -> None:
+        self._queue("update", flow)
+
+    def remove(self, flow: mitmproxy.flow.Flow) -> None:
+        self._queue("remove", flow)
+
+    def reset(self) -> None:
+        """
+        Tell clients to fetch all flows again, which supersedes all pending messages.
+        """
+        self.pending.clear()
+        if self.broadcaster.connections:
+            self.reset_pending = True
+            self._schedule()
+
+    def flush(self) -> None:
+        self.handle = None
+        messages: typing.List[dict] = []
+        if self.reset_pending:
+            messages.append(dict(resource="flows", cmd="reset"))
+        for cmd, flow in self.pending.values():
+            data = flow.id if cmd == "remove" else flow_to_json(flow)
+            messages.append(dict(resource="flows", cmd=cmd, data=data))
+        self.reset_pending = False
+        self.pending.clear()
+        if messages:
+            self.broadcaster.send(messages)
+
+
+class FlowChanges:
+    """
+    Numbers the changes to the flows in the view, so that clients can ask for
+    the flows changed since the last sequence number they have seen instead
+    of fetching all flows again.
+    """
+
+    def __init__(self, max_removed: int = 10000) -> None:
+        self.seq = 0
+        # Changes before this sequence number are no longer known.
+        self.horizon = 0
+        self.max_removed = max_removed
+        self.removed = 0
+        # The sequence number of the last change and the flow, or None if it
+        # has been removed, by flow id in the order of the changes.
+        self.changes: typing.Dict[str, typing.Tuple[int, typing.Optional[mitmproxy.flow.Flow]]] = collections.OrderedDict()
+
+    def _record(self, flow_id: str, flow: typing.Optional[mitmproxy.flow.Flow]) -> None:
+        self.seq += 1
+        previous = self.changes.pop(flow_id, None)
+        if previous and previous[1] is None:
+            self.removed -= 1
+        if flow is None:
+            self.removed += 1
+        self.changes[flow_id] = (self.seq, flow)
+        # Only removals need to be remembered, forget the oldest changes
+        # once there are too many of them.
+        while self.removed > self.max_removed:
+            _, (seq, f) = self.changes.popitem(last=False)  # type: ignore
+            self.horizon = seq
+            if f is None:
+                self.removed -= 1
+
+    def add(self, flow: mitmproxy.flow.Flow) -> None:
+        self._record(flow.id, flow)
+
+    update = add
+
+    def remove(self, flow: mitmproxy.flow.Flow) -> None:
+        self._record(flow.id, None)
+
+    def reset(self) -> None:
+        self.seq += 1
+        self.horizon = self.seq
+        self.removed = 0
+        self.changes.clear()
+
+    def since(
+        self, seq: int
+    ) -> typing.Optional[typing.Tuple[typing.List[mitmproxy.flow.Flow], typing.List[str]]]:
+        """
+        Returns the flows changed and the ids of the flows removed after the
+        given sequence number, or None if the changes are not known anymore
+        and the client has to fetch all flows.
+        """
+        if not self.horizon <= seq <= self.seq:
+            return None
+        changed, removed = [], []
+        for flow_id, (s, flow) in reversed(self.changes.items()):  # type: ignore
+            if s <= seq:
+                break
+            if flow is None:
+                removed.append(flow_id)
+            else:
+                changed.append(flow)
+        changed.reverse()
+        removed.reverse()
+        return changed, removed
+
+
 class Flows(RequestHandler):
+    """
+    Without arguments, all flows in the view are returned as a list. For large
+    views, clients should instead use:
+
+        ?limit=n&after=<flow id>  to fetch a page of flows, starting after the given flow.
+        ?since=<seq>              to fetch the flows changed since the given sequence number.
+        ?fields=id,request.host   to only include the given fields.
+    """
+
+    def int_argument(self, name: str, minimum: int = 0) -> typing.Optional[int]:
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        try:
+            i = int(value)
+        except ValueError:
+            i = minimum - 1
+        if i < minimum:
+            raise APIError(400, "Invalid {}: {}".format(name, value))
+        return i
+
+    def serialize(self, flows: typing.Iterable[mitmproxy.flow.Flow]) -> typing.List[dict]:
+        fields = self.get_argument("fields", None)
+        if not fields:
+            return [flow_to_json(f) for f in flows]
+        names = ["id"] + fields.split(",")
+        return [project_json(flow_to_json(f), names) for f in flows]
+
     def get(self):
-        self.write([flow_to_json(f) for f in self.view])
+        changes: FlowChanges = self.master.flow_changes
+        since = self.int_argument("since")
+        # An empty page would look like the end of the view.
+        limit = self.int_argument("limit", 1)
+        after = self.get_argument("after", None)
+
+        if since is not None:
+            delta = changes.since(since)
+            if delta is None:
+                self.write(dict(reset=True, seq=changes.seq))
+            else:
+                flows, removed = delta
+                self.write(dict(flows=self.serialize(flows), removed=removed, seq=changes.seq))
+        elif limit is not None or after is not None:
+            start = 0
+            if after:
+                f = self.view.get_by_id(after)
+                if f is None or f not in self.view:
+                    raise APIError(410, "Flow not in view anymore.")
+                start = self.view.index(f) + 1
+            stop = len(self.view) if limit is None else min(start + limit, len(self.view))
+            flows = [self.view[i] for i in range(start, stop)]
+            self.write(dict(
+                flows=self.serialize(flows),
+                next=flows[-1].id if flows and stop < len(self.view) else None,
+                seq=changes.seq,
+            ))
+        else:
+            self.write(self.serialize(self.view))
 
 
+class MultipartFile:
+    """
+    Extracts the first file from a multipart/form-data body as the body is
+    received, without keeping more than the current piece in memory.
+    """
+
+    def __init__(self, boundary: bytes) -> None:
+        # The first boundary may directly start the body.
+        self.buf = b"\r\n"
+        self.delimiter = b"\r\n--" + boundary
+        self.state = "preamble"
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        Adds the next piece of the body and returns the file contents in it.
+        """
+        self.buf += data
+        while True:
+            if self.state == "preamble":
+                i = self.buf.find(self.delimiter)
+                if i == -1:
+                    self.buf = self.buf[-len(self.delimiter):]
+                    return b""
+                self.buf = self.buf[i + len(self.delimiter):]
+                self.state = "headers"
+            elif self.state == "headers":
+                i = self.buf.find(b"\r\n\r\n")
+                if i == -1:
+                    return b""
+                headers, self.buf = self.buf[:i], self.buf[i + 4:]
+                # Skip over other form fields.
+                self.state = "file" if b"filename=" in headers else "preamble"
+            elif self.state == "file":
+                i = self.buf.find(self.delimiter)
+                if i == -1:
+                    # Hold back what may be the start of the delimiter.
+                    keep = len(self.delimiter) - 1
+                    ret, self.buf = self.buf[:-keep], self.buf[-keep:]
+                else:
+                    ret, self.buf = self.buf[:i], b""
+                    self.state = "done"
+                return ret
+            else:
+                return b""
+
+
+@tornado.web.stream_request_body
 class DumpFlows(RequestHandler):
-    def get(self):
+    """
+    Flows are serialized as they are sent and loaded as they are uploaded,
+    so that large dumps do not have to fit into memory.
+    """
+    CHUNK_SIZE = 512 * 1024
+
+    def prepare(self):
+        self.reader = io.IncrementalFlowReader()
+        self.multipart: typing.Optional[MultipartFile] = None
+        self.error: typing.Optional[exceptions.FlowReadException] = None
+        if self.request.method != "POST":
+            return
+        self.request.connection.set_max_body_size(sys.maxsize)
+        content_type = self.request.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            fields = cgi.parse_header(content_type)[1]
+            if "boundary" not in fields:
+                raise APIError(400, "Invalid multipart/form-data: no boundary.")
+            self.multipart = MultipartFile(fields["boundary"].encode())
+        self.view.clear()
+
+    async def data_received(self, chunk: bytes):
+        if self.error:
+            return
+        if self.multipart:
+            chunk = self.multipart.feed(chunk)
+        try:
+            flows = self.reader.feed(chunk)
+        except exceptions.FlowReadException as e:
+            self.error = e
+            return
+        for f in flows:
+            await self.master.load_flow(f)
+
+    async def get(self):
         self.set_header("Content-Disposition", "attachment; filename=flows")
         self.set_header("Content-Type", "application/octet-stream")
 
         bio = BytesIO()
         fw = io.FlowWriter(bio)
-        for f in self.view:
+        for f in list(self.view):
             fw.add(f)
-
+            if bio.tell() >= self.CHUNK_SIZE:
+                self.write(bio.getvalue())
+                bio.seek(0)
+                bio.truncate()
+                await self.flush()
         self.write(bio.getvalue())
-        bio.close()
 
     def post(self):
-        self.view.clear()
-        bio = BytesIO(self.filecontents)
-        for i in io.FlowReader(bio).stream():
-            asyncio.ensure_future(self.master.load_flow(i))
-        bio.close()
+        if not self.error:
+            try:
+                self.reader.close()
+            except exceptions.FlowReadException as e:
+                self.error = e
+        if self.error:
+            raise APIError(400, str(self.error))
 
 
 class ClearAll(RequestHandler):
@@ -20,11 +20,14 @@ from mitmproxy.tools.web import app, webaddons, static_viewer
 class WebMaster(master.Master):
     def __init__(self, options, with_termlog=True):
         super().__init__(options)
+        self.flow_updates = app.FlowUpdates(app.ClientConnection)
+        self.flow_changes = app.FlowChanges()
         self.view = view.View()
         self.view.sig_view_add.connect(self._sig_view_add)
         self.view.sig_view_remove.connect(self._sig_view_remove)
         self.view.sig_view_update.connect(self._sig_view_update)
         self.view.sig_view_refresh.connect(self._sig_view_refresh)
+        self.view.sig_view_refilter.connect(self._sig_view_refilter)
 
         self.events = eventstore.EventStore()
         self.events.sig_add.connect(self._sig_events_add)
@@ -49,30 +52,26 @@ class WebMaster(master.Master):
         )
 
     def _sig_view_add(self, view, flow):
-        app.ClientConnection.broadcast(
-            resource="flows",
-            cmd="add",
-            data=app.flow_to_json(flow)
-        )
+        self.flow_updates.add(flow)
+        self.flow_changes.add(flow)
 
     def _sig_view_update(self, view, flow):
-        app.ClientConnection.broadcast(
-            resource="flows",
-            cmd="update",
-            data=app.flow_to_json(flow)
-        )
+        self.flow_updates.update(flow)
+        self.flow_changes.update(flow)
 
     def _sig_view_remove(self, view, flow, index):
-        app.ClientConnection.broadcast(
-            resource="flows",
-            cmd="remove",
-            data=flow.id
-        )
+        self.flow_updates.remove(flow)
+        self.flow_changes.remove(flow)
 
     def _sig_view_refresh(self, view):
+        self.flow_updates.reset()
+        self.flow_changes.reset()
+
+    def _sig_view_refilter(self, view, done, total):
         app.ClientConnection.broadcast(
             resource="flows",
-            cmd="reset"
+            cmd="refilter",
+            data=dict(done=done, total=total)
         )
 
     def _sig_events_add(self, event_store, entry: log.LogEntry):
@@ -8,6 +8,7 @@ import traceback
 
 from OpenSSL import SSL
 
+from mitmproxy import ctx
 from mitmproxy import version
 
 
@@ -64,6 +65,19 @@ def dump_info(signal=None, frame=None, file=sys.stdout, testing=False):  # pragm
     for i in bthreads:
         print(i._threadinfo(), file=file)
 
+    print(file=file)
+    print("Hooks", file=file)
+    print("=====", file=file)
+    if ctx.master:
+        for name, stats in sorted(ctx.master.channel.stats.items()):
+            print(name, stats, file=file)
+        config = getattr(ctx.master.server, "config", None)
+        if config:
+            print(config.pool, file=file)
+            print(config.certstore, file=file)
+            print("ignore_hosts:", config.check_ignore, file=file)
+            print("tcp_hosts:", config.check_tcp, file=file)
+
     print(file=file)
     print("Memory", file=file)
     print("=======", file=file)
@@ -0,0 +1,120 @@
+"""
+Measures how many idle passthrough connections mitmdump can hold per GB of
+memory, and the round-trip latency through those connections, for both the
+threaded and the asyncio server mode.
+
+    python ./connections.py -n 2000
+    python ./connections.py -n 2000 --asyncio
+
+Linux only, as memory and thread counts are read from /proc.
+"""
+import argparse
+import asyncio
+import random
+import socket
+import statistics
+import subprocess
+import time
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid):
+    status = {}
+    with open("/proc/%s/status" % pid) as f:
+        for line in f:
+            k, v = line.split(":", 1)
+            status[k] = v.strip()
+    return int(status["VmRSS"].split()[0]) * 1024, int(status["Threads"])
+
+
+async def echo(reader, writer):
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        writer.write(line)
+    writer.close()
+
+
+async def wait_for_port(port, timeout=10):
+    start = time.time()
+    while time.time() - start < timeout:
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", port)
+            w.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("mitmdump did not come up on port %s" % port)
+
+
+async def open_tunnel(proxy_port, echo_port):
+    r, w = await asyncio.open_connection("127.0.0.1", proxy_port)
+    w.write(b"CONNECT 127.0.0.1:%d HTTP/1.1\r\n\r\n" % echo_port)
+    while (await r.readline()) not in (b"\r\n", b""):
+        pass
+    # The proxy only picks the next layer once the client has sent data.
+    w.write(b"hello\n")
+    await r.readline()
+    return r, w
+
+
+async def main(args):
+    echo_server = await asyncio.start_server(echo, "127.0.0.1", 0, backlog=4096)
+    echo_port = echo_server.sockets[0].getsockname()[1]
+    proxy_port = free_port()
+
+    proc = subprocess.Popen([
+        "mitmdump", "-q",
+        "--listen-host", "127.0.0.1",
+        "-p", str(proxy_port),
+        "--ignore-hosts", ".*",
+        "--set", "server_asyncio=%s" % ("true" if args.asyncio else "false"),
+    ])
+    try:
+        await wait_for_port(proxy_port)
+        rss_before, _ = proc_status(proc.pid)
+
+        tunnels = []
+        for _ in range(args.connections):
+            tunnels.append(await open_tunnel(proxy_port, echo_port))
+        await asyncio.sleep(1)
+        rss_after, threads = proc_status(proc.pid)
+
+        latencies = []
+        for _ in range(args.requests):
+            r, w = random.choice(tunnels)
+            start = time.perf_counter()
+            w.write(b"ping\n")
+            await r.readline()
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+
+        per_conn = (rss_after - rss_before) / args.connections
+        print("mode:                %s" % ("asyncio" if args.asyncio else "threaded"))
+        print("connections:         %d" % args.connections)
+        print("proxy threads:       %d" % threads)
+        print("RSS per connection:  %.1f KiB" % (per_conn / 1024))
+        print("connections per GB:  %d" % (1024 ** 3 / per_conn if per_conn > 0 else 0))
+        print("latency p50:         %.3f ms" % (statistics.median(latencies) * 1000))
+        print("latency p99:         %.3f ms" % (latencies[int(len(latencies) * 0.99)] * 1000))
+
+        for _, w in tunnels:
+            w.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+        echo_server.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--connections", type=int, default=1000)
+    parser.add_argument("-r", "--requests", type=int, default=5000)
+    parser.add_argument("--asyncio", action="store_true")
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,55 @@
+"""
+Measures reading the flows matching a filter from a dump, comparing a full
+parse of the dump with reading only the flows its index does not rule out.
+
+    python ./flowindex.py
+    python ./flowindex.py -n 50000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from mitmproxy import flowfilter
+from mitmproxy import io
+from mitmproxy.test import tflow
+
+
+def make_dump(path, n):
+    index = io.FlowIndex()
+    with open(path, "wb") as f:
+        w = io.FlowWriter(f, index)
+        for i in range(n):
+            flow = tflow.tflow(resp=True)
+            flow.request.host = "host%d.example.com" % (i % 100)
+            flow.response.content = b"x" * 2048
+            w.add(flow)
+    index.save(path)
+
+
+def bench(path, flt, indexed):
+    start = time.perf_counter()
+    with open(path, "rb") as f:
+        reader = io.FlowReader(f)
+        index = io.FlowIndex.open(path, reader) if indexed else None
+        f.seek(0)
+        n = len(list(reader.filtered(flt, index)))
+    return time.perf_counter() - start, n
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, "flows")
+        make_dump(path, args.flows)
+        print("%24s %8s %12s %12s %8s" % ("filter", "matches", "parse (s)", "indexed (s)", "speedup"))
+        for spec in ("~d host7\\.", "~c 404", "~d host7\\. & ~b xxx", "~b xxx"):
+            flt = flowfilter.parse(spec)
+            full, n = bench(path, flt, False)
+            indexed, _ = bench(path, flt, True)
+            print("%24s %8d %12.2f %12.2f %7.1fx" % (spec, n, full, indexed, full / indexed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--flows", type=int, default=20000)
+    main(parser.parse_args())
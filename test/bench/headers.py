@@ -0,0 +1,81 @@
+"""
+Measures common header operations on messages with many headers, comparing
+the indexed MultiDict with the previous implementation that scans all fields
+on every access.
+
+    python ./headers.py
+    python ./headers.py -n 20000
+"""
+import argparse
+import contextlib
+import time
+
+from mitmproxy.coretypes import multidict
+from mitmproxy.net.http import Headers
+
+
+@contextlib.contextmanager
+def scanning():
+    """
+    Temporarily restore the scanning implementation of the previous MultiDict.
+    """
+    names = ("__delitem__", "__iter__", "__len__", "get_all", "set_all", "insert")
+    saved = {name: multidict.MultiDict.__dict__[name] for name in names}
+    for name in names:
+        setattr(multidict.MultiDict, name, getattr(multidict._MultiDict, name))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(multidict.MultiDict, name, value)
+
+
+def make_fields(n_headers):
+    fields = [(b"Host", b"www.example.com"), (b"Content-Type", b"text/html")]
+    for i in range(n_headers - 3):
+        fields.append((b"X-Header-%d" % i, b"v" * 40))
+    fields.append((b"Accept", b"*/*"))
+    return fields
+
+
+def workload(fields):
+    """
+    Roughly what the proxy and a typical addon do with each message.
+    """
+    h = Headers(fields)
+    h.get("host")
+    h.get("content-type")
+    h.get("content-length")
+    h.get("transfer-encoding")
+    "connection" in h
+    "upgrade" in h
+    h.get_all("accept")
+    h["via"] = "mitmproxy"
+    h["accept"] = "text/html"
+    del h["x-header-0"]
+    len(h)
+
+
+def bench(fields, n):
+    start = time.process_time()
+    for _ in range(n):
+        workload(fields)
+    return (time.process_time() - start) / n
+
+
+def main(args):
+    print("%8s %14s %14s %8s" % ("headers", "scanning (us)", "indexed (us)", "speedup"))
+    for n_headers in (10, 30, 60):
+        fields = make_fields(n_headers)
+        with scanning():
+            old = bench(fields, args.messages)
+        new = bench(fields, args.messages)
+        print("%8d %14.1f %14.1f %7.1fx" % (
+            n_headers, old * 1e6, new * 1e6, old / new
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--messages", type=int, default=5000)
+    main(parser.parse_args())
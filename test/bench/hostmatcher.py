@@ -0,0 +1,73 @@
+"""
+Measures the time it takes to check a connection against ignore_hosts with
+many patterns, comparing the HostMatcher with searching each pattern in turn.
+
+    python ./hostmatcher.py
+    python ./hostmatcher.py -p 5000
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from mitmproxy.proxy.config import HostMatcher
+
+
+class LinearMatcher:
+    """
+    The previous implementation: search every pattern for every connection.
+    """
+
+    def __init__(self, patterns):
+        self.regexes = [re.compile(p, re.IGNORECASE) for p in patterns]
+
+    def __call__(self, address):
+        host = "%s:%s" % address
+        return any(rex.search(host) for rex in self.regexes)
+
+
+def name(rnd):
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(10))
+
+
+def make_patterns(rnd, n, simple):
+    patterns = []
+    for i in range(n):
+        if i < n * simple:
+            patterns.append(r"^(.+\.)?%s\.com:443$" % name(rnd))
+        else:
+            patterns.append(r"%s\.(net|org)" % name(rnd))
+    return patterns
+
+
+def bench(matcher, addresses):
+    start = time.perf_counter()
+    for address in addresses:
+        matcher(address)
+    return (time.perf_counter() - start) / len(addresses)
+
+
+def main(args):
+    rnd = random.Random(0)
+    # Most connections go to a limited set of hosts.
+    hosts = [("www.%s.com" % name(rnd), 443) for _ in range(200)]
+    addresses = [rnd.choice(hosts) for _ in range(args.connections)]
+
+    print("%8s %14s %14s %14s %8s" % ("simple", "linear (us)", "uncached (us)", "cached (us)", "speedup"))
+    for simple in (1, 0.9, 0.5, 0):
+        patterns = make_patterns(rnd, args.patterns, simple)
+        linear = bench(LinearMatcher(patterns), addresses)
+        matcher = HostMatcher(patterns)
+        uncached = bench(lambda a: matcher._match_uncached(*a), addresses)
+        cached = bench(HostMatcher(patterns), addresses)
+        print("%7d%% %14.1f %14.1f %14.1f %7.0fx" % (
+            simple * 100, linear * 1e6, uncached * 1e6, cached * 1e6, linear / cached
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--patterns", type=int, default=1000)
+    parser.add_argument("-n", "--connections", type=int, default=2000)
+    main(parser.parse_args())
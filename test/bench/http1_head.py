@@ -0,0 +1,70 @@
+"""
+Measures the CPU time spent reading and parsing HTTP/1 request heads from a
+socket, comparing the bulk line reader with reading one byte at a time.
+
+    python ./http1_head.py
+    python ./http1_head.py -n 20000
+"""
+import argparse
+import socket
+import time
+
+from mitmproxy.net import tcp
+from mitmproxy.net.http import http1
+
+
+class BytewiseReader:
+    """
+    The previous implementation: one read call per byte.
+    """
+
+    def __init__(self, rfile):
+        self.rfile = rfile
+
+    def readline(self, size=None):
+        result = b''
+        while size is None or len(result) < size:
+            ch = self.rfile.read(1)
+            if not ch:
+                break
+            result += ch
+            if ch == b'\n':
+                break
+        return result
+
+
+def make_head(n_headers):
+    lines = [b"GET /index.html?query=string HTTP/1.1", b"Host: www.example.com"]
+    for i in range(n_headers):
+        lines.append(b"X-Header-%d: %s" % (i, b"v" * 40))
+    return b"\r\n".join(lines) + b"\r\n\r\n"
+
+
+def bench(head, n, bytewise):
+    a, b = socket.socketpair()
+    with a, b:
+        rfile = tcp.Reader(socket.SocketIO(a, "rb"))
+        if bytewise:
+            rfile = BytewiseReader(rfile)
+        start = time.process_time()
+        for _ in range(n):
+            b.sendall(head)
+            http1.read_request_head(rfile)
+        return (time.process_time() - start) / n
+
+
+def main(args):
+    print("%8s %8s %14s %14s %8s" % ("headers", "bytes", "bytewise (us)", "bulk (us)", "speedup"))
+    for n_headers in (5, 15, 40):
+        head = make_head(n_headers)
+        old = bench(head, args.requests, True)
+        new = bench(head, args.requests, False)
+        print("%8d %8d %14.1f %14.1f %7.1fx" % (
+            n_headers, len(head), old * 1e6, new * 1e6, old / new
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--requests", type=int, default=5000)
+    main(parser.parse_args())
@@ -0,0 +1,58 @@
+"""
+Measures how many flows per second are read from a dump, sequentially and
+with a pool of 2, 4 and 8 decoding processes. Reads the given capture, or a
+generated one.
+
+    python ./readflows.py
+    python ./readflows.py -n 100000
+    python ./readflows.py ~/captures/big.flows
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from mitmproxy import io
+from mitmproxy.test import tflow
+
+
+def make_dump(path, n):
+    with open(path, "wb") as f:
+        w = io.FlowWriter(f)
+        for i in range(n):
+            flow = tflow.tflow(resp=True)
+            flow.request.path = "/path/%d" % i
+            flow.response.content = b"x" * 4096
+            w.add(flow)
+
+
+def bench(path, processes):
+    start = time.perf_counter()
+    if processes == 1:
+        with open(path, "rb") as f:
+            n = sum(1 for _ in io.FlowReader(f).stream())
+    else:
+        n = sum(1 for _ in io.ParallelFlowReader(path, processes).stream())
+    return n / (time.perf_counter() - start)
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as d:
+        path = args.path
+        if not path:
+            path = os.path.join(d, "flows")
+            make_dump(path, args.flows)
+        print("%s: %.0f MB, %d CPUs" % (path, os.path.getsize(path) / 1e6, os.cpu_count()))
+        print("%10s %12s %8s" % ("processes", "flows/s", "speedup"))
+        sequential = bench(path, 1)
+        print("%10d %12.0f %7.1fx" % (1, sequential, 1))
+        for processes in (2, 4, 8):
+            rate = bench(path, processes)
+            print("%10d %12.0f %7.1fx" % (processes, rate, rate / sequential))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?")
+    parser.add_argument("-n", "--flows", type=int, default=20000)
+    main(parser.parse_args())
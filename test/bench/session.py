@@ -0,0 +1,80 @@
+"""
+Streams flow updates through the Session addon, measuring the cost of keeping
+its view sorted. Compares the sorted container with the previous list-based
+view, which scans and rebuilds the list on every update.
+
+    python ./session.py
+    python ./session.py -f 50000 -u 1000000
+"""
+import argparse
+import bisect
+import random
+import time
+
+from mitmproxy.addons import session
+from mitmproxy.test import tflow
+
+
+class KeyifyList:
+    def __init__(self, inner, key):
+        self.inner = inner
+        self.key = key
+
+    def __len__(self):
+        return len(self.inner)
+
+    def __getitem__(self, k):
+        return self.key(self.inner[k])
+
+
+class ListSession(session.Session):
+    """
+    The previous implementation: a plain list kept sorted by insertion.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._view = []
+
+    def _set_view(self, entries):
+        self._view = sorted(entries)
+        self._view_keys = {fid: o for o, fid in entries}
+
+    def update_view(self, f):
+        if any([f.id == t[1] for t in self._view]):
+            self._view = [(order, fid) for order, fid in self._view if fid != f.id]
+        o = self._order_store[f.id][self.order]
+        self._view.insert(bisect.bisect_left(KeyifyList(self._view, lambda x: x[0]), o), (o, f.id))
+        self._view_keys[f.id] = o
+
+
+def bench(s, flows, updates, rnd):
+    s.db_store = session.SessionDB()
+    start = time.perf_counter()
+    for i in range(updates):
+        f = flows[i % len(flows)]
+        # Most updates are for recent flows, and move them around a little.
+        f.request.timestamp_start = i + rnd.random() * len(flows)
+        s.update([f])
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    s.set_order("size")
+    s.set_order("time")
+    return elapsed / updates, time.perf_counter() - start
+
+
+def main(args):
+    rnd = random.Random(0)
+    flows = [tflow.tflow(resp=True) for _ in range(args.flows)]
+    print("%14s %10s %16s %14s" % ("view", "updates", "per update (us)", "reorder (ms)"))
+    for cls, updates in ((ListSession, args.compare), (session.Session, args.updates)):
+        per_update, reorder = bench(cls(), flows, updates, rnd)
+        print("%14s %10d %16.1f %14.1f" % (cls.__name__, updates, per_update * 1e6, reorder * 1e3))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--flows", type=int, default=20000)
+    parser.add_argument("-u", "--updates", type=int, default=1000000)
+    parser.add_argument("-c", "--compare", type=int, default=20000, help="Updates for the list-based view.")
+    main(parser.parse_args())
@@ -0,0 +1,54 @@
+"""
+Measures how many flows per second are loaded into the view, adding them one
+at a time as the proxy does, and all at once as when loading a capture.
+
+    python ./viewload.py
+    python ./viewload.py -n 1000000
+"""
+import argparse
+import random
+import time
+
+from mitmproxy.addons import view
+from mitmproxy.test import tflow
+
+
+def make_flows(n):
+    rnd = random.Random(0)
+    template = tflow.tflow(resp=True)
+    flows = []
+    for i in range(n):
+        f = template.copy()
+        f.request.timestamp_start = rnd.random() * n
+        f.request.path = "/path/%d" % rnd.randrange(n)
+        flows.append(f)
+    return flows
+
+
+def bench(flows, order, bulk):
+    v = view.View()
+    v.set_order(order)
+    start = time.perf_counter()
+    if bulk:
+        v.add(flows)
+    else:
+        for f in flows:
+            v.add([f])
+    elapsed = time.perf_counter() - start
+    assert len(v) == len(flows)
+    return len(flows) / elapsed
+
+
+def main(args):
+    flows = make_flows(args.flows)
+    print("%8s %16s %16s %8s" % ("order", "single (flows/s)", "bulk (flows/s)", "speedup"))
+    for order in ("time", "url", "size"):
+        single = bench(flows, order, False)
+        bulk = bench(flows, order, True)
+        print("%8s %16d %16d %7.1fx" % (order, single, bulk, bulk / single))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--flows", type=int, default=100000)
+    main(parser.parse_args())
@@ -45,6 +45,8 @@ class TestReadFile:
             tctx.configure(rf, readfile_filter="~q")
             with pytest.raises(Exception, match="Invalid readfile filter"):
                 tctx.configure(rf, readfile_filter="~~")
+            with pytest.raises(exceptions.OptionsError):
+                tctx.configure(rf, readfile_processes=0)
 
     @pytest.mark.asyncio
     async def test_read(self, tmpdir, data, corrupt_data):
@@ -71,6 +73,66 @@ class TestReadFile:
             rf.running()
             assert await tctx.master.await_log("corrupted")
 
+    @pytest.mark.asyncio
+    async def test_read_index(self, tmpdir, data):
+        rf = readfile.ReadFile()
+        with taddons.context(rf) as tctx:
+            tf = str(tmpdir.join("tfile"))
+            index = mitmproxy.io.FlowIndex()
+            with open(tf, "wb") as f:
+                w = mitmproxy.io.FlowWriter(f, index)
+                for flow in mitmproxy.io.FlowReader(data).stream():
+                    w.add(flow)
+            index.save(tf)
+            # Corrupt the first flow, which the filter rules out.
+            with open(tf, "r+b") as f:
+                f.write(b"x" * index.entries[1].offset)
+
+            with asynctest.patch('mitmproxy.master.Master.load_flow') as mck:
+                tctx.configure(rf, readfile_filter="~tcp")
+                assert await rf.load_flows_from_path(tf) == 2
+                assert mck.await_count == 2
+
+                tctx.configure(rf, readfile_filter=None)
+                with pytest.raises(exceptions.FlowReadException):
+                    await rf.load_flows_from_path(tf)
+
+    @pytest.mark.asyncio
+    async def test_read_parallel(self, tmpdir, data, corrupt_data):
+        rf = readfile.ReadFile()
+        with taddons.context(rf) as tctx:
+            tf = tmpdir.join("tfile")
+            tf.write(data.getvalue())
+            tctx.configure(rf, readfile_processes=2, readfile_filter="~tcp")
+            with asynctest.patch('mitmproxy.master.Master.load_flow') as mck:
+                assert await rf.load_flows_from_path(str(tf)) == 2
+                assert mck.await_count == 2
+
+            tf.write(corrupt_data.getvalue())
+            tctx.configure(rf, readfile_filter=None)
+            with pytest.raises(exceptions.FlowReadException):
+                await rf.load_flows_from_path(str(tf))
+            assert await tctx.master.await_log("corrupted - loaded 4 flows")
+
+    @pytest.mark.asyncio
+    async def test_load_error_stops_reading(self):
+        rf = readfile.ReadFile()
+        closed = []
+
+        async def flows():
+            try:
+                yield tflow.tflow()
+                yield tflow.tflow()
+            finally:
+                closed.append(True)
+
+        with taddons.context(rf):
+            with asynctest.patch('mitmproxy.master.Master.load_flow') as mck:
+                mck.side_effect = ValueError
+                with pytest.raises(ValueError):
+                    await rf._load_flows(flows())
+        assert closed
+
     @pytest.mark.asyncio
     async def test_corrupt(self, corrupt_data):
         rf = readfile.ReadFile()
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 
 from mitmproxy.test import taddons
@@ -76,6 +78,46 @@ def test_save_command(tmpdir):
         tctx.master.commands.call_strings("save.file", ["@shown", p])
 
 
+def rd_index(p):
+    with open(p, "rb") as f:
+        return io.FlowIndex.open(p, io.FlowReader(f))
+
+
+@pytest.mark.asyncio
+async def test_save_index(tmpdir):
+    sa = save.Save()
+    with taddons.context(sa) as tctx:
+        p = str(tmpdir.join("foo"))
+        sa.save([tflow.tflow(resp=True)], p)
+        assert rd_index(p) is None
+
+        tctx.configure(sa, save_index=True)
+        sa.save([tflow.tflow(resp=True), tflow.ttcpflow()], p)
+        assert len(rd_index(p)) == 2
+        sa.save([tflow.tflow(resp=True)], "+" + p)
+        index = rd_index(p)
+        assert len(index) == 3
+        assert index.size == os.path.getsize(p)
+
+        p2 = str(tmpdir.join("bar"))
+        tctx.configure(sa, save_stream_file="+" + p2)
+        f = tflow.tflow(resp=True)
+        sa.request(f)
+        sa.response(f)
+        tctx.configure(sa, save_stream_file=None)
+        assert [e.id for e in rd_index(p2).entries] == [f.id]
+
+        # Appending to a file without an index does not create one.
+        os.remove(p + ".idx")
+        sa.save([tflow.tflow(resp=True)], "+" + p)
+        assert not os.path.exists(p + ".idx")
+
+        tctx.configure(sa, save_stream_file=str(tmpdir.join("baz")))
+        tmpdir.join("baz.idx").mkdir()
+        tctx.configure(sa, save_stream_file=None)
+        assert await tctx.master.await_log("Cannot write flow index")
+
+
 def test_simple(tmpdir):
     sa = save.Save()
     with taddons.context(sa) as tctx:
@@ -1,10 +1,17 @@
+import gzip
 import sqlite3
 import asyncio
+import threading
+import time
 import pytest
 import os
 
 from mitmproxy import ctx
+from mitmproxy import exceptions
+from mitmproxy import flowfilter
 from mitmproxy import http
+from mitmproxy.io import protobuf
+from mitmproxy.net.http import encoding
 from mitmproxy.test import tflow, tutils
 from mitmproxy.test import taddons
 from mitmproxy.addons import session
@@ -12,8 +19,182 @@ from mitmproxy.exceptions import SessionLoadException, CommandError
 from mitmproxy.utils.data import pkg_data
 
 
+class TestFilterQuery:
+
+    @staticmethod
+    def flows():
+        flows = []
+        for method in ("GET", "POST"):
+            f = tflow.tflow()
+            f.request.method = method
+            f.request.headers["content-type"] = "application/json"
+            flows.append(f)
+            f = tflow.tflow(resp=True)
+            f.request.method = method
+            f.request.host = "example.com"
+            f.response.headers.add("content-type", "text/html")
+            f.response.headers.add("content-type", "image/png")
+            flows.append(f)
+            f = tflow.tflow(resp=True, err=True)
+            f.request.method = method
+            f.request.path = "/other"
+            f.response.status_code = 404
+            f.response.content = b"not found"
+            flows.append(f)
+            f = tflow.tflow(resp=True)
+            f.request.method = method
+            f.response.content = b"compressed \"quoted\" text"
+            f.response.encode("gzip")
+            flows.append(f)
+        flows[-1].marked = True
+        return flows
+
+    @pytest.mark.parametrize("spec, pushed, residual", [
+        ("~m get", True, False),
+        ("~m ^get$", True, False),
+        ("~m ^PO", True, False),
+        ("~d example", True, False),
+        ("~d ^EXAMPLE\\.com$", True, False),
+        ("~d ^address", True, False),
+        ("~u ^http://address:22/other", True, False),
+        ("~u ^HTTP://address", True, False),
+        ("~u '(?i)^HTTP://address'", True, False),
+        ("!~m ^get", True, False),
+        ("~u other", True, False),
+        ("other", True, False),
+        ("~c 404", True, False),
+        ("!~c 404", True, False),
+        ("~q", True, False),
+        ("~s", True, False),
+        ("~e", True, False),
+        ("~http", True, False),
+        ("~tcp", True, False),
+        ("!~websocket", True, False),
+        ("~t json", True, False),
+        ("~tq json", True, False),
+        ("~ts ^image/png$", True, False),
+        ("~m post & ~c 404", True, False),
+        ("~m post | ~d example", True, False),
+        ("!(~m get & ~c 404)", True, False),
+        ("~m get & ~b found", True, True),
+        ("~c 404 & (~b found | ~h foo)", True, True),
+        ("~m get | ~b found", False, True),
+        ("!(~m get & ~b found)", False, True),
+        ("~marked", False, True),
+        ("~src address", False, True),
+        ("~b found", False, True),
+        ("~b ^not", False, True),
+        ("~b quoted..text", False, True),
+        ("~bs essed", False, True),
+        ("~bq essed", False, True),
+        ("~b '\"quoted\"'", False, True),
+        ("~b fo|mes", False, True),
+        ("~u oth & ~bs found", True, True),
+    ])
+    @pytest.mark.parametrize("fts", [False, True])
+    def test_equivalence(self, spec, pushed, residual, fts):
+        flt = flowfilter.parse(spec)
+        query = session.FilterQuery(flt, fts)
+        if not fts:
+            assert (query.where is not None) == pushed
+        assert (query.residual is not None) == residual
+
+        flows = self.flows()
+        db = session.SessionDB(fts=fts)
+        assert db.fts == fts
+        db.store_flows(flows)
+        expected = {f.id for f in flows if flt(f)}
+        matched = {f.id for f in db.filter_flows(query) if query.residual is None or query.residual(f)}
+        assert matched == expected
+        if not residual:
+            assert {row[0] for row in db.filter_orders(query)} == expected
+
+    @pytest.mark.parametrize("spec, index", [
+        ("~m ^GET$", "flow_method_nocase"),
+        ("~d ^example\\.com", "flow_host_nocase"),
+        ("~u ^https://example\\.com/", "flow_pretty_url"),
+        ("~m ^GET & ~c 200", "flow_"),
+        ("~m GET", None),
+        ("~u '(?i)^https://'", None),
+    ])
+    def test_query_plan(self, spec, index):
+        db = session.SessionDB()
+        query = session.FilterQuery(flowfilter.parse(spec))
+        db.active_query[0] = query
+        plan = " ".join(row[-1] for row in db.con.execute(f"EXPLAIN QUERY PLAN SELECT id FROM flow f WHERE {query.where};"))
+        if index:
+            assert f"USING INDEX {index}" in plan
+            if "~d" in spec:
+                assert "USING INDEX flow_pretty_host_nocase" in plan
+        else:
+            assert "USING INDEX" not in plan
+
+    @pytest.mark.parametrize("pattern, prefix", [
+        ("^foo$", "foo"),
+        ("^foo.*bar", "foo"),
+        (b"^ab+", "a"),
+        (b"^ab\xff", "ab"),
+        ("foo", None),
+        ("^", None),
+        ("^foo|bar", None),
+        ("[", None),
+    ])
+    def test_anchored_prefix(self, pattern, prefix):
+        assert session.FilterQuery.anchored_prefix(pattern) == prefix
+
+    @pytest.mark.parametrize("pattern, literal", [
+        ("foo", "foo"),
+        ("foo.*barbaz", "barbaz"),
+        ("^foo$", "foo"),
+        ("a|bcd", None),
+        ("(abc)", None),
+        ("ab+", "a"),
+        ("(?i)Hello", "Hello"),
+        (b"foo\xffbarbaz", "barbaz"),
+        ("[", None),
+    ])
+    def test_required_literal(self, pattern, literal):
+        assert session.FilterQuery.required_literal(pattern) == literal
+
+    def test_fts(self):
+        q = session.FilterQuery(flowfilter.parse("~b found"), fts=True)
+        assert "flow_fts" in q.where
+        q = session.FilterQuery(flowfilter.parse("~b fo"), fts=True)
+        assert q.where is None
+
+        db = session.SessionDB(fts=True)
+        f = tflow.tflow(resp=True)
+        f.response.content = b"first version"
+        db.store_flows([f])
+        f.response.content = b"second version"
+        db.store_flows([f])
+        search = "SELECT rowid FROM flow_fts WHERE flow_fts MATCH ?;"
+        assert len(db.con.execute(search, ['"version"']).fetchall()) == 1
+        assert not db.con.execute(search, ['"first"']).fetchall()
+
+        assert db.set_fts(False)
+        assert not db.fts
+        assert not db.con.execute("SELECT 1 FROM sqlite_master WHERE name = 'flow_fts';").fetchall()
+        assert db.set_fts(True)
+        assert db.con.execute(search, ['"second"']).fetchall()
+        db.clear()
+        assert not db.con.execute(search, ['"second"']).fetchall()
+
+    def test_orders(self):
+        f = tflow.tflow(resp=True)
+        db = session.SessionDB()
+        db.store_flows([f])
+        s = session.Session()
+        assert db.filter_orders(session.FilterQuery(None)) == [
+            (f.id,) + tuple(s._generate_order(o, f) for o in session.orders)
+        ]
+
+
 class TestSession:
 
+    bodies = "SELECT b.type_id, c.content FROM body b JOIN body_content c ON b.hash = c.hash " \
+             "WHERE b.flow_id = ? ORDER BY b.type_id;"
+
     @staticmethod
     def tft(*, method="GET", start=0):
         f = tflow.tflow()
@@ -73,7 +254,7 @@ class TestSession:
         with con:
             con.executescript(qry)
             blob = b'blob_of_data'
-            con.execute(f'INSERT INTO FLOW VALUES(1, "{blob}");')
+            con.execute(f'INSERT INTO FLOW (id, content) VALUES(1, "{blob}");')
         con.close()
         session.SessionDB(path)
         con = sqlite3.connect(path)
@@ -85,6 +266,212 @@ class TestSession:
         con.close()
         os.remove(path)
 
+    def test_session_migrate(self, tdata):
+        path = tdata.path('mitmproxy/data/') + '/test_mg.sqlite'
+        if os.path.isfile(path):
+            os.remove(path)
+        f = tflow.tflow(resp=True)
+        con = sqlite3.connect(path)
+        with con:
+            con.executescript(
+                "CREATE TABLE flow (id VARCHAR(36) PRIMARY KEY, content BLOB);"
+                "CREATE TABLE body (id INTEGER PRIMARY KEY, flow_id VARCHAR(36), type_id INTEGER, content BLOB);"
+                "CREATE TABLE annotation (id INTEGER PRIMARY KEY, flow_id VARCHAR(36), type VARCHAR(16), content BLOB);"
+                "CREATE INDEX flow_host ON flow(id);"
+            )
+            con.execute("INSERT INTO flow VALUES(?, ?);", (f.id, protobuf.dumps(f)))
+            con.execute("INSERT INTO body (flow_id, type_id, content) VALUES(?, 2, ?);", (f.id, b"old"))
+            con.execute("INSERT INTO body (flow_id, type_id, content) VALUES(?, 2, ?);", (f.id, b"new"))
+        con.close()
+        db = session.SessionDB(path)
+        assert f.id in db
+        assert db.con.execute("SELECT method, status_code FROM flow;").fetchall() == [("GET", 200)]
+        assert len(db.filter_orders(session.FilterQuery(flowfilter.parse("~c 200")))) == 1
+        assert db.retrieve_flows()[0].response.content == b"new"
+        assert db.con.execute("SELECT content, refs FROM body_content;").fetchall() == [(b"new", 1)]
+        assert "body_old" not in {t for t, in db.con.execute("SELECT name FROM sqlite_master;")}
+        indexes = {i for i, in db.con.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL;")}
+        assert indexes == {
+            "flow_method_nocase", "flow_host_nocase", "flow_pretty_host_nocase", "flow_pretty_url",
+            "flow_status_code", "body_flow"
+        }
+        del db
+        os.remove(path)
+
+    @pytest.mark.parametrize("encoding", [None, "gzip"])
+    def test_session_migrate_content_length(self, tmpdir, encoding):
+        path = str(tmpdir.join("old.sqlite"))
+        f = tflow.tflow(resp=True)
+        if encoding:
+            f.response.headers["content-encoding"] = encoding
+        f.response.content = b"A" * 2000
+        body = f.response.content
+        # Sessions used to store the body separately and the flow with an empty body.
+        f.response.content = b""
+        con = sqlite3.connect(path)
+        with con:
+            con.executescript(
+                "CREATE TABLE flow (id VARCHAR(36) PRIMARY KEY, content BLOB);"
+                "CREATE TABLE body (id INTEGER PRIMARY KEY, flow_id VARCHAR(36), type_id INTEGER, content BLOB);"
+                "CREATE TABLE annotation (id INTEGER PRIMARY KEY, flow_id VARCHAR(36), type VARCHAR(16), content BLOB);"
+            )
+            con.execute("INSERT INTO flow VALUES(?, ?);", (f.id, protobuf.dumps(f)))
+            con.execute("INSERT INTO body (flow_id, type_id, content) VALUES(?, 2, ?);", (f.id, body))
+        con.close()
+
+        db = session.SessionDB(path)
+        loaded = db.retrieve_flows()[0]
+        assert loaded.response.content == body
+        assert loaded.response.headers["content-length"] == str(len(loaded.response.raw_content))
+        assert loaded.request.headers["content-length"] == str(len(loaded.request.raw_content))
+        assert db.con.execute("SELECT response_size FROM flow;").fetchone() == (len(loaded.response.raw_content),)
+        del db
+
+    def test_body_dedup(self):
+        db = session.SessionDB()
+        db.content_threshold = 7
+        flows = [tflow.tflow(resp=True) for _ in range(3)]
+        for f in flows:
+            f.response.content = b"shared body"
+        flows[2].request.content = b"shared body"
+        db.store_flows(flows)
+        assert db.con.execute("SELECT refs FROM body_content;").fetchall() == [(4,)]
+        assert [f.response.content for f in db.retrieve_flows()] == [b"shared body"] * 3
+
+        flows[0].response.content = b"changed body"
+        flows[1].response.content = b"-"
+        db.store_flows(flows[:2])
+        assert sorted(db.con.execute("SELECT content, refs FROM body_content;").fetchall()) == [
+            (b"changed body", 1), (b"shared body", 2)
+        ]
+        assert sorted(f.response.content for f in db.retrieve_flows()) == [b"-", b"changed body", b"shared body"]
+
+        flows[0].response.content = b"shared body"
+        db.store_flows(flows[:1])
+        assert db.con.execute("SELECT content, refs FROM body_content;").fetchall() == [(b"shared body", 3)]
+        db.clear()
+        assert not db.con.execute("SELECT * FROM body_content;").fetchall()
+        assert not db.body_hashes
+
+    def test_store_rollback(self, monkeypatch):
+        db = session.SessionDB()
+        db.content_threshold = 7
+        flows = [tflow.tflow(resp=True) for _ in range(2)]
+        flows[0].response.content = b"stored body"
+        db.store_flows(flows[:1])
+        flows[0].response.content = b"changed body"
+        flows[1].response.content = b"new body!"
+        dumps = protobuf.dumps
+
+        def fail(f):
+            if f.id == flows[1].id:
+                raise ValueError("boom")
+            return dumps(f)
+
+        monkeypatch.setattr(protobuf, "dumps", fail)
+        with pytest.raises(ValueError):
+            db.store_flows(flows)
+        assert len(db) == 1
+        assert list(db.body_hashes) == [(flows[0].id, 2)]
+        assert db.retrieve_flows()[0].response.content == b"stored body"
+
+        monkeypatch.setattr(protobuf, "dumps", dumps)
+        db.store_flows(flows)
+        assert sorted(f.response.content for f in db.retrieve_flows()) == [b"changed body", b"new body!"]
+
+    def test_body_compression(self):
+        db = session.SessionDB()
+        flows = [tflow.tflow(resp=True) for _ in range(3)]
+        flows[0].response.content = b"hello world " * 200
+        flows[1].response.headers["content-type"] = "image/png"
+        flows[1].response.content = b"not a png " * 200
+        flows[2].response.content = os.urandom(2000)
+        db.store_flows(flows)
+        rows = sorted(db.con.execute("SELECT length(content), codec FROM body_content;").fetchall())
+        assert rows[0][0] < 100
+        assert rows == [(rows[0][0], db.CODEC_ZLIB), (2000, db.CODEC_RAW), (2000, db.CODEC_RAW)]
+        assert {f.id: f.response.content for f in db.retrieve_flows()} == {f.id: f.response.content for f in flows}
+        stats = db.compression_stats()
+        assert stats["raw_bytes"] == 6400
+        assert stats["stored_bytes"] == 4000 + rows[0][0]
+        assert stats["compression_ratio"] > 1
+        assert stats["decompress_time"] >= 0
+
+        db.compress = False
+        flows[0].response.content = b"hello again " * 200
+        db.store_flows(flows[:1])
+        assert db.retrieve_flows([flows[0].id])[0].response.content == b"hello again " * 200
+
+    def test_body_compression_dict(self):
+        db = session.SessionDB()
+        db.compress_dict = True
+        db.dict_size = 4000
+        flows = [tflow.tflow(resp=True) for _ in range(5)]
+        for i, f in enumerate(flows):
+            f.response.headers["content-type"] = "application/json"
+            f.response.content = b'{"id": %d, "name": "item", "values": [%s]}' % (
+                i, b", ".join(b"%d" % (i * j) for j in range(300))
+            )
+        db.store_flows(flows)
+        assert len(db.dictionaries) == 1
+        dict_id = next(iter(db.dictionaries))
+        assert db.con.execute("SELECT count(*) FROM body_content WHERE dict_id = ?;", (dict_id,)).fetchone()[0]
+        db2 = session.SessionDB(db.path)
+        assert db2.dictionaries == db.dictionaries
+        assert {f.id: f.response.content for f in db2.retrieve_flows()} == {f.id: f.response.content for f in flows}
+
+    def test_lazy_bodies(self):
+        db = session.SessionDB()
+        f = tflow.tflow(resp=True)
+        f.request.content = b"request body " * 100
+        f.response.encode("gzip")
+        f.response.content = b"response body " * 100
+        db.store_flows([f])
+        lf = db.retrieve_flows()[0]
+        assert not lf.request.data.content_loaded
+        assert not lf.response.data.content_loaded
+        assert lf.response.headers["content-length"] == f.response.headers["content-length"]
+
+        # Unchanged bodies are not loaded to write the flow again.
+        lf.marked = True
+        db.store_flows([lf])
+        assert not lf.request.data.content_loaded
+        assert db.con.execute("SELECT refs FROM body_content;").fetchall() == [(1,), (1,)]
+
+        lf = db.retrieve_flows()[0]
+        assert lf.marked
+        assert lf.request.content == b"request body " * 100
+        assert lf.response.headers["content-encoding"] == "gzip"
+        assert lf.response.content == b"response body " * 100
+        assert lf.response.data.content_loaded
+
+        # Content accessed by another thread than the one the database was opened on.
+        lf = db.retrieve_flows()[0]
+        result = []
+        t = threading.Thread(target=lambda: result.append(lf.request.content))
+        t.start()
+        t.join()
+        assert result == [b"request body " * 100]
+
+    @pytest.mark.parametrize("lines", [100, 5000])
+    def test_bodies_stored_as_sent(self, lines):
+        db = session.SessionDB()
+        f = tflow.tflow(resp=True)
+        f.request.method = "POST"
+        body = b"".join(b"line %d of the body\n" % i for i in range(lines))
+        # Not what encoding.encode produces with its default compression level.
+        f.request.raw_content = gzip.compress(body, 1)
+        f.request.headers["content-encoding"] = "gzip"
+        f.request.headers["content-length"] = str(len(f.request.raw_content))
+        assert f.request.raw_content != encoding.encode(body, "gzip")
+        raw = f.request.raw_content
+        db.store_flows([f])
+        lf = db.retrieve_flows()[0]
+        assert lf.request.data.content_size == len(raw)
+        assert lf.request.raw_content == raw
+        assert lf.request.headers["content-length"] == str(len(raw))
+        assert lf.request.content == body
+
     def test_session_order_generators(self):
         s = session.Session()
         tf = tflow.tflow(resp=True)
@@ -98,6 +485,9 @@ class TestSession:
         s = session.Session()
         ctx.options = taddons.context()
         ctx.options.session_path = None
+        ctx.options.session_fts = False
+        ctx.options.session_compress = True
+        ctx.options.session_compress_dict = False
         s.running()
         f = self.tft(start=1)
         assert s.store_count() == 0
@@ -159,6 +549,247 @@ class TestSession:
         s.set_filter(None)
         assert len(s._view) == 4
 
+    @pytest.mark.asyncio
+    async def test_storage_filter_stored(self):
+        s = self.start_session(fp=0.5)
+        flows = [self.tft(method=m, start=i) for i, m in enumerate(["get", "put", "get", "put"])]
+        s.update(flows)
+        await asyncio.sleep(1)
+        assert len(s._hot_store) == 0
+        s.request(flows[2])
+        s.set_filter("~m get")
+        assert s._view == [(0, flows[0].id), (2, flows[2].id)]
+        s.set_filter("~m put & ~b nomatch")
+        assert s._view == []
+        s.set_filter("~m put & !~b nomatch")
+        assert s._view == [(1, flows[1].id), (3, flows[3].id)]
+        s.set_order("method")
+        assert [f.request.method for f in s.load_view()] == ["PUT", "PUT"]
+        s.set_filter(None)
+        assert len(s._view) == 4
+
+    def test_update_view(self):
+        s = self.start_session()
+        s.set_filter("~m get")
+        flows = [self.tft(start=i) for i in range(3)]
+        s.update(flows)
+        assert s._view == [(0, flows[0].id), (1, flows[1].id), (2, flows[2].id)]
+        flows[0].request.timestamp_start = 5
+        s.update([flows[0]])
+        assert s._view == [(1, flows[1].id), (2, flows[2].id), (5, flows[0].id)]
+        assert s.view_index(flows[0].id) == 2
+        flows[1].request.method = "PUT"
+        s.update([flows[1]])
+        assert s._view == [(2, flows[2].id), (5, flows[0].id)]
+        assert s._view_keys == {flows[2].id: 2, flows[0].id: 5}
+        s.set_order("method")
+        assert s._view == sorted([("GET", flows[0].id), ("GET", flows[2].id)])
+        s.clear_storage()
+        assert not s._view and not s._view_keys
+
+    def test_load_view_window(self):
+        s = self.start_session()
+        flows = [self.tft(start=i) for i in range(10)]
+        s.update(flows[:6])
+        s.db_store.store_flows(list(s._hot_store.values()))
+        s._hot_store.clear()
+        flows[4].request.method = "PUT"
+        s.update(flows[4:])
+
+        assert [f.id for f in s.load_view()] == [f.id for f in flows]
+        assert [f.id for f in s.load_view(3, 4)] == [f.id for f in flows[3:7]]
+        assert [f.id for f in s.load_view(8, 4)] == [f.id for f in flows[8:]]
+        assert [f.id for f in s.load_view(-1, 2)] == [f.id for f in flows[:2]]
+        assert s.load_view(20, 5) == []
+        assert s.load_view(0, 0) == []
+        # Flows only in the hot store do not pull in stored ones.
+        assert [f.id for f in s.load_view(7, 2)] == [f.id for f in flows[7:9]]
+
+        summaries = s.load_summaries(3, 3)
+        assert [i["id"] for i in summaries] == [f.id for f in flows[3:6]]
+        assert [i["timestamp_start"] for i in summaries] == [3, 4, 5]
+        assert [i["method"] for i in summaries] == ["GET", "PUT", "GET"]
+        assert summaries[0]["url"] == flows[3].request.url
+        assert summaries[0]["status_code"] is None
+
+        assert s.view_index(flows[5].id) == 5
+        s.set_order("method")
+        assert s.view_index(flows[4].id) == 9
+        assert s.view_index(flows[7].id) in range(9)
+        with pytest.raises(ValueError):
+            s.view_index("nonexistent")
+        s.set_filter("~m put")
+        with pytest.raises(ValueError):
+            s.view_index(flows[5].id)
+
+    @pytest.mark.asyncio
+    async def test_storage_fts(self):
+        s = self.start_session(fp=0.5)
+        # The option applies to a session without flows as well.
+        with taddons.context() as tctx:
+            tctx.master.addons.add(s)
+            tctx.options.session_fts = True
+        assert s.db_store.fts
+        with taddons.context() as tctx:
+            tctx.master.addons.add(s)
+            tctx.options.session_fts = False
+        assert not s.db_store.fts
+        flows = [self.tft(start=i) for i in range(3)]
+        flows[1].request.content = b"needle"
+        s.update(flows)
+        await asyncio.sleep(1)
+        with taddons.context() as tctx:
+            tctx.master.addons.add(s)
+            tctx.options.session_fts = True
+        assert s.db_store.fts
+        s.set_filter("~bq needle")
+        assert s._view == [(1, flows[1].id)]
+        with taddons.context() as tctx:
+            tctx.master.addons.add(s)
+            tctx.options.session_fts = False
+        assert not s.db_store.fts
+        s.set_filter("~bq needle")
+        assert s._view == [(1, flows[1].id)]
+
+    def test_writer_options(self):
+        s = session.Session()
+        with taddons.context(s) as tctx:
+            tctx.configure(s, session_flush_interval=500, session_flush_batch=10, session_hot_max=20)
+            assert s._FP_DEFAULT == s._flush_period == 0.5
+            assert s._flush_rate == 10
+            assert s._hot_max == 20
+            with pytest.raises(exceptions.OptionsError):
+                tctx.configure(s, session_flush_batch=0)
+
+    def test_compress_options(self):
+        s = self.start_session()
+        with taddons.context(s) as tctx:
+            tctx.configure(s, session_compress=False, session_compress_dict=True)
+        assert not s.db_store.compress
+        assert s.db_store.compress_dict
+        assert s.stats()["raw_bytes"] == 0
+
+    def test_wal(self):
+        db = session.SessionDB()
+        assert db.con.execute("PRAGMA journal_mode;").fetchone() == ("wal",)
+
+    @pytest.mark.asyncio
+    async def test_storage_writer(self):
+        s = self.start_session(fp=60)
+        s._hot_max = 5
+        s._flush_rate = 2
+        threads = []
+        store_snapshot = s.db_store.store_snapshot
+        loop = asyncio.get_event_loop()
+
+        def store(snapshot, generation):
+            threads.append(threading.get_ident())
+            # An update while the flows are written keeps them in the hot store.
+            if len(threads) == 1:
+                loop.call_soon_threadsafe(s.update, [flows[0]])
+            return store_snapshot(snapshot, generation)
+
+        s.db_store.store_snapshot = store
+        flows = [self.tft(start=i) for i in range(5)]
+        s.update(flows)
+        # The writer does not wait for the flush interval once the hot store is full.
+        for _ in range(100):
+            await asyncio.sleep(0.02)
+            if not s._hot_store:
+                break
+        assert threading.get_ident() not in threads
+        assert len(threads) == 3
+        assert s.db_store.id_ledger == {f.id for f in flows}
+        stats = s.stats()
+        assert stats["hot"] == stats["writing"] == 0
+        assert stats["flushes"] == 3
+        assert stats["flushed"] == 6
+        assert 0 < stats["flush_time_avg"] <= stats["flush_time_max"]
+        s.done()
+
+    @pytest.mark.asyncio
+    async def test_storage_writer_error(self):
+        s = self.start_session(fp=0.1)
+        store_snapshot = s.db_store.store_snapshot
+        calls = []
+
+        def store(snapshot, generation):
+            calls.append(len(snapshot))
+            if len(calls) == 1:
+                raise sqlite3.OperationalError("disk I/O error")
+            return store_snapshot(snapshot, generation)
+
+        s.db_store.store_snapshot = store
+        flows = [self.tft(start=i) for i in range(3)]
+        with taddons.context() as tctx:
+            s.update(flows)
+            for _ in range(100):
+                await asyncio.sleep(0.05)
+                if len(calls) > 1 and not s._hot_store:
+                    break
+            assert tctx.master.has_log("Writing 3 flows to the session failed", "error")
+        assert calls == [3, 3]
+        assert s.stats()["write_errors"] == 1
+        assert s.db_store.id_ledger == {f.id for f in flows}
+        assert s._backoff == 0
+        s.update([self.tft(start=3)])
+        for _ in range(40):
+            await asyncio.sleep(0.05)
+            if not s._hot_store:
+                break
+        assert len(s.db_store) == 4
+        s.done()
+
+    def test_clear_during_write(self, monkeypatch):
+        db = session.SessionDB()
+        db.content_threshold = 7
+        flows = [tflow.tflow(resp=True) for _ in range(2)]
+        for f in flows:
+            f.response.content = b"some body"
+        store_flows = db._store_flows
+        writing = threading.Event()
+
+        def slow_store(con, snapshot):
+            writing.set()
+            time.sleep(0.2)
+            store_flows(con, snapshot)
+
+        monkeypatch.setattr(db, "_store_flows", slow_store)
+        generation = db.generation
+        snapshot = db.snapshot(flows[:1])
+        t = threading.Thread(target=db.store_snapshot, args=(snapshot, generation))
+        t.start()
+        writing.wait()
+        # Clearing waits for the write in progress instead of being undone by it.
+        db.clear()
+        assert not t.is_alive()
+        assert not len(db)
+        assert not db.body_hashes
+        assert not db.con.execute("SELECT * FROM flow;").fetchall()
+
+        # Snapshots taken before clearing are dropped.
+        snapshot = db.snapshot(flows[1:])
+        db.clear()
+        assert not db.store_snapshot(snapshot, generation + 1)
+        assert not len(db)
+        assert db.store_snapshot(db.snapshot(flows[1:]), db.generation)
+        assert len(db) == 1
+
+    @pytest.mark.asyncio
+    async def test_done(self):
+        s = self.start_session(fp=60)
+        flows = [self.tft(start=i) for i in range(3)]
+        s.update(flows)
+        task = s._writer_task
+        s.done()
+        await asyncio.sleep(0)
+        assert task.cancelled()
+        assert not s._hot_store
+        assert s.db_store.id_ledger == {f.id for f in flows}
+        assert s.store_count() == 3
+        # Nothing is left to write.
+        s.done()
+
     @pytest.mark.asyncio
     async def test_storage_flush_with_specials(self):
         s = self.start_session(fp=0.5)
@@ -191,17 +822,16 @@ class TestSession:
         # Need to test for configure
         # Need to test for set_order
         s = self.start_session(fp=0.5)
+        s.db_store.compress = False
         f = self.tft()
         f2 = self.tft(start=1)
         f.request.content = b"A" * 1001
         s.request(f)
         s.request(f2)
         await asyncio.sleep(1.0)
-        content = s.db_store.con.execute(
-            "SELECT type_id, content FROM body WHERE body.flow_id == (?);", [f.id]
-        ).fetchall()[0]
+        content = s.db_store.con.execute(self.bodies, [f.id]).fetchall()[0]
         assert content == (1, b"A" * 1001)
-        assert s.db_store.body_ledger == {f.id}
+        assert list(s.db_store.body_hashes) == [(f.id, 1)]
         f.response = http.HTTPResponse.wrap(tutils.tresp(content=b"A" * 1001))
         f2.response = http.HTTPResponse.wrap(tutils.tresp(content=b"A" * 1001))
         # Content length is wrong for some reason -- quick fix
@@ -210,15 +840,13 @@ class TestSession:
         s.response(f)
         s.response(f2)
         await asyncio.sleep(1.0)
-        rows = s.db_store.con.execute(
-            "SELECT type_id, content FROM body WHERE body.flow_id == (?);", [f.id]
-        ).fetchall()
-        assert len(rows) == 1
-        rows = s.db_store.con.execute(
-            "SELECT type_id, content FROM body WHERE body.flow_id == (?);", [f2.id]
-        ).fetchall()
-        assert len(rows) == 1
-        assert s.db_store.body_ledger == {f.id}
+        rows = s.db_store.con.execute(self.bodies, [f.id]).fetchall()
+        assert rows == [(1, b"A" * 1001), (2, b"A" * 1001)]
+        rows = s.db_store.con.execute(self.bodies, [f2.id]).fetchall()
+        assert rows == [(2, b"A" * 1001)]
+        # Identical bodies are stored once.
+        assert s.db_store.con.execute("SELECT refs FROM body_content;").fetchall() == [(3,)]
+        assert set(s.db_store.body_hashes) == {(f.id, 1), (f.id, 2), (f2.id, 2)}
         assert all([lf.__dict__ == rf.__dict__ for lf, rf in list(zip(s.load_view(), [f, f2]))])
 
     @pytest.mark.asyncio
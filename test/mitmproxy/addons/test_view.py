@@ -1,3 +1,5 @@
+import asyncio
+
 import pytest
 
 from mitmproxy.test import tflow
@@ -53,6 +55,18 @@ def test_order_generators():
     assert sz.generate(tf) == len(tf.request.raw_content) + len(tf.response.raw_content)
 
 
+def test_matchall():
+    norequest = tflow.tflow()
+    norequest.request = None
+    nohandshake = tflow.twebsocketflow()
+    nohandshake.handshake_flow = None
+    flows = [
+        tflow.tflow(), tflow.tflow(resp=True), tflow.tflow(err=True), norequest,
+        tflow.twebsocketflow(), nohandshake, tflow.ttcpflow(),
+    ]
+    assert [view.matchall(f) for f in flows] == [bool(flowfilter.parse(".")(f)) for f in flows]
+
+
 def test_simple():
     v = view.View()
     f = tft(start=1)
@@ -126,6 +140,8 @@ def test_filter():
     with pytest.raises(exceptions.CommandError):
         v.set_filter_cmd("~notafilter regex")
 
+    assert "4 of 4 flows matched" in v.profile_filter()
+
     v[1].marked = True
     v.toggle_marked()
     assert len(v) == 1
@@ -141,6 +157,112 @@ def tdump(path, flows):
             w.add(i)
 
 
+@pytest.mark.asyncio
+async def test_refilter_chunked():
+    v = view.View()
+    v.refilter_chunk = 2
+    progress = []
+    refreshed = []
+
+    def sig_refilter(sender, done, total):
+        progress.append((done, total))
+
+    def sig_refresh(sender):
+        refreshed.append(True)
+
+    v.sig_view_refilter.connect(sig_refilter)
+    v.sig_view_refresh.connect(sig_refresh)
+
+    flows = [tft(method="get" if i % 2 else "put", start=i) for i in range(7)]
+    v.add(flows)
+    v.set_filter(flowfilter.parse("~m get"))
+    # The previous view is shown until refiltering is done.
+    assert len(v) == 7
+    assert not refreshed
+
+    # Flows changed in the meantime are taken into account.
+    added = tft(method="get", start=10)
+    v.add([added])
+    flows[1].request.method = "put"
+    v.update([flows[1]])
+    v.remove([flows[3]])
+    flows[4].request.method = "get"
+    v.update([flows[4]])
+    # They are not matched against the new filter until refiltering is done.
+    assert list(v) == [f for f in flows if f is not flows[3]]
+
+    await v._refilter_task
+    assert progress == [(2, 7), (4, 7), (6, 7), (7, 7)]
+    assert refreshed
+    assert list(v) == [flows[4], flows[5], added]
+    assert not v.refilter_progress
+    assert not v._refilter_task
+
+    # A new refilter replaces one in progress.
+    v.set_filter(flowfilter.parse("~m put"))
+    task = v._refilter_task
+    v.set_filter(None)
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    await v._refilter_task
+    assert len(v) == 7
+
+    v.set_filter(flowfilter.parse("~m put"))
+    v.clear()
+    assert not v._refilter_task
+    assert not len(v)
+
+    # Small stores are refiltered at once.
+    v.add(flows[:2])
+    v.set_filter(flowfilter.parse("~m put"))
+    assert not v._refilter_task
+    assert len(v) == 2
+
+
+def test_add_bulk():
+    v = view.View()
+    v.BULK_ADD = 3
+    signals = []
+
+    def sig_add(sender, flow):
+        signals.append("add")
+
+    def sig_refresh(sender):
+        signals.append("refresh")
+
+    v.sig_view_add.connect(sig_add)
+    v.sig_view_refresh.connect(sig_refresh)
+    v.focus_follow = True
+
+    v.add([tft(start=5)])
+    flows = [tft(start=i) for i in (3, 1, 4, 2)]
+    v.add(flows + flows[:1])
+    assert signals == ["add", "refresh"]
+    assert [f.request.timestamp_start for f in v] == [1, 2, 3, 4, 5]
+    assert v.store_count() == 5
+    assert v.focus.flow is flows[-1]
+    assert all(v.settings[f][v._order_key_name()] == f.request.timestamp_start for f in v)
+
+    v.set_filter(flowfilter.parse("~m put"))
+    v.add([tft(start=i) for i in range(3)])
+    assert v.store_count() == 8
+    assert not len(v)
+    assert signals == ["add", "refresh", "refresh"]
+
+
+@pytest.mark.asyncio
+async def test_add_bulk_refilter():
+    v = view.View()
+    v.refilter_chunk = 2
+    v.BULK_ADD = 3
+    v.add([tft(method="put") for _ in range(5)])
+    v.set_filter(flowfilter.parse("~m get"))
+    v.add([tft(method="get") for _ in range(3)])
+    assert len(v) == 5
+    await v._refilter_task
+    assert len(v) == 3
+
+
 def test_create():
     v = view.View()
     with taddons.context():
@@ -582,3 +704,8 @@ def test_configure():
 
         tctx.configure(v, console_focus_follow=True)
         assert v.focus_follow
+
+        tctx.configure(v, view_refilter_chunk=0)
+        assert v.refilter_chunk == 0
+        with pytest.raises(Exception, match="must not be negative"):
+            tctx.configure(v, view_refilter_chunk=-1)
@@ -1,3 +1,5 @@
+import copy
+
 import pytest
 
 from mitmproxy.coretypes import multidict
@@ -153,6 +155,36 @@ class TestMultiDict:
         md.insert(2, "c", "c")
         assert md.fields == (("a", "a"), ("b", "b"), ("c", "c"))
 
+    def test_index(self):
+        md = self._multi()
+        md.add("bar", "qux")
+        md.add("new", "1")
+        md.set_all("other", ["2", "3"])
+        md.set_all("BAR", ["a", "b", "c"])
+        assert md.get_all("bar") == ["a", "b", "c"]
+        assert md.fields[1:3] == (("bar", "a"), ("Bar", "b"))
+        md.insert(0, "new", "0")
+        assert md.get_all("new") == ["0", "1"]
+        assert list(md) == ["new", "foo", "bar", "other"]
+        del md["foo"]
+        assert md.get_all("other") == ["2", "3"]
+        md.set_all("other", [])
+        md.set_all("missing", [])
+        assert len(md) == 2
+        md.fields = (("x", "y"),)
+        assert md["X"] == "y"
+        assert len(md) == 1
+
+    def test_copy(self):
+        md = self._multi()
+        assert md["foo"] == "bar"
+        c = copy.copy(md)
+        c.add("foo", "baz")
+        c["new"] = "1"
+        assert md.get_all("foo") == ["bar"]
+        assert "new" not in md
+        assert c.get_all("foo") == ["bar", "baz"]
+
     def test_keys(self):
         md = self._multi()
         assert list(md.keys()) == ["foo", "bar"]
@@ -1 +1,294 @@
-# TODO: write tests
+import asyncio
+import io as stdio
+import sys
+import threading
+
+import pytest
+
+from mitmproxy import exceptions
+from mitmproxy import flowfilter
+from mitmproxy import io
+from mitmproxy.io import io as mio
+from mitmproxy.test import tflow
+
+
+def tflows():
+    marked = tflow.tflow(resp=True)
+    marked.marked = True
+    post = tflow.tflow()
+    post.request.method = "POST"
+    post.request.host = "example.com"
+    return [
+        tflow.tflow(resp=True),
+        tflow.tflow(err=True),
+        marked,
+        post,
+        tflow.twebsocketflow(),
+        tflow.ttcpflow(),
+        tflow.ttcpflow(err=True),
+    ]
+
+
+def write(path, flows, mode="wb"):
+    index = io.FlowIndex()
+    if mode == "ab":
+        with open(path, "rb") as f:
+            index = io.FlowIndex.open(path, io.FlowReader(f))
+    with open(path, mode) as f:
+        w = io.FlowWriter(f, index)
+        for i in flows:
+            w.add(i)
+    index.save(path)
+    return index
+
+
+class TestFlowReader:
+    def test_offsets(self):
+        f = stdio.BytesIO()
+        w = io.FlowWriter(f)
+        flows = tflows()
+        for i in flows:
+            w.add(i)
+        f.seek(0)
+        r = io.FlowReader(f)
+        offsets = list(r.stream_offsets())
+        assert [i.id for _, i in offsets] == [i.id for i in flows]
+        for offset, i in reversed(offsets):
+            assert r.read_at(offset).id == i.id
+        with pytest.raises(exceptions.FlowReadException):
+            r.read_at(offsets[1][0] + 1)
+
+    def test_filtered(self):
+        f = stdio.BytesIO()
+        index = io.FlowIndex()
+        w = io.FlowWriter(f, index)
+        for i in tflows():
+            w.add(i)
+        assert index.size == len(f.getvalue())
+        r = io.FlowReader(f)
+        flt = flowfilter.parse("~tcp")
+        f.seek(0)
+        assert len(list(r.filtered(flt))) == 2
+        assert len(list(r.filtered(flt, index))) == 2
+        assert len(list(r.filtered(None, index))) == len(index)
+
+
+class TestFlowIndex:
+    @pytest.mark.parametrize("spec", [
+        "~http", "~tcp", "~websocket", "~e", "~marked", "~q", "~s", "~c 200", "~c 404",
+        "~m post", "~d example", "~d address", "~u path", "~u /nope", "!~s", "~s & ~m get",
+        "~tcp | ~d example", "!~e & !~marked", "!~s | ~marked", "~m get & ~b foo", "~b foo | ~http", "~b foo | ~tcp",
+    ])
+    def test_candidates(self, spec):
+        index = io.FlowIndex()
+        flows = tflows()
+        for offset, f in enumerate(flows):
+            index.add(offset, f)
+        flt = flowfilter.parse(spec)
+        for f, e in zip(flows, index.entries):
+            result = index._match(flt, e)
+            assert result is None or result == bool(flt(f)), (spec, f)
+        candidates = {e.offset for e in index.candidates(flt)}
+        assert all(offset in candidates for offset, f in enumerate(flows) if flt(f))
+
+    def test_undecided(self):
+        index = io.FlowIndex()
+        index.add(0, tflow.tflow(resp=True))
+        assert index._match(flowfilter.parse("~b foo"), index.entries[0]) is None
+        assert index._match(flowfilter.parse("!~b foo"), index.entries[0]) is None
+        assert index._match(flowfilter.parse("~b foo & ~http"), index.entries[0]) is None
+        assert index._match(flowfilter.parse("~b foo & ~tcp"), index.entries[0]) is False
+
+    def test_open(self, tmpdir):
+        p = str(tmpdir.join("flows"))
+        flows = tflows()
+        written = write(p, flows[:3])
+        with open(p, "rb") as f:
+            index = io.FlowIndex.open(p, io.FlowReader(f))
+        assert index.entries == written.entries
+        assert index.size == written.size
+
+        # Flows appended without updating the index are indexed when it is opened.
+        with open(p, "ab") as f:
+            w = io.FlowWriter(f)
+            for i in flows[3:]:
+                w.add(i)
+        with open(p, "rb") as f:
+            index = io.FlowIndex.open(p, io.FlowReader(f))
+        assert [e.id for e in index.entries] == [i.id for i in flows]
+
+        write(p, flows[3:], "ab")
+        with open(p, "rb") as f:
+            assert len(io.FlowIndex.open(p, io.FlowReader(f))) == len(flows) + 4
+
+    def test_open_invalid(self, tmpdir):
+        p = str(tmpdir.join("flows"))
+        flows = tflows()
+        with open(p, "wb") as f:
+            io.FlowWriter(f).add(flows[0])
+        with open(p, "rb") as f:
+            # No index.
+            assert io.FlowIndex.open(p, io.FlowReader(f)) is None
+            with open(mio.index_path(p), "wb") as fi:
+                fi.write(b"garbage")
+            assert io.FlowIndex.open(p, io.FlowReader(f)) is None
+
+        # A different dump of the same size.
+        write(p, flows[:1])
+        with open(p, "wb") as f:
+            io.FlowWriter(f).add(tflow.tflow(resp=True))
+        with open(p, "rb") as f:
+            assert io.FlowIndex.open(p, io.FlowReader(f)) is None
+
+        # The dump is smaller than the index says.
+        write(p, flows)
+        with open(p, "wb") as f:
+            io.FlowWriter(f).add(flows[0])
+        with open(p, "rb") as f:
+            assert io.FlowIndex.open(p, io.FlowReader(f)) is None
+
+
+def test_incremental_reader():
+    f = stdio.BytesIO()
+    w = io.FlowWriter(f)
+    flows = tflows()
+    for i in flows:
+        w.add(i)
+    dump = f.getvalue()
+
+    r = io.IncrementalFlowReader()
+    loaded = []
+    for i in range(0, len(dump), 7):
+        loaded.extend(r.feed(dump[i:i + 7]))
+    r.close()
+    assert [i.id for i in loaded] == [i.id for i in flows]
+    assert not r.buf
+    assert len(io.IncrementalFlowReader().feed(dump)) == len(flows)
+
+    r = io.IncrementalFlowReader()
+    r.feed(dump[:-1])
+    with pytest.raises(exceptions.FlowReadException):
+        r.close()
+    for data in (b"qibble", b"12345678901", b"2:ab,", b"1:a?"):
+        with pytest.raises(exceptions.FlowReadException):
+            io.IncrementalFlowReader().feed(data)
+
+
+def test_record_offsets():
+    f = stdio.BytesIO()
+    w = io.FlowWriter(f)
+    flows = tflows()
+    for i in flows:
+        w.add(i)
+    f.seek(0)
+    expected = [offset for offset, _ in io.FlowReader(f).stream_offsets()]
+    f.seek(0)
+    assert list(mio.record_offsets(f)) == expected
+    # Invalid records are left to the reader to report.
+    f.seek(0, stdio.SEEK_END)
+    f.write(b"qibble")
+    f.seek(0)
+    offsets = list(mio.record_offsets(f))
+    assert offsets[:-1] == expected
+    with pytest.raises(exceptions.FlowReadException):
+        io.FlowReader(f).read_at(offsets[-1])
+
+
+class TestParallelFlowReader:
+    def test_stream(self, tmpdir):
+        p = str(tmpdir.join("flows"))
+        flows = tflows() * 3
+        index = write(p, flows)
+        reader = io.ParallelFlowReader(p, 2, chunk_size=1)
+        assert len(list(reader.chunks())) == len(flows)
+        loaded = list(reader.stream())
+        assert [f.id for f in loaded] == [f.id for f in flows]
+        assert [type(f) for f in loaded] == [type(f) for f in flows]
+        assert loaded[4].get_state() == flows[4].get_state()
+
+        flt = flowfilter.parse("~e")
+        reader = io.ParallelFlowReader(p, 2, flt, index, chunk_size=4096)
+        assert [f.id for f in reader.stream()] == [f.id for f in flows if f.error]
+        assert all(len(c) > 1 for c in io.ParallelFlowReader(p, 2, chunk_size=4096).chunks())
+
+    @pytest.mark.asyncio
+    async def test_stream_async(self, tmpdir):
+        p = str(tmpdir.join("flows"))
+        flows = tflows()
+        write(p, flows)
+        reader = io.ParallelFlowReader(p, 2, chunk_size=1)
+        assert [f.id async for f in reader.stream_async()] == [f.id for f in flows]
+
+    @pytest.mark.asyncio
+    async def test_stream_async_stop(self, tmpdir):
+        p = str(tmpdir.join("flows"))
+        flows = tflows() * 10
+        write(p, flows)
+        reader = io.ParallelFlowReader(p, 1, chunk_size=1)
+        pools = []
+        make_pool = reader._pool
+
+        def pool():
+            pools.append(make_pool())
+            return pools[-1]
+
+        reader._pool = pool
+        stream = reader.stream_async()
+        assert (await stream.__anext__()).id == flows[0].id
+        shutdown = pools[0].shutdown
+        threads = []
+
+        def wait_shutdown(wait=True):
+            threads.append(threading.get_ident())
+            shutdown(wait)
+
+        pools[0].shutdown = wait_shutdown
+        await stream.aclose()
+        # The chunks being decoded are not waited for on the loop.
+        for _ in range(100):
+            if threads:
+                break
+            await asyncio.sleep(0.05)
+        assert threads and threads[0] != threading.get_ident()
+
+    @pytest.mark.skipif(sys.version_info < (3, 7), reason="Requires Python 3.7")
+    def test_spawn(self, tmpdir):
+        # Forking a proxy with running threads risks deadlocks on their locks.
+        with io.ParallelFlowReader(str(tmpdir.join("flows")))._pool() as pool:
+            assert pool._mp_context.get_start_method() == "spawn"
+
+    def test_corrupt(self, tmpdir):
+        p = str(tmpdir.join("flows"))
+        flows = tflows()
+        write(p, flows)
+        with open(p, "ab") as f:
+            f.write(b"qibble")
+        loaded = []
+        with pytest.raises(exceptions.FlowReadException):
+            for f in io.ParallelFlowReader(p, 2).stream():
+                loaded.append(f)
+        assert len(loaded) == len(flows)
+
+
+def test_read_flows_from_paths(tmpdir):
+    p = str(tmpdir.join("flows"))
+    flows = tflows()
+    write(p, flows)
+    assert len(io.read_flows_from_paths([p])) == len(flows)
+    assert [f.id for f in io.read_flows_from_paths([p], flowfilter.parse("~e"))] == [
+        f.id for f in flows if f.error
+    ]
+    # Flows the index rules out are not read.
+    index = write(p, flows)
+    with open(p, "r+b") as f:
+        f.write(b"x" * index.entries[1].offset)
+    assert [f.id for f in io.read_flows_from_paths([p], flowfilter.parse("~e"))] == [
+        f.id for f in flows if f.error
+    ]
+    with pytest.raises(exceptions.FlowReadException):
+        io.read_flows_from_paths([p])
+    with pytest.raises(exceptions.FlowReadException):
+        io.read_flows_from_paths([str(tmpdir.join("nope"))])
+
+    write(p, flows)
+    assert [f.id for f in io.read_flows_from_paths([p], processes=2)] == [f.id for f in flows]
@@ -1,12 +1,14 @@
 from io import BytesIO
 from unittest.mock import Mock
+import socket
 import pytest
 
 from mitmproxy import exceptions
+from mitmproxy.net import tcp
 from mitmproxy.net.http import Headers
 from mitmproxy.net.http.http1.read import (
     read_request, read_response, read_request_head,
-    read_response_head, read_body, connection_close, expected_http_body_size, _get_first_line,
+    read_response_head, read_body, read_body_into, connection_close, expected_http_body_size, _get_first_line,
     _read_request_line, _parse_authority_form, _read_response_line, _check_http_version,
     _read_headers, _read_chunked, get_header_tokens
 )
@@ -142,6 +144,43 @@ class TestReadBody:
         assert list(read_body(rfile, -1, max_chunk_size=1)) == [b"1", b"2", b"3", b"4", b"5", b"6"]
 
 
+class TestReadBodyInto:
+    @staticmethod
+    def _read(rfile, expected_size, limit=None):
+        buf = memoryview(bytearray(4))
+        # Slices are only valid until the next one is read, so we must copy them right away.
+        return [bytes(x) for x in read_body_into(rfile, expected_size, buf, limit)]
+
+    def test_chunked(self):
+        rfile = BytesIO(b"3\r\nfoo\r\n0\r\n\r\nbar")
+        assert self._read(rfile, None) == [b"foo"]
+        assert rfile.read() == b"bar"
+
+    def test_known_size(self):
+        rfile = BytesIO(b"foobarbaz")
+        assert self._read(rfile, 6) == [b"foob", b"ar"]
+        assert rfile.read() == b"baz"
+
+    def test_known_size_limit(self):
+        rfile = BytesIO(b"foobar")
+        with pytest.raises(exceptions.HttpException):
+            self._read(rfile, 3, 2)
+
+    def test_known_size_too_short(self):
+        rfile = BytesIO(b"foo")
+        with pytest.raises(exceptions.HttpException):
+            self._read(rfile, 6)
+
+    def test_unknown_size(self):
+        rfile = BytesIO(b"foobar")
+        assert self._read(rfile, -1) == [b"foob", b"ar"]
+
+    def test_unknown_size_limit(self):
+        rfile = BytesIO(b"foobar")
+        with pytest.raises(exceptions.HttpException):
+            self._read(rfile, -1, 3)
+
+
 def test_connection_close():
     headers = Headers()
     assert connection_close(b"HTTP/1.0", headers)
@@ -352,6 +391,19 @@ class TestReadHeaders:
         headers = self._read(data)
         assert headers.fields == ((b"bar", b""),)
 
+    @pytest.mark.parametrize("data", [
+        b"\r\nbody",
+        b"Header: one\r\nHeader2: two\r\n\r\nbody",
+        b"Header: one\nHeader2: two\n\nbody",
+    ])
+    def test_read_connection(self, data):
+        a, b = socket.socketpair()
+        with a, b:
+            b.sendall(data)
+            headers = _read_headers(tcp.Reader(socket.SocketIO(a, "rb")))
+            assert len(headers.fields) == data.count(b":")
+            assert a.recv(10) == b"body"
+
 
 def test_read_chunked():
     req = treq(content=None)
@@ -4,6 +4,7 @@ import pytest
 
 from mitmproxy.test import tutils
 from mitmproxy.net import http
+from mitmproxy.net.http import message
 
 
 def _test_passthrough_attr(message, attr):
@@ -54,6 +55,37 @@ class TestMessageData:
 
         assert data1 == data2
 
+    def test_lazy_content(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            return b"message"
+
+        data = tutils.tresp().data
+        data.content = message.LazyContent(load, 7)
+        assert not data.content_loaded
+        assert data.headers
+        assert data.content_size == 7
+        assert not loads
+
+        assert data.content == b"message"
+        assert data.content == b"message"
+        assert data.content_loaded
+        assert len(loads) == 1
+
+        # Without a size, the content is loaded to get it.
+        data.content = message.LazyContent(load)
+        assert data.content_size == 7
+        assert data.content_loaded
+        data.content = None
+        assert data.content_size is None
+
+        data.content = message.LazyContent(load, 7)
+        assert data.get_state()["content"] == b"message"
+        data.content = message.LazyContent(load)
+        assert data == tutils.tresp(content=b"message").data
+
 
 class TestMessage:
 
@@ -1,4 +1,6 @@
+import asyncio
 from io import BytesIO
+import os
 import re
 import queue
 import time
@@ -94,6 +96,87 @@ class TestServer(tservers.ServerTestBase):
         self.test_echo()
 
 
+@pytest.mark.asyncio
+async def test_serve_on_loop():
+    loop = asyncio.get_event_loop()
+    s = tservers._TServer(None, queue.Queue(), EchoHandler, ("127.0.0.1", 0))
+    s.serve_on_loop(loop)
+
+    def echo():
+        c = tcp.TCPClient(("127.0.0.1", s.address[1]))
+        with c.connect():
+            c.wfile.write(b"echo!\n")
+            c.wfile.flush()
+            return c.rfile.readline()
+
+    assert await loop.run_in_executor(None, echo) == b"echo!\n"
+    s.shutdown()
+    assert s.loop is None
+
+
+class TestRelay:
+    def socketpairs(self):
+        a, a_peer = socket.socketpair()
+        b, b_peer = socket.socketpair()
+        for x in (a, a_peer, b, b_peer):
+            x.setblocking(False)
+        return a, a_peer, b, b_peer
+
+    @pytest.mark.asyncio
+    async def test_relay(self):
+        loop = asyncio.get_event_loop()
+        a, a_peer, b, b_peer = self.socketpairs()
+        relay = asyncio.ensure_future(tcp.relay(a, b))
+
+        await loop.sock_sendall(a_peer, b"ping")
+        assert await loop.sock_recv(b_peer, 4) == b"ping"
+        a_peer.shutdown(socket.SHUT_WR)
+        assert await loop.sock_recv(b_peer, 4) == b""
+
+        await loop.sock_sendall(b_peer, b"pong")
+        assert await loop.sock_recv(a_peer, 4) == b"pong"
+        b_peer.shutdown(socket.SHUT_WR)
+        assert await loop.sock_recv(a_peer, 4) == b""
+
+        await asyncio.wait_for(relay, 5)
+        assert a.fileno() == b.fileno() == -1
+        a_peer.close()
+        b_peer.close()
+
+    @pytest.mark.asyncio
+    async def test_relay_bulk(self):
+        loop = asyncio.get_event_loop()
+        a, a_peer, b, b_peer = self.socketpairs()
+        # Data that arrives before the relay is set up is passed on as well.
+        await loop.sock_sendall(a_peer, b"early")
+        relay = asyncio.ensure_future(tcp.relay(a, b, bufsize=1024))
+        data = os.urandom(1024 * 1024)
+        send = asyncio.ensure_future(loop.sock_sendall(a_peer, data))
+        received = b""
+        while len(received) < len(data) + 5:
+            received += await loop.sock_recv(b_peer, 65536)
+        await send
+        assert received == b"early" + data
+
+        a_peer.close()
+        assert await loop.sock_recv(b_peer, 4) == b""
+        b_peer.close()
+        await asyncio.wait_for(relay, 5)
+        assert a.fileno() == b.fileno() == -1
+
+    @pytest.mark.asyncio
+    async def test_cancel(self):
+        a, a_peer, b, b_peer = self.socketpairs()
+        relay = asyncio.ensure_future(tcp.relay(a, b))
+        await asyncio.sleep(0)
+        relay.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await relay
+        assert a.fileno() == b.fileno() == -1
+        a_peer.close()
+        b_peer.close()
+
+
 class TestServerBind(tservers.ServerTestBase):
 
     class handler(tcp.BaseHandler):
@@ -763,6 +846,50 @@ class TestFileLike:
         with pytest.raises(exceptions.TlsException):
             s.read(1)
 
+    def test_read_until(self):
+        s = tcp.Reader(BytesIO(b"foo\r\n\r\nbar"))
+        assert s.read_until(re.compile(b"\r\n\r\n")) == b"foo\r\n\r\n"
+        assert s.read_until(re.compile(b"\n")) == b"bar"
+
+    def test_read_until_peek(self):
+        a, b = socket.socketpair()
+        with a, b:
+            s = tcp.Reader(socket.SocketIO(a, "rb"))
+            s.PEEKSIZE = 4
+            b.sendall(b"foobar\nfoo\r\n\r\nbar")
+            assert s.readline() == b"foobar\n"
+            assert s.readline(2) == b"fo"
+            assert s.read_until(re.compile(b"\r\n\r\n")) == b"o\r\n\r\n"
+            # Nothing beyond the match is consumed.
+            assert a.recv(10) == b"bar"
+            b.close()
+            assert s.readline() == b""
+
+    def test_readinto(self):
+        s = tcp.Reader(BytesIO(b"foobar"))
+        s.start_log()
+        buf = memoryview(bytearray(4))
+        assert s.readinto(buf) == 4
+        assert buf == b"foob"
+        assert s.readinto(buf) == 2
+        assert buf[:2] == b"ar"
+        assert s.readinto(buf) == 0
+        assert s.get_log() == b"foobar"
+
+    def test_readinto_error(self):
+        o = mock.MagicMock()
+        o.readinto = mock.MagicMock(side_effect=socket.error)
+        s = tcp.Reader(o)
+        with pytest.raises(exceptions.TcpDisconnect):
+            s.readinto(bytearray(1))
+
+    def test_write_memoryview(self):
+        a, b = socket.socketpair()
+        with a, b:
+            s = tcp.Writer(socket.SocketIO(a, "wb"))
+            s.write(memoryview(b"foobar")[3:])
+            assert b.recv(10) == b"bar"
+
     def test_reader_readline_disconnect(self):
         o = mock.MagicMock()
         o.read = mock.MagicMock(side_effect=socket.error)
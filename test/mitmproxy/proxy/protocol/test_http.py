@@ -1 +1,19 @@
-# TODO: write tests
+from mitmproxy.proxy.protocol import http
+from mitmproxy.test import tflow
+
+
+def test_binds_connection():
+    f = tflow.tflow(resp=True)
+    assert not http.binds_connection(f)
+    f.request.headers["Authorization"] = "Basic dXNlcjpwYXNz"
+    assert not http.binds_connection(f)
+    f.request.headers["Authorization"] = "NTLM TlRMTVNTUAAB"
+    assert http.binds_connection(f)
+
+    f = tflow.tflow(resp=True)
+    f.response.headers["WWW-Authenticate"] = "Negotiate"
+    assert http.binds_connection(f)
+
+    f = tflow.tflow()
+    f.request.headers["Proxy-Authorization"] = "Basic dXNlcjpwYXNz"
+    assert http.binds_connection(f)
@@ -84,6 +84,12 @@ class TestHeadContentLength(tservers.HTTPProxyTest):
 
 class TestStreaming(tservers.HTTPProxyTest):
 
+    @classmethod
+    def get_options(cls):
+        opts = super().get_options()
+        opts.stream_chunk_size = "4k"
+        return opts
+
     @pytest.mark.parametrize('streaming', [True, False])
     def test_streaming(self, streaming):
 
@@ -1,8 +1,10 @@
+import re
+
 import pytest
 
 from mitmproxy import options
 from mitmproxy import exceptions
-from mitmproxy.proxy.config import ProxyConfig
+from mitmproxy.proxy.config import HostMatcher, ProxyConfig
 
 
 class TestProxyConfig:
@@ -17,3 +19,108 @@ class TestProxyConfig:
         opts.certs = [tdata.path("mitmproxy/data/dumpfile-011")]
         with pytest.raises(exceptions.OptionsError, match="Invalid certificate format"):
             ProxyConfig(opts)
+
+    def test_cert_cache(self, tmpdir):
+        opts = options.Options(confdir=str(tmpdir))
+        pc = ProxyConfig(opts)
+        certstore = pc.certstore
+        assert certstore.persist_dir is None
+
+        opts.update(cert_cache_size=5, cert_cache_persist=True)
+        assert pc.certstore is certstore
+        assert certstore.cap == 5
+        assert certstore.persist_dir == str(tmpdir.join("mitmproxy-certs"))
+
+        opts.cert_cache_persist = False
+        assert certstore.persist_dir is None
+
+        opts.certs = []
+        assert pc.certstore is not certstore
+        assert pc.certstore.cap == 5
+
+    def test_cert_prefetch(self, tmpdir):
+        opts = options.Options(confdir=str(tmpdir), upstream_cert=False, cert_prefetch_hosts=["example.com"])
+        pc = ProxyConfig(opts)
+        certstore = pc.certstore
+        certstore.executor.shutdown()
+        assert certstore.prefetched == 1
+        assert certstore.get_cert(b"example.com", [b"example.com"])
+        assert certstore.hits == 1
+
+        certstore.certs.clear()
+        certstore.executor = None
+        opts.ssl_insecure = True
+        assert not certstore.executor
+
+        opts.cert_prefetch_hosts = ["example.com", "example.org"]
+        assert certstore.executor
+        opts.certs = []
+        assert not certstore.executor
+        assert pc.certstore.executor
+        pc.certstore.close()
+
+    def test_cert_prefetch_workers(self, tmpdir):
+        opts = options.Options(confdir=str(tmpdir), cert_prefetch_workers=2)
+        pc = ProxyConfig(opts)
+        assert pc.certstore.workers == 2
+        opts.cert_prefetch_workers = 3
+        assert pc.certstore.workers == 3
+        with pytest.raises(exceptions.OptionsError):
+            opts.cert_prefetch_workers = -1
+
+
+class TestHostMatcher:
+    patterns = [
+        r"^example\.com:443$",
+        r"^(.+\.)?apple\.com:443$",
+        r"^(?:.*\.)?foo\.org:\d+$",
+        r"bar\.net",
+        r"(a)\1",
+        r"(?P<x>x)yz",
+        r"(?P<x>x)zy",
+        r".+:8080",
+    ]
+
+    @pytest.mark.parametrize("host, port", [
+        ("example.com", 443),
+        ("EXAMPLE.com", 443),
+        ("a.example.com", 443),
+        ("example.com", 80),
+        ("apple.com", 443),
+        ("x.y.apple.com", 443),
+        (".apple.com", 443),
+        ("..apple.com", 443),
+        ("xapple.com", 443),
+        ("foo.org", 1),
+        (".foo.org", 5),
+        ("zfoo.org", 5),
+        ("q.bar.net", 1),
+        ("aa", 1),
+        ("xzy", 1),
+        ("x", 8080),
+        ("x", 80),
+        (None, 443),
+    ])
+    def test_equivalent(self, host, port):
+        h = HostMatcher(self.patterns)
+        expected = any(re.search(p, "%s:%s" % (host, port), re.IGNORECASE) for p in self.patterns)
+        assert h((host, port)) == expected
+
+    def test_simple(self):
+        h = HostMatcher(self.patterns)
+        assert set(h.suffixes) == {"example.com", "apple.com", "foo.org"}
+        # Duplicate group names prevent combining the other patterns.
+        assert len(h.remaining) == 5
+        h = HostMatcher(self.patterns[:6])
+        assert len(h.remaining) == 2
+
+    def test_cache(self):
+        h = HostMatcher(self.patterns)
+        assert not h(None)
+        assert not HostMatcher()
+        assert not HostMatcher()(("example.com", 443))
+        assert h(("example.com", 443))
+        assert h(("example.com", 443))
+        assert h.calls == 2
+        assert "cache_hits=1" in repr(h)
+        assert repr(HostMatcher())
@@ -0,0 +1,95 @@
+import socket
+from unittest import mock
+
+from mitmproxy import connections
+from mitmproxy.proxy import pool
+
+
+def tconn(address=("example.com", 80)):
+    a, b = socket.socketpair()
+    c = connections.ServerConnection(address)
+    c.connection = a
+    c._makefile()
+    return c, b
+
+
+class TestConnectionPool:
+    def test_disabled(self):
+        p = pool.ConnectionPool()
+        c, _ = tconn()
+        assert not p.put(c)
+        assert not p.get(p.key(c))
+        assert p.misses == 0
+
+    def test_reuse(self):
+        p = pool.ConnectionPool(max_per_host=1)
+        c, _c = tconn()
+        key = p.key(c)
+        assert key == (("example.com", 80), False, None, None)
+
+        assert not p.get(key)
+        assert p.put(c)
+        assert len(p) == 1
+        # Keep the peers referenced, the health check would notice them going away.
+        full, _full = tconn()
+        other, _other = tconn(("example.org", 80))
+        assert not p.put(full)
+        assert p.put(other)
+
+        assert p.get((("example.net", 80), False, None, None), key) is c
+        assert not p.get(key)
+        assert p.hits == 1
+        assert p.misses == 2
+        assert p.handshakes_saved == 1
+        assert p.hit_rate == 1 / 3
+        assert repr(p)
+
+        c.tls_established = True
+        assert p.put(c)
+        assert p.get(key[:1] + (True,) + key[2:]) is c
+        assert p.handshakes_saved == 3
+
+    def test_health_check(self):
+        p = pool.ConnectionPool(max_per_host=2)
+        c, peer = tconn()
+        assert p.put(c)
+        peer.close()
+        assert not p.get(p.key(c))
+        assert c.finished
+
+        c, peer = tconn()
+        peer.sendall(b"unsolicited")
+        assert not p.put(c)
+
+        c, _ = tconn()
+        c.finish()
+        assert not p.put(c)
+
+    def test_idle_timeout(self):
+        p = pool.ConnectionPool(max_per_host=2, idle_timeout=10)
+        a, _a = tconn()
+        b, _b = tconn(("example.org", 80))
+        with mock.patch("time.time", return_value=0):
+            assert p.put(a)
+        with mock.patch("time.time", return_value=5):
+            assert p.put(b)
+        with mock.patch("time.time", return_value=12):
+            assert not p.get(p.key(a))
+            assert a.finished
+            assert p.get(p.key(b)) is b
+
+            c, _c = tconn()
+            assert p.put(c)
+        # Returning a connection also closes all expired ones.
+        with mock.patch("time.time", return_value=30):
+            assert p.put(b)
+        assert len(p) == 1
+        assert c.finished
+
+    def test_clear(self):
+        p = pool.ConnectionPool(max_per_host=1)
+        c, _c = tconn()
+        assert p.put(c)
+        p.clear()
+        assert len(p) == 0
+        assert c.finished
@@ -135,14 +135,15 @@ class TcpMixin:
         assert not any(f.response.status_code == 305 for f in self.master.state.flows if isinstance(f, http.HTTPFlow))
         assert not any(f.response.status_code == 306 for f in self.master.state.flows if isinstance(f, http.HTTPFlow))
 
-        # Test that we get the original SSL cert
+        # TLS is intercepted before the TCP stream is relayed, and the generated
+        # cert stays cached when tcp_hosts changes.
         if self.ssl:
             i_cert = certs.Cert(i.sslinfo.certchain[0])
             i2_cert = certs.Cert(i2.sslinfo.certchain[0])
             n_cert = certs.Cert(n.sslinfo.certchain[0])
 
             assert i_cert == i2_cert
-            assert i_cert != n_cert
+            assert i_cert == n_cert
 
         # Make sure that TCP messages are in the event log.
         # Re-enable and fix this when we start keeping TCPFlows in the state.
@@ -274,6 +275,16 @@ class TestHTTPS(tservers.HTTPProxyTest, CommonMixin, TcpMixin):
             assert p.request("get:/:i0,'invalid\r\n\r\n'").status_code == 400
 
 
+class TestHTTPSAsyncio(tservers.HTTPProxyTest, CommonMixin, TcpMixin):
+    ssl = True
+
+    @classmethod
+    def get_options(cls):
+        opts = super().get_options()
+        opts.server_asyncio = True
+        return opts
+
+
 class TestHTTPSCertfile(tservers.HTTPProxyTest, CommonMixin):
     ssl = True
     certfile = True
@@ -425,6 +436,81 @@ class TestReverseSSL(tservers.ReverseProxyTest, CommonMixin, TcpMixin):
     ssl = True
 
 
+class PoolMixin:
+    @classmethod
+    def get_options(cls):
+        opts = super().get_options()
+        opts.upstream_pool_size = 1
+        return opts
+
+    def setup(self):
+        super().setup()
+        self.master.server.config.pool.max_per_host = 1
+
+    def teardown(self):
+        # Idle pooled connections would keep the pathod handlers alive,
+        # including those that are only returned after the test has finished.
+        self.master.server.config.pool.max_per_host = 0
+        self.master.server.config.pool.clear()
+        super().teardown()
+
+    def test_pool(self):
+        pool = self.master.server.config.pool
+        pool.clear()
+        hits = pool.hits
+        for _ in range(3):
+            assert self.pathod("200:b@1").status_code == 200
+            # The server connection is returned once the proxy notices the client is gone.
+            for _ in range(100):
+                if len(pool):
+                    break
+                time.sleep(0.01)
+            assert len(pool) == 1
+        assert pool.hits == hits + 2
+
+    def wait_for_release(self):
+        # The proxy releases the server connection once it notices the client is gone.
+        time.sleep(0.2)
+
+    def test_pool_connection_auth(self):
+        pool = self.master.server.config.pool
+        pool.clear()
+        resp = self.pathod('200:h"WWW-Authenticate"="NTLM":b@1')
+        assert resp.status_code == 200
+        self.wait_for_release()
+        assert len(pool) == 0
+
+    def test_pool_proxy_auth(self):
+        class ProxyAuth:
+            # Like the upstream_auth addon.
+            def requestheaders(self, f):
+                f.request.headers["Proxy-Authorization"] = "Basic dXNlcjpwYXNz"
+
+        pool = self.master.server.config.pool
+        pool.clear()
+        self.set_addons(ProxyAuth())
+        assert self.pathod("200:b@1").status_code == 200
+        self.wait_for_release()
+        assert len(pool) == 0
+
+
+class TestHTTPPooled(PoolMixin, tservers.HTTPProxyTest, CommonMixin):
+    pass
+
+
+class TestHTTPSPooled(PoolMixin, tservers.HTTPProxyTest, CommonMixin):
+    ssl = True
+
+
+class TestReversePooled(PoolMixin, tservers.ReverseProxyTest, CommonMixin):
+    reverse = True
+
+
+class TestReverseSSLPooled(PoolMixin, tservers.ReverseProxyTest, CommonMixin):
+    reverse = True
+    ssl = True
+
+
 class TestSocks5(tservers.SocksModeTest):
 
     def test_simple(self):
@@ -539,6 +625,16 @@ class TestTransparent(tservers.TransparentProxyTest, CommonMixin, TcpMixin):
         assert d.content == b"bar"
 
 
+class TestTransparentAsyncio(tservers.TransparentProxyTest, CommonMixin, TcpMixin):
+    ssl = False
+
+    @classmethod
+    def get_options(cls):
+        opts = super().get_options()
+        opts.server_asyncio = True
+        return opts
+
+
 class TestTransparentSSL(tservers.TransparentProxyTest, CommonMixin, TcpMixin):
     ssl = True
 
@@ -738,6 +834,22 @@ class TestStreamRequest(tservers.HTTPProxyTest):
             r1 = p.request("get:'%s/p/201:b@100k'" % self.server.urlbase)
             assert r1.status_code == 201
 
+    def test_stream_buffer(self):
+        self.set_addons(AStreamRequest())
+        self.options.stream_chunk_size = "1k"
+        try:
+            p = self.pathoc()
+            with p.connect():
+                r = p.request("get:'%s/p/201:b@100k'" % self.server.urlbase)
+                assert r.status_code == 201
+                assert len(r.content) == 100 * 1024
+                # Without content-length
+                r = p.request("get:'%s/p/201:r:b@100k:d102400'" % self.server.urlbase)
+                assert r.status_code == 201
+                assert len(r.content) > 100000
+        finally:
+            self.options.stream_chunk_size = "128k"
+
     def test_stream_chunked(self):
         self.set_addons(AStreamRequest())
         connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -790,6 +902,36 @@ class TestServerConnect(tservers.HTTPProxyTest):
         await asyncio.sleep(0.1)
         assert not self.proxy.tmaster.has_log("serverconnect")
 
+    def test_cert_prefetch(self):
+        store = self.master.server.config.certstore
+        # Let prefetches started by earlier tests land before clearing the cache.
+        for pending in list(store.pending.values()):
+            pending.result()
+        store.certs.clear()
+        store.expire_queue.clear()
+        prefetched = store.prefetched
+        assert self.pathod("200").status_code == 200
+        assert store.prefetched == prefetched + 1
+        # The handshake used the prefetched certificate.
+        assert len(store.certs) == 1
+
+
+class TestUpstreamCertPrefetch(tservers.HTTPProxyTest):
+    ssl = True
+
+    def test_cert_prefetch(self):
+        store = self.master.server.config.certstore
+        assert self.pathod("200").status_code == 200
+        for pending in list(store.pending.values()):
+            pending.result()
+        store.certs.clear()
+        store.expire_queue.clear()
+        prefetched = store.prefetched
+        assert self.pathod("200").status_code == 200
+        assert store.prefetched == prefetched + 1
+        # The handshake used the prefetched certificate.
+        assert len(store.certs) == 1
+
 
 class AKillRequest:
 
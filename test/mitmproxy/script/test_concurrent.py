@@ -4,6 +4,7 @@ from mitmproxy.test import tflow
 from mitmproxy.test import taddons
 
 from mitmproxy import controller
+from mitmproxy.script import threadsafe
 import time
 
 from .. import tservers
@@ -57,3 +58,14 @@ class TestConcurrent(tservers.MasterTest):
                     if f1.reply.state == f2.reply.state == "committed":
                         return
                 raise ValueError("Script never acked")
+
+
+def test_threadsafe():
+    def request(f):
+        pass
+    assert threadsafe(request).threadsafe
+
+    def load(l):
+        pass
+    with pytest.raises(NotImplementedError):
+        threadsafe(load)
@@ -4,10 +4,12 @@ from unittest import mock
 
 from mitmproxy import addons
 from mitmproxy import addonmanager
+from mitmproxy import controller
 from mitmproxy import exceptions
 from mitmproxy import options
 from mitmproxy import command
 from mitmproxy import master
+from mitmproxy.script import threadsafe
 from mitmproxy.test import taddons
 from mitmproxy.test import tflow
 
@@ -39,6 +41,19 @@ class THalt:
         raise exceptions.AddonHalt
 
 
+class TThreadsafe:
+    def __init__(self, name, halt=False):
+        self.name = name
+        self.requests = 0
+        self.halt = halt
+
+    @threadsafe
+    def request(self, f):
+        self.requests += 1
+        if self.halt:
+            raise exceptions.AddonHalt
+
+
 class AOption:
     def load(self, l):
         l.add_option("custom_option", bool, False, "help")
@@ -86,6 +101,49 @@ async def test_lifecycle():
     a._configure_all(o, o.keys())
 
 
+@pytest.mark.asyncio
+async def test_lifecycle_inline():
+    o = options.Options()
+    m = master.Master(o)
+    a = addonmanager.AddonManager(m)
+    one, two = TThreadsafe("one", halt=True), TThreadsafe("two")
+    a.add(one)
+    a.add(two)
+
+    f = tflow.tflow()
+    f.reply = controller.Reply(f)
+    # Nothing is known about the event yet.
+    assert not a.handle_lifecycle_inline("request", f)
+    await a.handle_lifecycle("request", f)
+    assert f.reply.q.get() == f
+
+    f.reply = controller.Reply(f)
+    assert a.handle_lifecycle_inline("request", f)
+    assert f.reply.q.get() == f
+    assert one.requests == 2
+    assert two.requests == 0
+
+    # No addon implements requestheaders at all.
+    f.reply = controller.Reply(f)
+    await a.handle_lifecycle("requestheaders", f)
+    f.reply = controller.Reply(f)
+    assert a.handle_lifecycle_inline("requestheaders", f)
+    assert f.reply.state == "committed"
+
+    # Adding an addon with a regular update handler invalidates the cache
+    # and disables inline handling for flows.
+    t = TAddon("update")
+    t.update = mock.Mock()
+    a.add(t)
+    f.reply = controller.Reply(f)
+    assert not a.handle_lifecycle_inline("request", f)
+    await a.handle_lifecycle("request", f)
+    f.reply = controller.Reply(f)
+    assert not a.handle_lifecycle_inline("request", f)
+    await a.handle_lifecycle("request", f)
+    assert t.update.called
+
+
 def test_defaults():
     assert addons.default_addons()
 
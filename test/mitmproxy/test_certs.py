@@ -1,4 +1,6 @@
+import concurrent.futures
 import os
+import threading
 from mitmproxy import certs
 from ..conftest import skip_windows
 
@@ -71,8 +73,7 @@ class TestCertStore:
         assert b"*.baz.com" in cert.altnames
 
     def test_expire(self, tmpdir):
-        ca = certs.CertStore.from_store(str(tmpdir), "test")
-        ca.STORE_CAP = 3
+        ca = certs.CertStore.from_store(str(tmpdir), "test", 3)
         ca.get_cert(b"one.com", [])
         ca.get_cert(b"two.com", [])
         ca.get_cert(b"three.com", [])
@@ -89,11 +90,151 @@ class TestCertStore:
 
         ca.get_cert(b"four.com", [])
 
-        assert (b"one.com", ()) not in ca.certs
-        assert (b"two.com", ()) in ca.certs
+        # one.com has been used more recently than two.com
+        assert (b"one.com", ()) in ca.certs
+        assert (b"two.com", ()) not in ca.certs
         assert (b"three.com", ()) in ca.certs
         assert (b"four.com", ()) in ca.certs
 
+        assert ca.hits == 1
+        assert ca.misses == 4
+        assert repr(ca)
+
+        ca.set_cap(2)
+        assert len(ca.certs) == 2
+        ca.get_cert(b"five.com", [])
+        assert len(ca.certs) == 2
+        assert (b"four.com", ()) in ca.certs
+
+    def test_persist(self, tmpdir):
+        ca = certs.CertStore.from_store(str(tmpdir.join("ca")), "test")
+        ca.persist_dir = str(tmpdir.join("ca", "leafs"))
+        c1 = ca.get_cert(b"foo.com", [b"foo.com"])[0]
+        assert len(tmpdir.join("ca", "leafs").listdir()) == 1
+
+        ca2 = certs.CertStore.from_store(str(tmpdir.join("ca")), "test")
+        ca2.persist_dir = ca.persist_dir
+        assert ca2.get_cert(b"foo.com", [b"foo.com"])[0] == c1
+        assert ca2.disk_hits == 1
+        ca2.certs.clear()
+        assert not ca2.get_cert(b"foo.com", [b"foo.com"], b"Org")[0] == c1
+        assert ca2.disk_hits == 1
+
+        # Certs signed by another CA are not picked up.
+        other = certs.CertStore.from_store(str(tmpdir.join("other")), "test")
+        other.persist_dir = ca.persist_dir
+        assert not other.get_cert(b"foo.com", [b"foo.com"])[0] == c1
+        assert other.disk_hits == 0
+
+        for f in tmpdir.join("ca", "leafs").listdir():
+            f.write(b"garbage")
+        ca3 = certs.CertStore.from_store(str(tmpdir.join("ca")), "test")
+        ca3.persist_dir = ca.persist_dir
+        assert ca3.get_cert(b"foo.com", [b"foo.com"])
+        assert ca3.disk_hits == 0
+
+        ca3.persist_dir = str(tmpdir.join("ca", "test-ca.pem", "invalid"))
+        assert ca3.get_cert(b"bar.com", [])
+
+    def test_persist_prune(self, tmpdir, monkeypatch):
+        monkeypatch.setattr(certs.CertStore, "PERSIST_CAP", 10)
+        leafs = tmpdir.join("leafs")
+        ca = certs.CertStore.from_store(str(tmpdir), "test")
+        ca.persist_dir = str(leafs)
+        for i in range(10):
+            ca.get_cert(b"%d.com" % i, [])
+            os.utime(ca._persist_path((b"%d.com" % i, ()), None), (i, i))
+        assert len(leafs.listdir()) == 10
+
+        ca.certs.clear()
+        ca.get_cert(b"0.com", [])
+        assert ca.disk_hits == 1
+
+        ca.get_cert(b"10.com", [])
+        assert len(leafs.listdir()) == 9
+        # 0.com has been used more recently than 1.com
+        ca.certs.clear()
+        ca.get_cert(b"0.com", [])
+        ca.get_cert(b"1.com", [])
+        assert ca.disk_hits == 2
+
+    def test_sans_order(self, tmpdir):
+        ca = certs.CertStore.from_store(str(tmpdir), "test")
+        c1 = ca.get_cert(b"foo.com", [b"a.com", b"b.com", b"a.com"])
+        c2 = ca.get_cert(b"foo.com", [b"b.com", b"a.com"])
+        assert c1 == c2
+        assert ca.hits == 1
+
+    def test_prefetch(self, tmpdir):
+        ca = certs.CertStore.from_store(str(tmpdir), "test")
+        ca.prefetch(b"foo.com", [b"foo.com"])
+        ca.executor.shutdown()
+        assert not ca.pending
+        assert ca.prefetched == 1
+
+        ca.get_cert(b"foo.com", [b"foo.com"])
+        assert ca.hits == 1
+        assert ca.misses == 0
+
+        # Nothing to do for certs that are already cached.
+        ca.prefetch(b"foo.com", [b"foo.com"])
+        assert not ca.pending
+
+    def test_prefetch_upstream(self, tmpdir):
+        ca = certs.CertStore.from_store(str(tmpdir), "test", 1)
+        ca.prefetch_upstream(b"foo.com")
+        assert not ca.pending
+
+        ca.add_upstream_hint(b"foo.com", b"foo.com", [b"foo.com", b"*.foo.com"], b"Foo")
+        ca.add_upstream_hint(b"bar.com", b"bar.com", [b"bar.com"], None)
+        ca.get_cert(b"foo.com", [b"foo.com", b"*.foo.com"], b"Foo")
+        ca.get_cert(b"bar.com", [b"bar.com"])
+        ca.prefetch_upstream(b"foo.com")
+        ca.executor.shutdown()
+        ca.close()
+        assert not ca.executor
+        assert ca.prefetched == 1
+        ca.get_cert(b"foo.com", [b"*.foo.com", b"foo.com"], b"Foo")
+        assert ca.hits == 1
+
+        for i in range(20):
+            ca.add_upstream_hint(b"%d.com" % i, None, [], None)
+        assert len(ca.upstream_hints) == 10
+        assert b"foo.com" not in ca.upstream_hints
+
+    def test_prefetch_workers(self, tmpdir):
+        ca = certs.CertStore.from_store(str(tmpdir), "test", 2)
+        assert ca.workers == (os.cpu_count() or 1)
+        ca.set_workers(3)
+        release = threading.Event()
+        create_entry = ca._create_entry
+
+        def slow_create_entry(key, organization):
+            release.wait()
+            return create_entry(key, organization)
+
+        ca._create_entry = slow_create_entry
+        for host in (b"a.com", b"b.com", b"c.com"):
+            ca.prefetch(host, [host])
+        assert ca.executor._max_workers == 3
+        # No more than fit in the cache are queued.
+        assert len(ca.pending) == 2
+        release.set()
+        ca.executor.shutdown()
+        assert ca.prefetched == 2
+
+        ca.set_workers(0)
+        assert not ca.executor
+        assert ca.workers == (os.cpu_count() or 1)
+
+    def test_prefetch_pending(self, tmpdir):
+        ca = certs.CertStore.from_store(str(tmpdir), "test")
+        f = concurrent.futures.Future()
+        ca.pending[(b"foo.com", ())] = f
+        entry = certs.CertStoreEntry(ca.get_cert(b"bar.com", [])[0], None, None)
+        f.set_result(entry)
+        assert ca.get_cert(b"foo.com", [])[0] is entry.cert
+
     def test_overrides(self, tmpdir):
         ca1 = certs.CertStore.from_store(str(tmpdir.join("ca1")), "test")
         ca2 = certs.CertStore.from_store(str(tmpdir.join("ca2")), "test")
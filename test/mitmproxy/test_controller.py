@@ -5,6 +5,7 @@ import pytest
 from mitmproxy.exceptions import Kill, ControlException
 from mitmproxy import controller
 from mitmproxy.test import taddons
+from mitmproxy.test import tflow
 import mitmproxy.ctx
 
 
@@ -26,6 +27,24 @@ async def test_master():
         assert ctx.master.should_exit.is_set()
 
 
+@pytest.mark.asyncio
+async def test_ask_inline():
+    with taddons.context(loadcore=False) as ctx:
+        f = tflow.tflow()
+        f.reply = controller.DummyReply()
+        await ctx.master.addons.handle_lifecycle("requestheaders", f)
+
+        assert ctx.master.channel.ask("requestheaders", f) is f
+        stats = ctx.master.channel.stats["requestheaders"]
+        assert stats.count == stats.inline == 1
+        assert stats.max >= stats.mean > 0
+        assert repr(stats)
+
+        ctx.master.channel.tell("requestheaders", f)
+        assert f.reply.state == "committed"
+        assert ctx.master.channel.stats["requestheaders"].count == 1
+
+
 class TestReply:
     def test_simple(self):
         reply = controller.Reply(42)
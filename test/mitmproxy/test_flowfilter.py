@@ -552,6 +552,54 @@ class TestMatchingDummyFlow:
         assert not self.q("~q", f)
 
 
+class TestEvaluation:
+
+    def test_cost_order(self):
+        a = flowfilter.parse("~b foo & ~m get | ~c 200")
+        inner = a.lst[0]
+        assert [type(i) for i in inner.lst] == [flowfilter.FBod, flowfilter.FMethod]
+        assert [type(i) for i in inner.ordered] == [flowfilter.FMethod, flowfilter.FBod]
+        assert [type(i) for i in a.ordered] == [flowfilter.FCode, flowfilter.FAnd]
+        assert flowfilter.parse("!~b foo").cost == flowfilter.FBod.cost
+
+    def test_cached(self):
+        f = tflow.tflow(resp=True)
+        f.request.content = b"foo"
+        flt = flowfilter.parse("~bq foo")
+        with patch.object(f.request, "get_content", wraps=f.request.get_content) as get_content:
+            assert flt(f)
+            assert flt(f)
+            assert flowfilter.parse("~bq foo")(f)
+            assert get_content.call_count == 1
+            assert not flowfilter.parse("~bq bar")(f)
+            assert get_content.call_count == 2
+
+            f.request.content = b"bar"
+            assert not flt(f)
+            f.request.encode("gzip")
+            assert not flt(f)
+            assert get_content.call_count == 4
+
+        f = tflow.ttcpflow()
+        flt = flowfilter.parse("~b hello")
+        assert flt(f)
+        f.messages[0].content = b"bye"
+        f.messages[1].content = b"bye"
+        assert not flt(f)
+
+    def test_profile(self):
+        flows = [tflow.tflow(), tflow.tflow(resp=True)]
+        flows[0].request.method = "POST"
+        report = flowfilter.profile(flowfilter.parse("!(~b foo & ~m get)"), flows)
+        lines = report.splitlines()
+        assert "FNot" in lines[1]
+        assert lines[3].split()[0] == "2"
+        assert "FMethod get" in lines[3]
+        assert lines[4].split()[0] == "1"
+        assert "FBod foo" in lines[4]
+        assert lines[-1] == "2 of 2 flows matched."
+
+
 @patch('traceback.extract_tb')
 def test_pyparsing_bug(extract_tb):
     """https://github.com/mitmproxy/mitmproxy/issues/1087"""
@@ -1,4 +1,9 @@
+import threading
+
+import pytest
+
 from mitmproxy import log
+from mitmproxy.test import taddons
 
 
 def test_logentry():
@@ -9,3 +14,12 @@ def test_logentry():
     assert e == e
     assert e != f
     assert e != 42
+
+
+@pytest.mark.asyncio
+async def test_log_from_thread():
+    with taddons.context() as tctx:
+        t = threading.Thread(target=tctx.master.log.info, args=("from thread",))
+        t.start()
+        t.join()
+        assert await tctx.master.await_log("from thread")
@@ -35,6 +35,10 @@ def test_statusbar(monkeypatch):
     bar = statusbar.StatusBar(m)  # this already causes a redraw
     assert bar.ib._w
 
+    m.view.refilter_progress = (1, 4)
+    m.view.sig_view_refilter.send(m.view, done=1, total=4)
+    assert "[filtering:25%]" in bar.get_status()
+
 
 @pytest.mark.parametrize("message,ready_message", [
     ("", [(None, ""), ("warn", "")]),
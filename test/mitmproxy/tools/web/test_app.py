@@ -3,12 +3,14 @@ import logging
 from unittest import mock
 import os
 import asyncio
+from io import BytesIO
 
 import pytest
 import tornado.testing
 from tornado import httpclient
 from tornado import websocket
 
+from mitmproxy import io
 from mitmproxy import options
 from mitmproxy.test import tflow
 from mitmproxy.tools.web import app
@@ -76,10 +78,92 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
         assert json(resp)[0]["request"]["contentHash"]
         assert json(resp)[1]["error"]
 
+    def test_flows_paginated(self):
+        for _ in range(3):
+            self.view.add([tflow.tflow()])
+        ids = [f.id for f in self.view]
+        resp = json(self.fetch("/flows?limit=2"))
+        assert [f["id"] for f in resp["flows"]] == ids[:2]
+        assert resp["next"] == ids[1]
+        assert resp["seq"] == self.master.flow_changes.seq
+        resp = json(self.fetch("/flows?limit=2&after=" + resp["next"]))
+        assert [f["id"] for f in resp["flows"]] == ids[2:4]
+        resp = json(self.fetch("/flows?limit=2&after=" + resp["next"]))
+        assert [f["id"] for f in resp["flows"]] == ids[4:]
+        assert resp["next"] is None
+        assert len(json(self.fetch("/flows?after=" + ids[0]))["flows"]) == 4
+
+        self.view.remove([self.view.get_by_id(ids[-1])])
+        assert self.fetch("/flows?after=" + ids[-1]).code == 410
+        assert self.fetch("/flows?limit=-1").code == 400
+        assert self.fetch("/flows?limit=0").code == 400
+        assert self.fetch("/flows?limit=foo").code == 400
+        self.view.remove(self.view[2:])
+
+    def test_flows_fields(self):
+        resp = json(self.fetch("/flows?fields=request.method,response.status_code,error.msg,nope.nope"))
+        assert resp == [
+            {"id": "42", "request": {"method": "GET"}, "response": {"status_code": 200}},
+            {"id": self.view[1].id, "request": {"method": "GET"}, "error": {"msg": "error"}},
+        ]
+
+    def test_flows_since(self):
+        seq = json(self.fetch("/flows?limit=1"))["seq"]
+        assert json(self.fetch("/flows?since=%d" % seq)) == {"flows": [], "removed": [], "seq": seq}
+
+        added = tflow.tflow()
+        self.view.add([added])
+        f = self.view.get_by_id("42")
+        self.view.remove([f])
+        resp = json(self.fetch("/flows?since=%d&fields=marked" % seq))
+        assert resp["flows"] == [{"id": added.id, "marked": False}]
+        assert resp["removed"] == ["42"]
+        assert resp["seq"] == seq + 2
+
+        self.view.add([f])
+        self.view.remove([added])
+        resp = json(self.fetch("/flows?since=%d" % seq))
+        assert [i["id"] for i in resp["flows"]] == ["42"]
+        assert resp["removed"] == [added.id]
+
+        # Changes from before a refresh are not known.
+        self.view.set_filter(None)
+        assert json(self.fetch("/flows?since=%d" % seq))["reset"]
+        assert json(self.fetch("/flows?since=%d" % (seq + 1000)))["reset"]
+
     def test_flows_dump(self):
         resp = self.fetch("/flows/dump")
         assert b"address" in resp.body
 
+        ids = [f.id for f in self.view]
+        with mock.patch.object(app.DumpFlows, "CHUNK_SIZE", 1):
+            resp = self.fetch("/flows/dump")
+        assert [f.id for f in io.FlowReader(BytesIO(resp.body)).stream()] == ids
+        dump = resp.body
+
+        self.view.clear()
+        assert self.fetch("/flows/dump", method="POST", body=dump).code == 200
+        assert [f.id for f in self.view] == ids
+
+        body = (
+            b'--foo\r\nContent-Disposition: form-data; name="bar"\r\n\r\nbaz\r\n'
+            b'--foo\r\nContent-Disposition: form-data; name="file"; filename="flows"\r\n'
+            b'Content-Type: application/octet-stream\r\n\r\n' + dump + b'\r\n--foo--\r\n'
+        )
+        self.view.clear()
+        assert self.fetch(
+            "/flows/dump", method="POST", body=body,
+            headers={"Content-Type": "multipart/form-data; boundary=foo"}
+        ).code == 200
+        assert [f.id for f in self.view] == ids
+
+        assert self.fetch(
+            "/flows/dump", method="POST", body=body, headers={"Content-Type": "multipart/form-data"}
+        ).code == 400
+        assert self.fetch("/flows/dump", method="POST", body=dump[:-1]).code == 400
+        assert self.fetch("/flows/dump", method="POST", body=b"qibble" + dump).code == 400
+        assert not len(self.view)
+
     def test_clear(self):
         events = self.events.data.copy()
         flows = list(self.view)
@@ -317,6 +401,39 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
         ws_client2 = yield websocket.websocket_connect(ws_url)
         ws_client2.close()
 
+    @tornado.testing.gen_test
+    def test_websocket_flows(self):
+        ws_url = "ws://localhost:{}/updates".format(self.get_http_port())
+        ws_client = yield websocket.websocket_connect(ws_url)
+
+        f = tflow.tflow()
+        self.view.add([f])
+        for _ in range(10):
+            f.marked = not f.marked
+            self.view.update([f])
+        self.view.remove([self.view.get_by_id("42")])
+
+        messages = _json.loads((yield ws_client.read_message()))
+        assert [(m["cmd"], m["data"] if m["cmd"] == "remove" else m["data"]["id"]) for m in messages] == [
+            ("add", f.id),
+            ("remove", "42"),
+        ]
+        assert messages[0]["data"]["marked"] == f.marked
+        ws_client.close()
+
+    @tornado.testing.gen_test
+    def test_websocket_refilter(self):
+        ws_url = "ws://localhost:{}/updates".format(self.get_http_port())
+        ws_client = yield websocket.websocket_connect(ws_url)
+
+        self.view.sig_view_refilter.send(self.view, done=2, total=7)
+        assert _json.loads((yield ws_client.read_message())) == {
+            "resource": "flows",
+            "cmd": "refilter",
+            "data": {"done": 2, "total": 7},
+        }
+        ws_client.close()
+
     def _test_generate_tflow_js(self):
         _tflow = app.flow_to_json(tflow.tflow(resp=True, err=True))
         # Set some value as constant, so that _tflow.js would not change every time.
@@ -333,3 +450,89 @@ class TestApp(tornado.testing.AsyncHTTPTestCase):
         content = """export default function(){{\n    return {tflow_json}\n}}""".format(tflow_json=tflow_json)
         with open(tflow_path, 'w', newline="\n") as f:
             f.write(content)
+
+
+def test_multipart_file():
+    data = b"--foo\r\n--fo\r\n-foo\r\n"
+    body = (
+        b'preamble\r\n--foo\r\nContent-Disposition: form-data; name="file"; filename="x"\r\n\r\n' +
+        data + b'\r\n--foo\r\nContent-Disposition: form-data; name="file"; filename="y"\r\n\r\nnope'
+        b'\r\n--foo--\r\n'
+    )
+    m = app.MultipartFile(b"foo")
+    assert b"".join(m.feed(body[i:i + 1]) for i in range(len(body))) == data
+    m = app.MultipartFile(b"foo")
+    assert m.feed(body) == data
+
+
+def test_flow_changes():
+    changes = app.FlowChanges(max_removed=2)
+    flows = [tflow.tflow() for _ in range(4)]
+    for f in flows:
+        changes.add(f)
+    assert changes.since(0) == (flows, [])
+    changes.update(flows[0])
+    assert changes.since(4) == ([flows[0]], [])
+    for f in flows[1:]:
+        changes.remove(f)
+    # Only the last two removals are remembered.
+    assert changes.since(5) is None
+    assert changes.since(6) == ([], [flows[2].id, flows[3].id])
+    changes.add(flows[3])
+    assert changes.removed == 1
+    assert changes.since(7) == ([flows[3]], [])
+
+
+class TestFlowUpdates:
+    class Conn:
+        def __init__(self):
+            self.messages = []
+
+        def write_message(self, message):
+            self.messages.append(_json.loads(message))
+
+    class Broadcaster(app.WebSocketEventBroadcaster):
+        connections: set = set()
+
+    @pytest.mark.asyncio
+    async def test_coalesce(self):
+        conn = self.Conn()
+        self.Broadcaster.connections = {conn}
+        u = app.FlowUpdates(self.Broadcaster, 0.01)
+        added, updated, removed = tflow.tflow(), tflow.tflow(), tflow.tflow()
+        u.add(added)
+        u.update(updated)
+        u.update(added)
+        u.remove(removed)
+        u.update(updated)
+        readded = tflow.tflow()
+        u.remove(readded)
+        u.add(readded)
+        transient = tflow.tflow()
+        u.add(transient)
+        u.remove(transient)
+        assert not conn.messages
+
+        with mock.patch("mitmproxy.tools.web.app.flow_to_json", wraps=app.flow_to_json) as to_json:
+            await asyncio.sleep(0.05)
+            assert to_json.call_count == 3
+        assert len(conn.messages) == 1
+        assert [(m["cmd"], m["data"] if m["cmd"] == "remove" else m["data"]["id"]) for m in conn.messages[0]] == [
+            ("add", added.id),
+            ("update", updated.id),
+            ("remove", removed.id),
+            ("update", readded.id),
+        ]
+
+        u.update(added)
+        u.reset()
+        u.add(updated)
+        await asyncio.sleep(0.05)
+        assert [m["cmd"] for m in conn.messages[1]] == ["reset", "add"]
+
+        # Nothing is queued without clients, they fetch all flows when they connect.
+        self.Broadcaster.connections = set()
+        u.add(added)
+        u.reset()
+        assert not u.pending
+        assert not u.handle
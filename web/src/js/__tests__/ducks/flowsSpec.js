@@ -18,10 +18,18 @@ describe('flow reducer', () => {
             filter: null,
             sort: { column: null, desc: false },
             selected: [],
+            refilter: null,
             ...reduceStore(undefined, {})
         })
     })
 
+    it('should track refilter progress until the flows are received again', () => {
+        let refiltering = reduceFlows(state, { type: flowActions.REFILTER, data: { done: 2, total: 7 }, cmd: 'refilter' })
+        expect(refiltering.refilter).toEqual({ done: 2, total: 7 })
+        expect(refiltering.list).toEqual(state.list)
+        expect(reduceFlows(refiltering, { type: flowActions.RECEIVE, data: [], cmd: 'receive' }).refilter).toBeNull()
+    })
+
     describe('selections', () => {
         it('should be possible to select a single flow', () => {
             expect(reduceFlows(state, flowActions.select(2))).toEqual(
@@ -19,7 +19,7 @@ export default class WebsocketBackend {
         this.socket = new WebSocket(location.origin.replace('http', 'ws') + '/updates')
         this.socket.addEventListener('open', () => this.onOpen())
         this.socket.addEventListener('close', event => this.onClose(event))
-        this.socket.addEventListener('message', msg => this.onMessage(JSON.parse(msg.data)))
+        this.socket.addEventListener('message', msg => this.onMessages(JSON.parse(msg.data)))
         this.socket.addEventListener('error', error => this.onError(error))
     }
 
@@ -43,6 +43,15 @@ export default class WebsocketBackend {
             })
     }
 
+    onMessages(data) {
+        // Flow updates arrive in batches.
+        if (Array.isArray(data)) {
+            data.forEach(msg => this.onMessage(msg))
+        } else {
+            this.onMessage(data)
+        }
+    }
+
     onMessage(msg) {
 
         if (msg.cmd === CMD_RESET) {
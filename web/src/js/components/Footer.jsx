@@ -6,9 +6,10 @@ import HideInStatic from '../components/common/HideInStatic'
 
 Footer.propTypes = {
     settings: PropTypes.object.isRequired,
+    refilter: PropTypes.object,
 }
 
-function Footer({ settings }) {
+function Footer({ settings, refilter }) {
     let {mode, intercept, showhost, no_upstream_cert, rawtcp, http2, websocket, anticache, anticomp,
             stickyauth, stickycookie, stream_large_bodies, listen_host, listen_port, version, server} = settings;
     return (
@@ -49,6 +50,11 @@ function Footer({ settings }) {
             {stream_large_bodies && (
                 <span className="label label-success">stream: {formatSize(stream_large_bodies)}</span>
             )}
+            {refilter && refilter.done < refilter.total && (
+                <span className="label label-info">
+                    filtering: {Math.floor(100 * refilter.done / refilter.total)}%
+                </span>
+            )}
             <div className="pull-right">
                 <HideInStatic>
                 {
@@ -69,5 +75,6 @@ function Footer({ settings }) {
 export default connect(
     state => ({
         settings: state.settings,
+        refilter: state.flows.refilter,
     })
 )(Footer)
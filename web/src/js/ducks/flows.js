@@ -13,6 +13,7 @@ export const SET_FILTER     = 'FLOWS_SET_FILTER'
 export const SET_SORT       = 'FLOWS_SET_SORT'
 export const SET_HIGHLIGHT  = 'FLOWS_SET_HIGHLIGHT'
 export const REQUEST_ACTION = 'FLOWS_REQUEST_ACTION'
+export const REFILTER       = 'FLOWS_REFILTER'
 
 
 const defaultState = {
@@ -20,6 +21,7 @@ const defaultState = {
     filter: null,
     sort: { column: null, desc: false },
     selected: [],
+    refilter: null,
     ...reduceStore(undefined, {})
 }
 
@@ -58,9 +60,17 @@ export default function reduce(state = defaultState, action) {
             return {
                 ...state,
                 selected,
+                // All flows are fetched again once refiltering is done.
+                refilter: action.type === RECEIVE ? null : state.refilter,
                 ...reduceStore(state, storeAction)
             }
 
+        case REFILTER:
+            return {
+                ...state,
+                refilter: action.data
+            }
+
         case SET_FILTER:
             return {
                 ...state,